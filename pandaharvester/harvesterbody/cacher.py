@@ -58,18 +58,34 @@ class Cacher(AgentBase):
                 if subKey == "":
                     subKey = None
                 # check last update time
-                lastUpdateTime = self.dbProxy.get_cache_last_update_time(mainKey, subKey)
+                cacheMeta = self.dbProxy.get_cache_meta(mainKey, subKey)
+                if cacheMeta is None:
+                    cacheMeta = dict()
+                lastUpdateTime = cacheMeta.get("lastUpdate")
                 if (not force_update) and lastUpdateTime is not None and lastUpdateTime > timeLimit:
                     return
+                # validators of the cached data for conditional fetch, unless forced or the dump file is missing
+                validators = dict()
+                if not force_update and (dumpFile is None or os.path.exists(dumpFile)):
+                    validators["etag"] = cacheMeta.get("etag")
+                    validators["lastModified"] = cacheMeta.get("lastModified")
                 # get information
-                tmpStat, newInfo = self.get_data(infoURL, mainLog)
+                tmpStat, newInfo = self.get_data(infoURL, mainLog, validators)
                 if tmpStat:
                     mainLog.debug(f"got data for key={mainKey} subKey={subKey} from {infoURL}")
                 else:
                     mainLog.error(f"failed to get info for key={mainKey} subKey={subKey}")
                     return
+                if validators.get("notModified"):
+                    # only update time if not modified
+                    tmpStat = self.dbProxy.touch_cache(mainKey, subKey, validators.get("etag"), validators.get("lastModified"))
+                    if tmpStat:
+                        mainLog.debug(f"not modified key={mainKey} subKey={subKey}")
+                    else:
+                        mainLog.error(f"failed to touch key={mainKey} subKey={subKey} due to a DB error")
+                    return
                 # update
-                tmpStat = self.dbProxy.refresh_cache(mainKey, subKey, newInfo)
+                tmpStat = self.dbProxy.refresh_cache(mainKey, subKey, newInfo, validators.get("etag"), validators.get("lastModified"))
                 if tmpStat:
                     mainLog.debug(f"refreshed key={mainKey} subKey={subKey}")
                     if dumpFile is not None:
@@ -94,9 +110,9 @@ class Cacher(AgentBase):
                     _refresh_cache(inputs)
             mainLog.debug("done")
 
-    # get new data
-
-    def get_data(self, info_url, tmp_log):
+    # get new data. validators is a dict of etag and lastModified of the cached data to fetch http(s) data conditionally.
+    # It is updated with the validators of new data, or notModified=True is set with retVal=None if the data is not modified
+    def get_data(self, info_url, tmp_log, validators=None):
         retStat = False
         retVal = None
         # resolve env variable
@@ -118,48 +134,51 @@ class Cacher(AgentBase):
                         pass
             except Exception:
                 core_utils.dump_error_message(tmp_log)
-        elif info_url.startswith("http:"):
+        elif info_url.startswith("http:") or info_url.startswith("https:"):
+            # conditional fetch
+            headers = dict()
+            if validators:
+                if validators.get("etag"):
+                    headers["If-None-Match"] = validators["etag"]
+                if validators.get("lastModified"):
+                    headers["If-Modified-Since"] = validators["lastModified"]
             try:
-                res = requests.get(info_url, timeout=60)
-                if res.status_code == 200:
-                    try:
-                        retVal = res.json()
-                    except Exception:
-                        errMsg = f"corrupted json from {info_url} : {res.text}"
-                        tmp_log.error(errMsg)
+                if info_url.startswith("http:"):
+                    res = requests.get(info_url, headers=headers, timeout=60)
                 else:
-                    errMsg = f"failed to get {info_url} with StatusCode={res.status_code} {res.text}"
-                    tmp_log.error(errMsg)
-            except requests.exceptions.ReadTimeout:
-                tmp_log.error(f"read timeout when getting data from {info_url}")
-            except Exception:
-                core_utils.dump_error_message(tmp_log)
-        elif info_url.startswith("https:"):
-            try:
-                try:
-                    # try with pandacon certificate
-                    cert_file = harvester_config.pandacon.cert_file
-                    key_file = harvester_config.pandacon.key_file
-                    ca_cert = harvester_config.pandacon.ca_cert
-                    if ca_cert is False:
-                        cert = None
-                    else:
-                        cert = (cert_file, key_file)
-                    res = requests.get(info_url, cert=cert, verify=ca_cert, timeout=60)
-                except requests.exceptions.SSLError:
-                    # try without certificate
-                    res = requests.get(info_url, timeout=60)
+                    try:
+                        # try with pandacon certificate
+                        cert_file = harvester_config.pandacon.cert_file
+                        key_file = harvester_config.pandacon.key_file
+                        ca_cert = harvester_config.pandacon.ca_cert
+                        if ca_cert is False:
+                            cert = None
+                        else:
+                            cert = (cert_file, key_file)
+                        res = requests.get(info_url, headers=headers, cert=cert, verify=ca_cert, timeout=60)
+                    except requests.exceptions.SSLError:
+                        # try without certificate
+                        res = requests.get(info_url, headers=headers, timeout=60)
             except requests.exceptions.ReadTimeout:
                 tmp_log.error(f"read timeout when getting data from {info_url}")
             except Exception:
                 core_utils.dump_error_message(tmp_log)
             else:
-                if res.status_code == 200:
+                if res.status_code == 304 and headers:
+                    tmp_log.debug(f"not modified {info_url}")
+                    validators["notModified"] = True
+                    retStat = True
+                elif res.status_code == 200:
                     try:
                         retVal = res.json()
                     except Exception:
                         errMsg = f"corrupted json from {info_url} : {res.text}"
                         tmp_log.error(errMsg)
+                    else:
+                        # validators of the new data
+                        if validators is not None:
+                            validators["etag"] = res.headers.get("ETag")
+                            validators["lastModified"] = res.headers.get("Last-Modified")
                 else:
                     errMsg = f"failed to get {info_url} with StatusCode={res.status_code} {res.text}"
                     tmp_log.error(errMsg)
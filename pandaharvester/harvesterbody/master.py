@@ -235,7 +235,7 @@ class Master(object):
             tmp_log.debug("starting Service Monitor thread")
             from pandaharvester.harvesterbody.service_monitor import ServiceMonitor
 
-            thr = ServiceMonitor(options.pid, single_mode=self.singleMode)
+            thr = ServiceMonitor(options.pid, single_mode=self.singleMode, communicator_pool=self.communicatorPool)
             thr.set_stop_event(self.stopEvent)
             thr.start()
             thrList.append(thr)
@@ -96,6 +96,7 @@ class Monitor(AgentBase):
                     harvester_config.monitor.maxWorkers, harvester_config.monitor.checkInterval, harvester_config.monitor.lockInterval, lockedBy
                 )
                 mainLog.debug(f"got {len(workSpecsPerQueue)} queues")
+                item_score_list = []
                 # loop over all workers
                 for queueName, configIdWorkSpecs in workSpecsPerQueue.items():
                     for configID, workSpecsList in configIdWorkSpecs.items():
@@ -108,21 +109,19 @@ class Monitor(AgentBase):
                         if monitor_fifo.enabled and retVal is not None:
                             workSpecsToEnqueue, workSpecsToEnqueueToHead, timeNow_timestamp, fifoCheckInterval = retVal
                             if workSpecsToEnqueue:
-                                mainLog.debug("putting workers to FIFO")
-                                try:
-                                    score = fifoCheckInterval + timeNow_timestamp
-                                    monitor_fifo.put((queueName, workSpecsToEnqueue), score)
-                                    mainLog.info(f"put workers of {queueName} to FIFO with score {score}")
-                                except Exception as errStr:
-                                    mainLog.error(f"failed to put object from FIFO: {errStr}")
+                                score = fifoCheckInterval + timeNow_timestamp
+                                item_score_list.append(((queueName, workSpecsToEnqueue), score))
+                                mainLog.info(f"put workers of {queueName} to FIFO with score {score}")
                             if workSpecsToEnqueueToHead:
-                                mainLog.debug("putting workers to FIFO head")
-                                try:
-                                    score = fifoCheckInterval - timeNow_timestamp
-                                    monitor_fifo.put((queueName, workSpecsToEnqueueToHead), score)
-                                    mainLog.info(f"put workers of {queueName} to FIFO with score {score}")
-                                except Exception as errStr:
-                                    mainLog.error(f"failed to put object from FIFO head: {errStr}")
+                                score = fifoCheckInterval - timeNow_timestamp
+                                item_score_list.append(((queueName, workSpecsToEnqueueToHead), score))
+                                mainLog.info(f"put workers of {queueName} to FIFO with score {score}")
+                if item_score_list:
+                    mainLog.debug("putting workers to FIFO")
+                    try:
+                        monitor_fifo.putmany(item_score_list)
+                    except Exception as errStr:
+                        mainLog.error(f"failed to put objects to FIFO: {errStr}")
                 last_DB_cycle_timestamp = time.time()
                 if sw_db.get_elapsed_time_in_sec() > harvester_config.monitor.lockInterval:
                     mainLog.warning("a single DB cycle was longer than lockInterval " + sw_db.get_elapsed_time())
@@ -277,34 +276,31 @@ class Monitor(AgentBase):
                 # enqueue to fifo
                 sw.reset()
                 n_chunk_put = 0
+                item_score_list = []
                 mainLog.debug("putting worker chunks to FIFO")
                 for _dct in (obj_to_enqueue_dict, remaining_obj_to_enqueue_dict):
                     for (queueName, configID), obj_to_enqueue in _dct.items():
-                        try:
-                            workSpecsToEnqueue, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue
-                            if workSpecsToEnqueue:
-                                score = fifoCheckInterval + timeNow_timestamp
-                                monitor_fifo.put((queueName, workSpecsToEnqueue), score)
-                                n_chunk_put += 1
-                                mainLog.info(f"put a chunk of {len(workSpecsToEnqueue)} workers of {queueName} to FIFO with score {score}")
-                        except Exception as errStr:
-                            mainLog.error(f"failed to put object from FIFO: {errStr}")
+                        workSpecsToEnqueue, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue
+                        if workSpecsToEnqueue:
+                            score = fifoCheckInterval + timeNow_timestamp
+                            item_score_list.append(((queueName, workSpecsToEnqueue), score))
+                            mainLog.info(f"put a chunk of {len(workSpecsToEnqueue)} workers of {queueName} to FIFO with score {score}")
                 mainLog.debug("putting worker chunks to FIFO head")
                 for _dct in (obj_to_enqueue_to_head_dict, remaining_obj_to_enqueue_to_head_dict):
                     for (queueName, configID), obj_to_enqueue_to_head in _dct.items():
-                        try:
-                            workSpecsToEnqueueToHead, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue_to_head
-                            if workSpecsToEnqueueToHead:
-                                score = fifoCheckInterval + timeNow_timestamp - 2**32
-                                monitor_fifo.put((queueName, workSpecsToEnqueueToHead), score)
-                                n_chunk_put += 1
-                                mainLog.info(f"put a chunk of {len(workSpecsToEnqueueToHead)} workers of {queueName} to FIFO with score {score}")
-                        except Exception as errStr:
-                            mainLog.error(f"failed to put object from FIFO head: {errStr}")
+                        workSpecsToEnqueueToHead, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue_to_head
+                        if workSpecsToEnqueueToHead:
+                            score = fifoCheckInterval + timeNow_timestamp - 2**32
+                            item_score_list.append(((queueName, workSpecsToEnqueueToHead), score))
+                            mainLog.info(f"put a chunk of {len(workSpecsToEnqueueToHead)} workers of {queueName} to FIFO with score {score}")
+                try:
+                    n_chunk_put = monitor_fifo.putmany(item_score_list)
+                except Exception as errStr:
+                    mainLog.error(f"failed to put objects to FIFO: {errStr}")
                 # delete protective dequeued objects
                 if fifoProtectiveDequeue and len(obj_dequeued_id_list) > 0:
                     try:
-                        monitor_fifo.delete(ids=obj_dequeued_id_list)
+                        monitor_fifo.deletemany(ids=obj_dequeued_id_list)
                     except Exception as e:
                         mainLog.error(f"failed to delete object from FIFO: {e}")
                 mainLog.debug(f"put {n_chunk_put} worker chunks into FIFO" + sw.get_elapsed_time())
@@ -1,5 +1,6 @@
 import datetime
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from pandaharvester.harvesterbody.agent_base import AgentBase
 from pandaharvester.harvesterconfig import harvester_config
@@ -26,6 +27,8 @@ class Propagator(AgentBase):
         self.queueConfigMapper = queue_config_mapper
         self._last_stats_update = None
         self._last_metrics_update = None
+        # number of jobs or workers in one request, which is adjusted to latency if targetShardLatency is set
+        self.shardSizes = {"jobs": harvester_config.propagator.nJobsInBulk, "workers": harvester_config.propagator.nWorkersInBulk}
 
         # clean old service metrics at start up of the agent
         self.dbProxy.clean_service_metrics()
@@ -43,112 +46,31 @@ class Propagator(AgentBase):
             )
             mainLog.debug(f"got {len(jobSpecs)} jobs {sw.get_elapsed_time()}")
             # update jobs in central database
-            iJobs = 0
-            nJobs = harvester_config.propagator.nJobsInBulk
+            sw.reset()
             hbSuppressMap = dict()
-            while iJobs < len(jobSpecs):
-                jobList = jobSpecs[iJobs : iJobs + nJobs]
-                iJobs += nJobs
-                # collect jobs to update or check
-                jobListToSkip = []
-                jobListToUpdate = []
-                jobListToCheck = []
-                retList = []
-                for tmpJobSpec in jobList:
-                    if tmpJobSpec.computingSite not in hbSuppressMap:
-                        queueConfig = self.queueConfigMapper.get_queue(tmpJobSpec.computingSite, tmpJobSpec.configID)
-                        if queueConfig:
-                            hbSuppressMap[tmpJobSpec.computingSite] = queueConfig.get_no_heartbeat_status()
-                        else:  # assume truepilot
-                            hbSuppressMap[tmpJobSpec.computingSite] = ["running", "transferring", "finished", "failed"]
-                    # heartbeat is suppressed
-                    if tmpJobSpec.get_status() in hbSuppressMap[tmpJobSpec.computingSite] and not tmpJobSpec.not_suppress_heartbeat():
-                        # check running job to detect lost heartbeat
-                        if tmpJobSpec.status == "running":
-                            jobListToCheck.append(tmpJobSpec)
-                        else:
-                            jobListToSkip.append(tmpJobSpec)
-                            retList.append({"StatusCode": 0, "command": None})
-                    else:
-                        jobListToUpdate.append(tmpJobSpec)
-                sw.reset()
-                retList += self.communicator.check_jobs(jobListToCheck)
-                mainLog.debug(f"check_jobs for {len(jobListToCheck)} jobs {sw.get_elapsed_time()}")
-                sw.reset()
-                retList += self.communicator.update_jobs(jobListToUpdate, self.get_pid())
-                mainLog.debug(f"update_jobs for {len(jobListToUpdate)} jobs took {sw.get_elapsed_time()}")
-                # logging
-                for tmpJobSpec, tmpRet in zip(jobListToSkip + jobListToCheck + jobListToUpdate, retList):
-                    if tmpRet["StatusCode"] == 0:
-                        if tmpJobSpec in jobListToUpdate:
-                            mainLog.debug(f"updated PandaID={tmpJobSpec.PandaID} status={tmpJobSpec.status}")
-                        else:
-                            mainLog.debug(f"skip updating PandaID={tmpJobSpec.PandaID} status={tmpJobSpec.status}")
-                        # release job
-                        tmpJobSpec.propagatorLock = None
-                        if tmpJobSpec.is_final_status() and tmpJobSpec.status == tmpJobSpec.get_status():
-                            # unset to disable further updating
-                            tmpJobSpec.propagatorTime = None
-                            tmpJobSpec.subStatus = "done"
-                            tmpJobSpec.modificationTime = core_utils.naive_utcnow()
-                        elif tmpJobSpec.is_final_status() and not tmpJobSpec.all_events_done():
-                            # trigger next propagation to update remaining events
-                            tmpJobSpec.trigger_propagation()
-                        else:
-                            # check event availability
-                            if tmpJobSpec.status == "starting" and "eventService" in tmpJobSpec.jobParams and tmpJobSpec.subStatus != "submitted":
-                                tmpEvStat, tmpEvRet = self.communicator.check_event_availability(tmpJobSpec)
-                                if tmpEvStat:
-                                    if tmpEvRet is not None:
-                                        tmpJobSpec.nRemainingEvents = tmpEvRet
-                                    if tmpEvRet == 0:
-                                        mainLog.debug(f"kill PandaID={tmpJobSpec.PandaID} due to no event")
-                                        tmpRet["command"] = "tobekilled"
-                            # got kill command
-                            if "command" in tmpRet and tmpRet["command"] in ["tobekilled"]:
-                                nWorkers = self.dbProxy.mark_workers_to_kill_by_pandaid(tmpJobSpec.PandaID)
-                                if nWorkers == 0:
-                                    # no workers
-                                    tmpJobSpec.status = "cancelled"
-                                    tmpJobSpec.subStatus = "killed"
-                                    tmpJobSpec.set_pilot_error(PilotErrors.PANDAKILL, PilotErrors.pilot_error_msg[PilotErrors.PANDAKILL])
-                                    tmpJobSpec.stateChangeTime = core_utils.naive_utcnow()
-                                    tmpJobSpec.trigger_propagation()
-                        self.dbProxy.update_job(tmpJobSpec, {"propagatorLock": self.get_pid()}, update_out_file=True)
-                    else:
-                        mainLog.error(f"failed to update PandaID={tmpJobSpec.PandaID} status={tmpJobSpec.status}")
+            jobItems = [(tmpJobSpec, self.get_job_action(tmpJobSpec, hbSuppressMap)) for tmpJobSpec in jobSpecs]
+            self.run_shards(
+                "jobs",
+                jobItems,
+                lambda job_items: self.send_jobs(job_items, mainLog),
+                lambda job_items, ret_val: self.process_job_results(ret_val, mainLog),
+                mainLog,
+            )
+            mainLog.debug(f"propagated {len(jobSpecs)} jobs {sw.get_elapsed_time()}")
             mainLog.debug("getting workers to propagate")
             sw.reset()
             workSpecs = self.dbProxy.get_workers_to_propagate(harvester_config.propagator.maxWorkers, harvester_config.propagator.updateInterval)
             mainLog.debug(f"got {len(workSpecs)} workers {sw.get_elapsed_time()}")
             # update workers in central database
             sw.reset()
-            iWorkers = 0
-            nWorkers = harvester_config.propagator.nWorkersInBulk
-            while iWorkers < len(workSpecs):
-                workList = workSpecs[iWorkers : iWorkers + nWorkers]
-                iWorkers += nWorkers
-                retList, tmpErrStr = self.communicator.update_workers(workList)
-                # logging
-                if retList is None:
-                    mainLog.error(f"failed to update workers with {tmpErrStr}")
-                else:
-                    for tmpWorkSpec, tmpRet in zip(workList, retList):
-                        if tmpRet:
-                            mainLog.debug(f"updated workerID={tmpWorkSpec.workerID} status={tmpWorkSpec.status}")
-                            # update logs
-                            for logFilePath, logOffset, logSize, logRemoteName in tmpWorkSpec.get_log_files_to_upload():
-                                with open(logFilePath, "rb") as logFileObj:
-                                    tmpStat, tmpErr = self.communicator.upload_file(logRemoteName, logFileObj, logOffset, logSize)
-                                    if tmpStat:
-                                        tmpWorkSpec.update_log_files_to_upload(logFilePath, logOffset + logSize)
-                            # disable further update
-                            if tmpWorkSpec.is_final_status():
-                                tmpWorkSpec.disable_propagation()
-                            self.dbProxy.update_worker(tmpWorkSpec, {"workerID": tmpWorkSpec.workerID})
-                        else:
-                            mainLog.error(f"failed to update workerID={tmpWorkSpec.workerID} status={tmpWorkSpec.status}")
-            mainLog.debug(f"update_workers for {iWorkers} workers took {sw.get_elapsed_time()}")
+            self.run_shards(
+                "workers",
+                workSpecs,
+                self.send_workers,
+                lambda work_list, ret_val: self.process_worker_results(work_list, ret_val, mainLog),
+                mainLog,
+            )
+            mainLog.debug(f"update_workers for {len(workSpecs)} workers took {sw.get_elapsed_time()}")
             mainLog.debug("getting commands")
             commandSpecs = self.dbProxy.get_commands_for_receiver("propagator")
             mainLog.debug(f"got {len(commandSpecs)} commands")
@@ -225,3 +147,173 @@ class Propagator(AgentBase):
             if self.terminated(harvester_config.propagator.sleepTime):
                 mainLog.debug("terminated")
                 return
+
+    # get how to propagate a job; skip, check, or update
+    def get_job_action(self, job_spec, hb_suppress_map):
+        if job_spec.computingSite not in hb_suppress_map:
+            queueConfig = self.queueConfigMapper.get_queue(job_spec.computingSite, job_spec.configID)
+            if queueConfig:
+                hb_suppress_map[job_spec.computingSite] = queueConfig.get_no_heartbeat_status()
+            else:  # assume truepilot
+                hb_suppress_map[job_spec.computingSite] = ["running", "transferring", "finished", "failed"]
+        # heartbeat is suppressed
+        if job_spec.get_status() in hb_suppress_map[job_spec.computingSite] and not job_spec.not_suppress_heartbeat():
+            # check running job to detect lost heartbeat
+            if job_spec.status == "running":
+                return "check"
+            return "skip"
+        return "update"
+
+    # send a shard of jobs to PanDA. Return job items sorted by action, results in the same order, and time spent in the communicator
+    def send_jobs(self, job_items, main_log):
+        jobListToSkip = [tmpJobSpec for tmpJobSpec, tmpAction in job_items if tmpAction == "skip"]
+        jobListToCheck = [tmpJobSpec for tmpJobSpec, tmpAction in job_items if tmpAction == "check"]
+        jobListToUpdate = [tmpJobSpec for tmpJobSpec, tmpAction in job_items if tmpAction == "update"]
+        retList = [{"StatusCode": 0, "command": None} for tmpJobSpec in jobListToSkip]
+        sw = core_utils.get_stopwatch()
+        timeStart = time.monotonic()
+        retList += self.communicator.check_jobs(jobListToCheck)
+        main_log.debug(f"check_jobs for {len(jobListToCheck)} jobs {sw.get_elapsed_time()}")
+        sw.reset()
+        retList += self.communicator.update_jobs(jobListToUpdate, self.get_pid())
+        main_log.debug(f"update_jobs for {len(jobListToUpdate)} jobs took {sw.get_elapsed_time()}")
+        latency = time.monotonic() - timeStart
+        sortedItems = [(tmpJobSpec, "skip") for tmpJobSpec in jobListToSkip]
+        sortedItems += [(tmpJobSpec, "check") for tmpJobSpec in jobListToCheck]
+        sortedItems += [(tmpJobSpec, "update") for tmpJobSpec in jobListToUpdate]
+        return (sortedItems, retList), latency
+
+    # send a shard of workers to PanDA. Return results and time spent in the communicator
+    def send_workers(self, work_list):
+        timeStart = time.monotonic()
+        retVal = self.communicator.update_workers(work_list)
+        return retVal, time.monotonic() - timeStart
+
+    # process results of a shard of jobs and release them
+    def process_job_results(self, ret_val, main_log):
+        job_items, ret_list = ret_val
+        jobListToRelease = []
+        for (tmpJobSpec, tmpAction), tmpRet in zip(job_items, ret_list):
+            if tmpRet["StatusCode"] == 0:
+                if tmpAction == "update":
+                    main_log.debug(f"updated PandaID={tmpJobSpec.PandaID} status={tmpJobSpec.status}")
+                else:
+                    main_log.debug(f"skip updating PandaID={tmpJobSpec.PandaID} status={tmpJobSpec.status}")
+                # release job
+                tmpJobSpec.propagatorLock = None
+                if tmpJobSpec.is_final_status() and tmpJobSpec.status == tmpJobSpec.get_status():
+                    # unset to disable further updating
+                    tmpJobSpec.propagatorTime = None
+                    tmpJobSpec.subStatus = "done"
+                    tmpJobSpec.modificationTime = core_utils.naive_utcnow()
+                elif tmpJobSpec.is_final_status() and not tmpJobSpec.all_events_done():
+                    # trigger next propagation to update remaining events
+                    tmpJobSpec.trigger_propagation()
+                else:
+                    # check event availability
+                    if tmpJobSpec.status == "starting" and "eventService" in tmpJobSpec.jobParams and tmpJobSpec.subStatus != "submitted":
+                        tmpEvStat, tmpEvRet = self.communicator.check_event_availability(tmpJobSpec)
+                        if tmpEvStat:
+                            if tmpEvRet is not None:
+                                tmpJobSpec.nRemainingEvents = tmpEvRet
+                            if tmpEvRet == 0:
+                                main_log.debug(f"kill PandaID={tmpJobSpec.PandaID} due to no event")
+                                tmpRet["command"] = "tobekilled"
+                    # got kill command
+                    if "command" in tmpRet and tmpRet["command"] in ["tobekilled"]:
+                        nWorkers = self.dbProxy.mark_workers_to_kill_by_pandaid(tmpJobSpec.PandaID)
+                        if nWorkers == 0:
+                            # no workers
+                            tmpJobSpec.status = "cancelled"
+                            tmpJobSpec.subStatus = "killed"
+                            tmpJobSpec.set_pilot_error(PilotErrors.PANDAKILL, PilotErrors.pilot_error_msg[PilotErrors.PANDAKILL])
+                            tmpJobSpec.stateChangeTime = core_utils.naive_utcnow()
+                            tmpJobSpec.trigger_propagation()
+                jobListToRelease.append(tmpJobSpec)
+            else:
+                main_log.error(f"failed to update PandaID={tmpJobSpec.PandaID} status={tmpJobSpec.status}")
+        # release jobs in bulk
+        sw = core_utils.get_stopwatch()
+        tmpRetList = self.dbProxy.update_jobs_bulk(jobListToRelease, {"propagatorLock": self.get_pid()}, update_out_file=True)
+        if tmpRetList is None:
+            # fall back to update jobs one by one
+            main_log.error(f"failed to release {len(jobListToRelease)} jobs in bulk. try one by one")
+            tmpRetList = [self.dbProxy.update_job(tmpJobSpec, {"propagatorLock": self.get_pid()}, update_out_file=True) for tmpJobSpec in jobListToRelease]
+        for tmpJobSpec, tmpRet in zip(jobListToRelease, tmpRetList):
+            if tmpRet == 0:
+                main_log.debug(f"PandaID={tmpJobSpec.PandaID} was not released since the lock was lost")
+        main_log.debug(f"released {len(jobListToRelease)} jobs {sw.get_elapsed_time()}")
+
+    # process results of a shard of workers
+    def process_worker_results(self, work_list, ret_val, main_log):
+        retList, tmpErrStr = ret_val
+        # logging
+        if retList is None:
+            main_log.error(f"failed to update workers with {tmpErrStr}")
+        else:
+            for tmpWorkSpec, tmpRet in zip(work_list, retList):
+                if tmpRet:
+                    main_log.debug(f"updated workerID={tmpWorkSpec.workerID} status={tmpWorkSpec.status}")
+                    # update logs
+                    for logFilePath, logOffset, logSize, logRemoteName in tmpWorkSpec.get_log_files_to_upload():
+                        with open(logFilePath, "rb") as logFileObj:
+                            tmpStat, tmpErr = self.communicator.upload_file(logRemoteName, logFileObj, logOffset, logSize)
+                            if tmpStat:
+                                tmpWorkSpec.update_log_files_to_upload(logFilePath, logOffset + logSize)
+                    # disable further update
+                    if tmpWorkSpec.is_final_status():
+                        tmpWorkSpec.disable_propagation()
+                    self.dbProxy.update_worker(tmpWorkSpec, {"workerID": tmpWorkSpec.workerID})
+                else:
+                    main_log.error(f"failed to update workerID={tmpWorkSpec.workerID} status={tmpWorkSpec.status}")
+
+    # adjust shard size so that one request takes about the target latency
+    def adjust_shard_size(self, kind, n_items, latency):
+        targetLatency = getattr(harvester_config.propagator, "targetShardLatency", 0)
+        if targetLatency <= 0 or n_items == 0:
+            return
+        if kind == "jobs":
+            maxSize = getattr(harvester_config.propagator, "maxJobsInBulk", harvester_config.propagator.nJobsInBulk)
+        else:
+            maxSize = getattr(harvester_config.propagator, "maxWorkersInBulk", harvester_config.propagator.nWorkersInBulk)
+        newSize = n_items * targetLatency / max(latency, 0.001)
+        # move half way to damp fluctuation
+        newSize = int((self.shardSizes[kind] + newSize) / 2)
+        self.shardSizes[kind] = min(max(newSize, 1), maxSize)
+
+    # send shards to PanDA concurrently with bounded concurrency, and process results in this thread as they arrive.
+    # send_func returns results and time spent in the communicator, which is used to adjust the shard size
+    def run_shards(self, kind, items, send_func, process_func, main_log):
+        nConcurrentShards = max(getattr(harvester_config.propagator, "nConcurrentShards", 1), 1)
+        # send and process shards one by one
+        if nConcurrentShards == 1:
+            iItems = 0
+            while iItems < len(items):
+                shard = items[iItems : iItems + self.shardSizes[kind]]
+                iItems += len(shard)
+                retVal, latency = send_func(shard)
+                self.adjust_shard_size(kind, len(shard), latency)
+                process_func(shard, retVal)
+            return
+        # pipeline
+        iItems = 0
+        futureMap = dict()
+        with ThreadPoolExecutor(max_workers=nConcurrentShards) as executor:
+            while iItems < len(items) or futureMap:
+                # send shards to free slots
+                while iItems < len(items) and len(futureMap) < nConcurrentShards:
+                    shard = items[iItems : iItems + self.shardSizes[kind]]
+                    iItems += len(shard)
+                    futureMap[executor.submit(send_func, shard)] = shard
+                # process results
+                done, _ = wait(futureMap, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard = futureMap.pop(future)
+                    try:
+                        retVal, latency = future.result()
+                    except Exception:
+                        core_utils.dump_error_message(main_log)
+                        continue
+                    self.adjust_shard_size(kind, len(shard), latency)
+                    process_func(shard, retVal)
+        main_log.debug(f"shard size for {kind} is {self.shardSizes[kind]}")
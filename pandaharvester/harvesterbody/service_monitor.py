@@ -5,11 +5,13 @@ import traceback
 
 import psutil
 
+from pandaharvester.harvesterbody import submitter
 from pandaharvester.harvesterbody.agent_base import AgentBase
 from pandaharvester.harvesterbody.cred_manager import CredManager
 from pandaharvester.harvesterconfig import harvester_config
-from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore import core_utils, plugin_call_stats
 from pandaharvester.harvestercore.db_proxy_pool import DBProxyPool as DBProxy
+from pandaharvester.harvestercore.plugin_factory import PluginFactory
 from pandaharvester.harvestercore.queue_config_mapper import QueueConfigMapper
 from pandaharvester.harvestercore.service_metrics_spec import ServiceMetricSpec
 
@@ -25,9 +27,10 @@ def round_floats(value):
 # class to monitor the service, e.g. memory usage
 class ServiceMonitor(AgentBase):
     # constructor
-    def __init__(self, pid_file, single_mode=False):
+    def __init__(self, pid_file, single_mode=False, communicator_pool=None):
         AgentBase.__init__(self, single_mode)
         self.db_proxy = DBProxy()
+        self.communicator_pool = communicator_pool
 
         if pid_file is not None:
             self.pid_file = pid_file
@@ -166,6 +169,68 @@ class ServiceMonitor(AgentBase):
 
             _logger.debug(f"Got cert validities: {service_metrics['cert_lifetime']}")
 
+            # get counters of requests and TLS handshakes per PanDA endpoint
+            if self.communicator_pool is not None:
+                service_metrics["pandacon_stats"] = {
+                    endpoint: {key: round_floats(value) for (key, value) in stats.items()}
+                    for (endpoint, stats) in self.communicator_pool.get_connection_stats().items()
+                }
+                _logger.debug(f"Got PanDA connection stats: {service_metrics['pandacon_stats']}")
+
+            # get statistics of plugin instance cache and plugin construction time
+            plugin_stats = PluginFactory.get_instance_cache_stats()
+            plugin_stats["constructions"] = {
+                plugin_key: {key: round_floats(value) for (key, value) in stats.items()} for (plugin_key, stats) in plugin_stats["constructions"].items()
+            }
+            service_metrics["plugin_stats"] = plugin_stats
+            _logger.debug(f"Got plugin stats: {service_metrics['plugin_stats']}")
+
+            # get contention statistics of application side DB lock
+            service_metrics["db_lock_stats"] = {key: round_floats(value) for (key, value) in self.db_proxy.get_app_lock_stats().items()}
+            _logger.debug(f"Got DB lock stats: {service_metrics['db_lock_stats']}")
+
+            # get statistics of DB connection pools and histograms of wait time for each DB method
+            db_pool_stats = self.db_proxy.get_pool_stats()
+            for method_stats in db_pool_stats["wait_time"].values():
+                for key in ["wait_time", "max_wait_time"]:
+                    method_stats[key] = round(method_stats[key], 3)
+            service_metrics["db_pool_stats"] = db_pool_stats
+            _logger.debug(f"Got DB pool stats: {service_metrics['db_pool_stats']}")
+
+            # get latency and row counts of the most time-consuming DB methods and SQL statements
+            db_stats_top_n = getattr(harvester_config.service_monitor, "db_stats_top_n", 30)
+            db_call_stats = self.db_proxy.get_call_stats(db_stats_top_n)
+            for key in ["methods", "sql"]:
+                service_metrics[f"db_{key}_stats"] = [
+                    {tmp_key: round(value, 4) if isinstance(value, float) else value for (tmp_key, value) in stats.items()} for stats in db_call_stats[key]
+                ]
+            _logger.debug(f"Got DB call stats of {len(service_metrics['db_methods_stats'])} methods and {len(service_metrics['db_sql_stats'])} statements")
+
+            # get latency histograms of plugin calls for each queue and stack samples of recent slow calls
+            plugin_stats_top_n = getattr(harvester_config.service_monitor, "plugin_stats_top_n", 50)
+            service_metrics["plugin_call_stats"] = [
+                {key: round(value, 4) if isinstance(value, float) else value for (key, value) in stats.items()}
+                for stats in plugin_call_stats.callStats.get_stats(plugin_stats_top_n)
+            ]
+            n_slow_call_samples = getattr(harvester_config.service_monitor, "plugin_slow_call_samples", 20)
+            slow_call_samples = plugin_call_stats.callStats.get_slow_call_samples()
+            if n_slow_call_samples > 0:
+                slow_call_samples = slow_call_samples[-n_slow_call_samples:]
+            else:
+                slow_call_samples = []
+            service_metrics["plugin_slow_calls"] = [
+                {key: round(value, 3) if isinstance(value, float) else value for (key, value) in sample.items()} for sample in slow_call_samples
+            ]
+            _logger.debug(
+                f"Got plugin call stats of {len(service_metrics['plugin_call_stats'])} methods and {len(service_metrics['plugin_slow_calls'])} slow call samples"
+            )
+
+            # get time consumed by each stage of submission cycles
+            service_metrics["submitter_stage_stats"] = [
+                {key: round(value, 4) if isinstance(value, float) else value for (key, value) in stats.items()} for stats in submitter.stageStats.get_stats()
+            ]
+            _logger.debug(f"Got submitter stage stats of {len(service_metrics['submitter_stage_stats'])} stages")
+
             service_metrics_spec = ServiceMetricSpec(service_metrics)
             self.db_proxy.insert_service_metrics(service_metrics_spec)
 
@@ -2,6 +2,7 @@ import datetime
 import math
 import socket
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from pandaharvester.harvesterbody.agent_base import AgentBase
 from pandaharvester.harvesterbody.worker_adjuster import WorkerAdjuster
@@ -9,6 +10,7 @@ from pandaharvester.harvesterbody.worker_maker import WorkerMaker
 from pandaharvester.harvesterconfig import harvester_config
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.command_spec import CommandSpec
+from pandaharvester.harvestercore.db_call_stats import CallStats
 from pandaharvester.harvestercore.db_proxy_pool import DBProxyPool as DBProxy
 from pandaharvester.harvestercore.fifos import MonitorFIFO
 from pandaharvester.harvestercore.pilot_errors import PilotErrors
@@ -21,6 +23,9 @@ _logger = core_utils.setup_logger("submitter")
 
 DEFAULT_JOB_TYPE = "managed"
 
+# statistics of time consumed by each stage of submission cycles, shared by all submitter threads
+stageStats = CallStats()
+
 
 # class to submit workers
 class Submitter(AgentBase):
@@ -38,381 +43,31 @@ class Submitter(AgentBase):
     # main loop
     def run(self):
         locked_by = f"submitter-{self.get_pid()}"
-        monitor_fifo = self.monitor_fifo
         queue_lock_interval = getattr(harvester_config.submitter, "queueLockInterval", harvester_config.submitter.lockInterval)
+        # max number of sites processed concurrently in each thread
+        n_sites_in_parallel = getattr(harvester_config.submitter, "nSitesInParallel", 1)
+        if n_sites_in_parallel > 1:
+            self.run_pipelined(locked_by, queue_lock_interval, n_sites_in_parallel)
+            return
         while True:
             sw_main = core_utils.get_stopwatch()
             main_log = self.make_logger(_logger, f"id={locked_by}", method_name="run")
             main_log.debug("getting queues to submit workers")
 
             # get queues associated to a site to submit workers
+            timeStart = time.monotonic()
             current_workers, site_name, res_map = self.dbProxy.get_queues_to_submit(
                 harvester_config.submitter.lookupTime,
                 harvester_config.submitter.lockInterval,
                 locked_by,
                 queue_lock_interval,
             )
+            stageStats.record("get_sites_to_submit", time.monotonic() - timeStart, n_rows=0 if site_name is None else 1)
             submitted = False
             if site_name is not None:
-                main_log.debug(f"got {len(current_workers)} queues for site {site_name}")
-
-                # get commands from panda server
-                com_str = f"{CommandSpec.COM_setNWorkers}:{site_name}"
-                command_specs = self.dbProxy.get_commands_for_receiver("submitter", com_str)
-                main_log.debug(f"got {len(command_specs)} {com_str} commands")
-                for command_spec in command_specs:
-                    new_limits = self.dbProxy.set_queue_limit(site_name, command_spec.params)
-                    for _, tmp_jt_vals in new_limits.items():
-                        res_map.setdefault(DEFAULT_JOB_TYPE, {})
-                        for tmp_resource_type, tmp_new_val in tmp_jt_vals.items():
-                            # if available, overwrite new worker value with the command from panda server
-                            if tmp_resource_type in res_map[DEFAULT_JOB_TYPE]:
-                                tmp_queue_name = res_map[DEFAULT_JOB_TYPE][tmp_resource_type]
-                                if tmp_queue_name in current_workers:
-                                    # pilot_type "ANY" to collect all nNewWorkers from the command
-                                    current_workers[tmp_queue_name][DEFAULT_JOB_TYPE][tmp_resource_type]["ANY"]["nNewWorkers"] = tmp_new_val
-
-                # define number of new workers
-                if len(current_workers) == 0:
-                    n_workers_per_queue_jt_rt = dict()
-                else:
-                    n_workers_per_queue_jt_rt = self.workerAdjuster.define_num_workers(current_workers, site_name)
-
-                if n_workers_per_queue_jt_rt is None:
-                    main_log.error("WorkerAdjuster failed to define the number of workers")
-                elif len(n_workers_per_queue_jt_rt) == 0:
-                    pass
-                else:
-                    # loop over all queues and resource types
-                    for queue_name in n_workers_per_queue_jt_rt:
-                        job_type = DEFAULT_JOB_TYPE
-                        # get queue
-                        queue_config = self.queue_configMapper.get_queue(queue_name)
-                        workerMakerCore = self.workerMaker.get_plugin(queue_config)
-                        for resource_type in n_workers_per_queue_jt_rt[queue_name][job_type]:
-                            for pilot_type in n_workers_per_queue_jt_rt[queue_name][job_type][resource_type]:
-                                tmp_val = n_workers_per_queue_jt_rt[queue_name][job_type][resource_type][pilot_type]
-                                # get prod_source_label from pilot_type for worker maker
-                                prod_source_label = core_utils.special_pilot_type_to_prod_source_label(pilot_type)
-                                tmp_log = self.make_logger(
-                                    _logger,
-                                    f"id={locked_by} queue={queue_name} jtype={job_type} rtype={resource_type} ptype={pilot_type}",
-                                    method_name="run",
-                                )
-                                try:
-                                    tmp_log.debug("start")
-                                    tmp_log.debug(f"workers status: {tmp_val}")
-                                    nWorkers = tmp_val["nNewWorkers"] + tmp_val["nReady"]
-                                    nReady = tmp_val["nReady"]
-
-                                    # check queue
-                                    if not self.queue_configMapper.has_queue(queue_name):
-                                        tmp_log.error("config not found")
-                                        continue
-
-                                    # no new workers
-                                    if nWorkers == 0:
-                                        tmp_log.debug("skipped since no new worker is needed based on current stats")
-                                        continue
-                                    # check if resource is ready
-                                    if hasattr(workerMakerCore, "dynamicSizing") and workerMakerCore.dynamicSizing is True:
-                                        numReadyResources = self.workerMaker.num_ready_resources(queue_config, job_type, resource_type, workerMakerCore)
-                                        tmp_log.debug(f"numReadyResources: {numReadyResources}")
-                                        if not numReadyResources:
-                                            if hasattr(workerMakerCore, "staticWorkers"):
-                                                nQRWorkers = tmp_val["nQueue"] + tmp_val["nRunning"]
-                                                tmp_log.debug(f"staticWorkers: {workerMakerCore.staticWorkers}, nQRWorkers(Queue+Running): {nQRWorkers}")
-                                                if nQRWorkers >= workerMakerCore.staticWorkers:
-                                                    tmp_log.debug("No left static workers, skip")
-                                                    continue
-                                                else:
-                                                    nWorkers = min(workerMakerCore.staticWorkers - nQRWorkers, nWorkers)
-                                                    tmp_log.debug(f"staticWorkers: {workerMakerCore.staticWorkers}, nWorkers: {nWorkers}")
-                                            else:
-                                                tmp_log.debug("skip since no resources are ready")
-                                                continue
-                                        else:
-                                            nWorkers = min(nWorkers, numReadyResources)
-                                    # post action of worker maker
-                                    if hasattr(workerMakerCore, "skipOnFail") and workerMakerCore.skipOnFail is True:
-                                        skipOnFail = True
-                                    else:
-                                        skipOnFail = False
-                                    # actions based on mapping type
-                                    if queue_config.mapType == WorkSpec.MT_NoJob:
-                                        # workers without jobs
-                                        jobChunks = []
-                                        for i in range(nWorkers):
-                                            jobChunks.append([])
-                                    elif queue_config.mapType == WorkSpec.MT_OneToOne:
-                                        # one worker per one job
-                                        jobChunks = self.dbProxy.get_job_chunks_for_workers(
-                                            queue_name,
-                                            nWorkers,
-                                            nReady,
-                                            1,
-                                            None,
-                                            queue_config.useJobLateBinding,
-                                            harvester_config.submitter.checkInterval,
-                                            harvester_config.submitter.lockInterval,
-                                            locked_by,
-                                        )
-                                    elif queue_config.mapType == WorkSpec.MT_MultiJobs:
-                                        # one worker for multiple jobs
-                                        nJobsPerWorker = self.workerMaker.get_num_jobs_per_worker(
-                                            queue_config, nWorkers, job_type, resource_type, maker=workerMakerCore
-                                        )
-                                        tmp_log.debug(f"nJobsPerWorker={nJobsPerWorker}")
-                                        jobChunks = self.dbProxy.get_job_chunks_for_workers(
-                                            queue_name,
-                                            nWorkers,
-                                            nReady,
-                                            nJobsPerWorker,
-                                            None,
-                                            queue_config.useJobLateBinding,
-                                            harvester_config.submitter.checkInterval,
-                                            harvester_config.submitter.lockInterval,
-                                            locked_by,
-                                            queue_config.allowJobMixture,
-                                        )
-                                    elif queue_config.mapType == WorkSpec.MT_MultiWorkers:
-                                        # multiple workers for one job
-                                        nWorkersPerJob = self.workerMaker.get_num_workers_per_job(
-                                            queue_config, nWorkers, job_type, resource_type, maker=workerMakerCore
-                                        )
-                                        maxWorkersPerJob = self.workerMaker.get_max_workers_per_job_in_total(
-                                            queue_config, job_type, resource_type, maker=workerMakerCore
-                                        )
-                                        maxWorkersPerJobPerCycle = self.workerMaker.get_max_workers_per_job_per_cycle(
-                                            queue_config, job_type, resource_type, maker=workerMakerCore
-                                        )
-                                        tmp_log.debug(f"nWorkersPerJob={nWorkersPerJob}")
-                                        jobChunks = self.dbProxy.get_job_chunks_for_workers(
-                                            queue_name,
-                                            nWorkers,
-                                            nReady,
-                                            None,
-                                            nWorkersPerJob,
-                                            queue_config.useJobLateBinding,
-                                            harvester_config.submitter.checkInterval,
-                                            harvester_config.submitter.lockInterval,
-                                            locked_by,
-                                            max_workers_per_job_in_total=maxWorkersPerJob,
-                                            max_workers_per_job_per_cycle=maxWorkersPerJobPerCycle,
-                                        )
-                                    else:
-                                        tmp_log.error(f"unknown mapType={queue_config.mapType}")
-                                        continue
-
-                                    tmp_log.debug(f"got {len(jobChunks)} job chunks")
-                                    if len(jobChunks) == 0:
-                                        continue
-                                    # make workers
-                                    okChunks, ngChunks = self.workerMaker.make_workers(
-                                        jobChunks,
-                                        queue_config,
-                                        nReady,
-                                        job_type,
-                                        resource_type,
-                                        prod_source_label=prod_source_label,
-                                        maker=workerMakerCore,
-                                    )
-
-                                    if len(ngChunks) == 0:
-                                        tmp_log.debug(f"successfully made {len(okChunks)} workers")
-                                    else:
-                                        tmp_log.debug(f"made {len(okChunks)} workers, while {len(ngChunks)} workers failed")
-                                    timeNow = core_utils.naive_utcnow()
-                                    timeNow_timestamp = time.time()
-                                    pandaIDs = set()
-                                    # NG (=not good)
-                                    for ngJobs in ngChunks:
-                                        for job_spec in ngJobs:
-                                            if skipOnFail:
-                                                # release jobs when workers are not made
-                                                pandaIDs.add(job_spec.PandaID)
-                                            else:
-                                                job_spec.status = "failed"
-                                                job_spec.subStatus = "failed_to_make"
-                                                job_spec.stateChangeTime = timeNow
-                                                job_spec.locked_by = None
-                                                errStr = "failed to make a worker"
-                                                job_spec.set_pilot_error(PilotErrors.SETUPFAILURE, errStr)
-                                                job_spec.trigger_propagation()
-                                                self.dbProxy.update_job(job_spec, {"locked_by": locked_by, "subStatus": "prepared"})
-                                    # OK
-                                    work_specList = []
-                                    if len(okChunks) > 0:
-                                        for work_spec, okJobs in okChunks:
-                                            # has job
-                                            if (queue_config.useJobLateBinding and work_spec.workerID is None) or queue_config.mapType == WorkSpec.MT_NoJob:
-                                                work_spec.hasJob = 0
-                                            else:
-                                                work_spec.hasJob = 1
-                                                if work_spec.nJobsToReFill in [None, 0]:
-                                                    work_spec.set_jobspec_list(okJobs)
-                                                else:
-                                                    # refill free slots during the worker is running
-                                                    work_spec.set_jobspec_list(okJobs[: work_spec.nJobsToReFill])
-                                                    work_spec.nJobsToReFill = None
-                                                    for job_spec in okJobs[work_spec.nJobsToReFill :]:
-                                                        pandaIDs.add(job_spec.PandaID)
-                                                work_spec.set_num_jobs_with_list()
-                                            # map type
-                                            work_spec.mapType = queue_config.mapType
-                                            # queue name
-                                            work_spec.computingSite = queue_config.queueName
-                                            # set access point
-                                            work_spec.accessPoint = queue_config.messenger["accessPoint"]
-                                            # sync level
-                                            work_spec.syncLevel = queue_config.get_synchronization_level()
-                                            # events
-                                            if len(okJobs) > 0 and (
-                                                "eventService" in okJobs[0].jobParams or "cloneJob" in okJobs[0].jobParams or "isHPO" in okJobs[0].jobParams
-                                            ):
-                                                work_spec.eventsRequest = WorkSpec.EV_useEvents
-                                            work_specList.append(work_spec)
-                                    if len(work_specList) > 0:
-                                        sw = core_utils.get_stopwatch()
-                                        # get plugin for submitter
-                                        submitterCore = self.pluginFactory.get_plugin(queue_config.submitter)
-                                        if submitterCore is None:
-                                            # not found
-                                            tmp_log.error(f"submitter plugin for {job_spec.computingSite} not found")
-                                            continue
-                                        # get plugin for messenger
-                                        messenger = self.pluginFactory.get_plugin(queue_config.messenger)
-                                        if messenger is None:
-                                            # not found
-                                            tmp_log.error(f"messenger plugin for {job_spec.computingSite} not found")
-                                            continue
-                                        # setup access points
-                                        messenger.setup_access_points(work_specList)
-                                        # feed jobs
-                                        for work_spec in work_specList:
-                                            if work_spec.hasJob == 1:
-                                                tmpStat = messenger.feed_jobs(work_spec, work_spec.get_jobspec_list())
-                                                if tmpStat is False:
-                                                    tmp_log.error(f"failed to send jobs to workerID={work_spec.workerID}")
-                                                else:
-                                                    tmp_log.debug(f"sent jobs to workerID={work_spec.workerID} with {tmpStat}")
-                                        # insert workers
-                                        self.dbProxy.insert_workers(work_specList, locked_by)
-                                        # submit
-                                        sw.reset()
-                                        tmp_log.info(f"submitting {len(work_specList)} workers")
-                                        work_specList, tmpRetList, tmpStrList = self.submit_workers(submitterCore, work_specList)
-                                        tmp_log.debug(f"done submitting {len(work_specList)} workers" + sw.get_elapsed_time())
-                                        # collect successful jobs
-                                        okPandaIDs = set()
-                                        for iWorker, (tmpRet, tmpStr) in enumerate(zip(tmpRetList, tmpStrList)):
-                                            if tmpRet:
-                                                work_spec, jobList = okChunks[iWorker]
-                                                jobList = work_spec.get_jobspec_list()
-                                                if jobList is not None:
-                                                    for job_spec in jobList:
-                                                        okPandaIDs.add(job_spec.PandaID)
-                                        # loop over all workers
-                                        for iWorker, (tmpRet, tmpStr) in enumerate(zip(tmpRetList, tmpStrList)):
-                                            work_spec, jobList = okChunks[iWorker]
-                                            # set harvesterHost
-                                            work_spec.harvesterHost = socket.gethostname()
-                                            # use associated job list since it can be truncated for re-filling
-                                            jobList = work_spec.get_jobspec_list()
-                                            # set status
-                                            if not tmpRet:
-                                                # failed submission
-                                                errStr = f"failed to submit a workerID={work_spec.workerID} with {tmpStr}"
-                                                tmp_log.error(errStr)
-                                                work_spec.set_status(WorkSpec.ST_missed)
-                                                work_spec.set_dialog_message(tmpStr)
-                                                work_spec.set_pilot_error(PilotErrors.SETUPFAILURE, errStr)
-                                                work_spec.set_pilot_closed()
-                                                if jobList is not None:
-                                                    # increment attempt number
-                                                    newJobList = []
-                                                    for job_spec in jobList:
-                                                        # skip if successful with another worker
-                                                        if job_spec.PandaID in okPandaIDs:
-                                                            continue
-                                                        if job_spec.submissionAttempts is None:
-                                                            job_spec.submissionAttempts = 0
-                                                        job_spec.submissionAttempts += 1
-                                                        # max attempt or permanent error
-                                                        if tmpRet is False or job_spec.submissionAttempts >= queue_config.maxSubmissionAttempts:
-                                                            newJobList.append(job_spec)
-                                                        else:
-                                                            self.dbProxy.increment_submission_attempt(job_spec.PandaID, job_spec.submissionAttempts)
-                                                    jobList = newJobList
-                                            elif queue_config.useJobLateBinding and work_spec.hasJob == 1:
-                                                # directly go to running after feeding jobs for late biding
-                                                work_spec.set_status(WorkSpec.ST_running)
-                                            else:
-                                                # normal successful submission
-                                                work_spec.set_status(WorkSpec.ST_submitted)
-                                            work_spec.submitTime = timeNow
-                                            work_spec.modificationTime = timeNow
-                                            work_spec.checkTime = timeNow
-                                            if self.monitor_fifo.enabled:
-                                                work_spec.set_work_params({"lastCheckAt": timeNow_timestamp})
-                                            # prefetch events
-                                            if (
-                                                tmpRet
-                                                and work_spec.hasJob == 1
-                                                and work_spec.eventsRequest == WorkSpec.EV_useEvents
-                                                and queue_config.prefetchEvents
-                                            ):
-                                                work_spec.eventsRequest = WorkSpec.EV_requestEvents
-                                                eventsRequestParams = dict()
-                                                for job_spec in jobList:
-                                                    eventsRequestParams[job_spec.PandaID] = {
-                                                        "pandaID": job_spec.PandaID,
-                                                        "taskID": job_spec.taskID,
-                                                        "jobsetID": job_spec.jobParams["jobsetID"],
-                                                        "nRanges": max(int(math.ceil(work_spec.nCore / len(jobList))), job_spec.jobParams["coreCount"])
-                                                        * queue_config.initEventsMultipler,
-                                                    }
-                                                    if "isHPO" in job_spec.jobParams:
-                                                        if "sourceURL" in job_spec.jobParams:
-                                                            sourceURL = job_spec.jobParams["sourceURL"]
-                                                        else:
-                                                            sourceURL = None
-                                                        eventsRequestParams[job_spec.PandaID].update({"isHPO": True, "jobsetID": 0, "sourceURL": sourceURL})
-                                                work_spec.eventsRequestParams = eventsRequestParams
-                                            # register worker
-                                            tmpStat = self.dbProxy.register_worker(work_spec, jobList, locked_by)
-                                            if jobList is not None:
-                                                for job_spec in jobList:
-                                                    pandaIDs.add(job_spec.PandaID)
-                                                    if tmpStat:
-                                                        if tmpRet:
-                                                            tmpStr = "submitted a workerID={0} for PandaID={1} with submissionHost={2} batchID={3}"
-                                                            tmp_log.info(
-                                                                tmpStr.format(work_spec.workerID, job_spec.PandaID, work_spec.submissionHost, work_spec.batchID)
-                                                            )
-                                                        else:
-                                                            tmpStr = "failed to submit a workerID={0} for PandaID={1}"
-                                                            tmp_log.error(tmpStr.format(work_spec.workerID, job_spec.PandaID))
-                                                    else:
-                                                        tmpStr = "failed to register a worker for PandaID={0} with submissionHost={1} batchID={2}"
-                                                        tmp_log.error(tmpStr.format(job_spec.PandaID, work_spec.submissionHost, work_spec.batchID))
-                                        # enqueue to monitor fifo
-                                        if self.monitor_fifo.enabled and queue_config.mapType != WorkSpec.MT_MultiWorkers:
-                                            work_specsToEnqueue = [[w] for w in work_specList if w.status in (WorkSpec.ST_submitted, WorkSpec.ST_running)]
-                                            check_delay = min(
-                                                getattr(harvester_config.monitor, "eventBasedCheckInterval", harvester_config.monitor.checkInterval),
-                                                getattr(harvester_config.monitor, "fifoCheckInterval", harvester_config.monitor.checkInterval),
-                                            )
-                                            monitor_fifo.put((queue_name, work_specsToEnqueue), time.time() + check_delay)
-                                            main_log.debug("put workers to monitor FIFO")
-                                        submitted = True
-                                    # release jobs
-                                    self.dbProxy.release_jobs(pandaIDs, locked_by)
-                                    tmp_log.info("done")
-                                except Exception:
-                                    core_utils.dump_error_message(tmp_log)
-                # release the site
-                self.dbProxy.release_site(site_name, locked_by)
+                timeStart = time.monotonic()
+                submitted = self.submit_site(site_name, current_workers, res_map, locked_by)
+                stageStats.record("site", time.monotonic() - timeStart)
                 if sw_main.get_elapsed_time_in_sec() > queue_lock_interval:
                     main_log.warning(f"a submitter cycle was longer than queue_lock_interval {queue_lock_interval} sec" + sw_main.get_elapsed_time())
             main_log.debug("done")
@@ -421,11 +76,8 @@ class Submitter(AgentBase):
                 sleepTime = harvester_config.submitter.sleepTime
             else:
                 sleepTime = 0
-                if submitted and hasattr(harvester_config.submitter, "minSubmissionInterval"):
-                    interval = harvester_config.submitter.minSubmissionInterval
-                    if interval > 0:
-                        newTime = core_utils.naive_utcnow() + datetime.timedelta(seconds=interval)
-                        self.dbProxy.update_panda_queue_attribute("submitTime", newTime, site_name=site_name)
+                if submitted:
+                    self.postpone_submission(site_name)
 
             # time the cycle
             main_log.debug("done a submitter cycle" + sw_main.get_elapsed_time())
@@ -434,6 +86,458 @@ class Submitter(AgentBase):
                 main_log.debug("terminated")
                 return
 
+    # main loop to claim multiple sites and to process them concurrently
+    def run_pipelined(self, locked_by, queue_lock_interval, n_sites_in_parallel):
+        main_log = self.make_logger(_logger, f"id={locked_by}", method_name="run_pipelined")
+        main_log.debug(f"start with {n_sites_in_parallel} sites in parallel")
+        respect_sleep_time = getattr(harvester_config.submitter, "respectSleepTime", False)
+        # sites taking longer than this skip remaining queues. Sites stuck in a plugin call are reported, while they keep their slots until completion
+        site_timeout = getattr(harvester_config.submitter, "siteTimeout", queue_lock_interval)
+        # interval in sec to check sites in flight
+        check_interval = 10
+        # sites in flight; future: [site_name, start time, reported as timed out]
+        in_flight = dict()
+        next_claim_time = 0
+        with ThreadPoolExecutor(max_workers=n_sites_in_parallel) as executor:
+            while True:
+                # claim as many sites as free slots so that slow sites apply backpressure to claiming
+                n_free = n_sites_in_parallel - len(in_flight)
+                if n_free > 0 and time.monotonic() >= next_claim_time:
+                    timeStart = time.monotonic()
+                    site_list = self.dbProxy.get_sites_to_submit(
+                        harvester_config.submitter.lookupTime,
+                        harvester_config.submitter.lockInterval,
+                        locked_by,
+                        queue_lock_interval,
+                        n_free,
+                    )
+                    stageStats.record("get_sites_to_submit", time.monotonic() - timeStart, n_rows=len(site_list))
+                    main_log.debug(f"claimed {len(site_list)} sites with {n_free} free slots")
+                    for current_workers, site_name, res_map in site_list:
+                        future = executor.submit(self.submit_site, site_name, current_workers, res_map, locked_by, site_timeout)
+                        in_flight[future] = [site_name, time.monotonic(), False]
+                    # wait for sites to get ready when no more is available
+                    if len(site_list) < n_free or respect_sleep_time:
+                        next_claim_time = time.monotonic() + harvester_config.submitter.sleepTime
+                elif n_free == 0:
+                    main_log.debug("no free slot to claim sites")
+                if in_flight:
+                    # wait for sites to complete
+                    if next_claim_time > time.monotonic():
+                        timeout = min(check_interval, next_claim_time - time.monotonic())
+                    else:
+                        timeout = check_interval
+                    done, not_done = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        site_name, start_time, timed_out = in_flight.pop(future)
+                        elapsed = time.monotonic() - start_time
+                        try:
+                            submitted = future.result()
+                            stageStats.record("site", elapsed)
+                            main_log.debug(f"done site={site_name} in {elapsed:.3f} sec")
+                            if submitted and not respect_sleep_time:
+                                self.postpone_submission(site_name)
+                        except Exception:
+                            stageStats.record("site", elapsed, is_error=True)
+                            main_log.error(f"failed site={site_name}")
+                            core_utils.dump_error_message(main_log)
+                    # report slow sites
+                    for future in not_done:
+                        site_name, start_time, timed_out = in_flight[future]
+                        elapsed = time.monotonic() - start_time
+                        if not timed_out and elapsed > site_timeout:
+                            in_flight[future][2] = True
+                            stageStats.record("site_timeout", elapsed, is_error=True)
+                            main_log.warning(f"site={site_name} has been processed for {elapsed:.0f} sec longer than siteTimeout {site_timeout} sec")
+                    if self.terminated(0):
+                        break
+                elif self.terminated(max(next_claim_time - time.monotonic(), 0), randomize=False):
+                    break
+            main_log.debug(f"terminated. waiting for {len(in_flight)} sites in flight")
+
+    # postpone next submission to a site
+    def postpone_submission(self, site_name):
+        if hasattr(harvester_config.submitter, "minSubmissionInterval"):
+            interval = harvester_config.submitter.minSubmissionInterval
+            if interval > 0:
+                newTime = core_utils.naive_utcnow() + datetime.timedelta(seconds=interval)
+                self.dbProxy.update_panda_queue_attribute("submitTime", newTime, site_name=site_name)
+
+    # make and submit workers for queues associated to a site, and release the site. Queues are skipped once time_limit in sec is exceeded
+    def submit_site(self, site_name, current_workers, res_map, locked_by, time_limit=None):
+        sw_site = core_utils.get_stopwatch()
+        main_log = self.make_logger(_logger, f"id={locked_by} site={site_name}", method_name="submit_site")
+        main_log.debug(f"got {len(current_workers)} queues for site {site_name}")
+        submitted = False
+
+        # get commands from panda server
+        com_str = f"{CommandSpec.COM_setNWorkers}:{site_name}"
+        command_specs = self.dbProxy.get_commands_for_receiver("submitter", com_str)
+        main_log.debug(f"got {len(command_specs)} {com_str} commands")
+        for command_spec in command_specs:
+            new_limits = self.dbProxy.set_queue_limit(site_name, command_spec.params)
+            for _, tmp_jt_vals in new_limits.items():
+                res_map.setdefault(DEFAULT_JOB_TYPE, {})
+                for tmp_resource_type, tmp_new_val in tmp_jt_vals.items():
+                    # if available, overwrite new worker value with the command from panda server
+                    if tmp_resource_type in res_map[DEFAULT_JOB_TYPE]:
+                        tmp_queue_name = res_map[DEFAULT_JOB_TYPE][tmp_resource_type]
+                        if tmp_queue_name in current_workers:
+                            # pilot_type "ANY" to collect all nNewWorkers from the command
+                            current_workers[tmp_queue_name][DEFAULT_JOB_TYPE][tmp_resource_type]["ANY"]["nNewWorkers"] = tmp_new_val
+
+        # define number of new workers
+        if len(current_workers) == 0:
+            n_workers_per_queue_jt_rt = dict()
+        else:
+            timeStart = time.monotonic()
+            n_workers_per_queue_jt_rt = self.workerAdjuster.define_num_workers(current_workers, site_name)
+            stageStats.record("define_num_workers", time.monotonic() - timeStart, is_error=n_workers_per_queue_jt_rt is None)
+
+        if n_workers_per_queue_jt_rt is None:
+            main_log.error("WorkerAdjuster failed to define the number of workers")
+        elif len(n_workers_per_queue_jt_rt) == 0:
+            pass
+        else:
+            # loop over all queues and resource types
+            for queue_name in n_workers_per_queue_jt_rt:
+                # give up remaining queues to free the slot for other sites
+                if time_limit is not None and sw_site.get_elapsed_time_in_sec() > time_limit:
+                    main_log.warning(f"skipped {queue_name} and following queues since the site exceeded {time_limit} sec")
+                    stageStats.record("site_timeout", sw_site.get_elapsed_time_in_sec(), is_error=True)
+                    break
+                job_type = DEFAULT_JOB_TYPE
+                # get queue
+                queue_config = self.queue_configMapper.get_queue(queue_name)
+                workerMakerCore = self.workerMaker.get_plugin(queue_config)
+                for resource_type in n_workers_per_queue_jt_rt[queue_name][job_type]:
+                    for pilot_type in n_workers_per_queue_jt_rt[queue_name][job_type][resource_type]:
+                        tmp_val = n_workers_per_queue_jt_rt[queue_name][job_type][resource_type][pilot_type]
+                        # get prod_source_label from pilot_type for worker maker
+                        prod_source_label = core_utils.special_pilot_type_to_prod_source_label(pilot_type)
+                        tmp_log = self.make_logger(
+                            _logger,
+                            f"id={locked_by} queue={queue_name} jtype={job_type} rtype={resource_type} ptype={pilot_type}",
+                            method_name="run",
+                        )
+                        try:
+                            tmp_log.debug("start")
+                            tmp_log.debug(f"workers status: {tmp_val}")
+                            nWorkers = tmp_val["nNewWorkers"] + tmp_val["nReady"]
+                            nReady = tmp_val["nReady"]
+
+                            # check queue
+                            if not self.queue_configMapper.has_queue(queue_name):
+                                tmp_log.error("config not found")
+                                continue
+
+                            # no new workers
+                            if nWorkers == 0:
+                                tmp_log.debug("skipped since no new worker is needed based on current stats")
+                                continue
+                            # check if resource is ready
+                            if hasattr(workerMakerCore, "dynamicSizing") and workerMakerCore.dynamicSizing is True:
+                                numReadyResources = self.workerMaker.num_ready_resources(queue_config, job_type, resource_type, workerMakerCore)
+                                tmp_log.debug(f"numReadyResources: {numReadyResources}")
+                                if not numReadyResources:
+                                    if hasattr(workerMakerCore, "staticWorkers"):
+                                        nQRWorkers = tmp_val["nQueue"] + tmp_val["nRunning"]
+                                        tmp_log.debug(f"staticWorkers: {workerMakerCore.staticWorkers}, nQRWorkers(Queue+Running): {nQRWorkers}")
+                                        if nQRWorkers >= workerMakerCore.staticWorkers:
+                                            tmp_log.debug("No left static workers, skip")
+                                            continue
+                                        else:
+                                            nWorkers = min(workerMakerCore.staticWorkers - nQRWorkers, nWorkers)
+                                            tmp_log.debug(f"staticWorkers: {workerMakerCore.staticWorkers}, nWorkers: {nWorkers}")
+                                    else:
+                                        tmp_log.debug("skip since no resources are ready")
+                                        continue
+                                else:
+                                    nWorkers = min(nWorkers, numReadyResources)
+                            # post action of worker maker
+                            if hasattr(workerMakerCore, "skipOnFail") and workerMakerCore.skipOnFail is True:
+                                skipOnFail = True
+                            else:
+                                skipOnFail = False
+                            # actions based on mapping type
+                            timeStart = time.monotonic()
+                            if queue_config.mapType == WorkSpec.MT_NoJob:
+                                # workers without jobs
+                                jobChunks = []
+                                for i in range(nWorkers):
+                                    jobChunks.append([])
+                            elif queue_config.mapType == WorkSpec.MT_OneToOne:
+                                # one worker per one job
+                                jobChunks = self.dbProxy.get_job_chunks_for_workers(
+                                    queue_name,
+                                    nWorkers,
+                                    nReady,
+                                    1,
+                                    None,
+                                    queue_config.useJobLateBinding,
+                                    harvester_config.submitter.checkInterval,
+                                    harvester_config.submitter.lockInterval,
+                                    locked_by,
+                                )
+                            elif queue_config.mapType == WorkSpec.MT_MultiJobs:
+                                # one worker for multiple jobs
+                                nJobsPerWorker = self.workerMaker.get_num_jobs_per_worker(
+                                    queue_config, nWorkers, job_type, resource_type, maker=workerMakerCore
+                                )
+                                tmp_log.debug(f"nJobsPerWorker={nJobsPerWorker}")
+                                jobChunks = self.dbProxy.get_job_chunks_for_workers(
+                                    queue_name,
+                                    nWorkers,
+                                    nReady,
+                                    nJobsPerWorker,
+                                    None,
+                                    queue_config.useJobLateBinding,
+                                    harvester_config.submitter.checkInterval,
+                                    harvester_config.submitter.lockInterval,
+                                    locked_by,
+                                    queue_config.allowJobMixture,
+                                )
+                            elif queue_config.mapType == WorkSpec.MT_MultiWorkers:
+                                # multiple workers for one job
+                                nWorkersPerJob = self.workerMaker.get_num_workers_per_job(
+                                    queue_config, nWorkers, job_type, resource_type, maker=workerMakerCore
+                                )
+                                maxWorkersPerJob = self.workerMaker.get_max_workers_per_job_in_total(
+                                    queue_config, job_type, resource_type, maker=workerMakerCore
+                                )
+                                maxWorkersPerJobPerCycle = self.workerMaker.get_max_workers_per_job_per_cycle(
+                                    queue_config, job_type, resource_type, maker=workerMakerCore
+                                )
+                                tmp_log.debug(f"nWorkersPerJob={nWorkersPerJob}")
+                                jobChunks = self.dbProxy.get_job_chunks_for_workers(
+                                    queue_name,
+                                    nWorkers,
+                                    nReady,
+                                    None,
+                                    nWorkersPerJob,
+                                    queue_config.useJobLateBinding,
+                                    harvester_config.submitter.checkInterval,
+                                    harvester_config.submitter.lockInterval,
+                                    locked_by,
+                                    max_workers_per_job_in_total=maxWorkersPerJob,
+                                    max_workers_per_job_per_cycle=maxWorkersPerJobPerCycle,
+                                )
+                            else:
+                                tmp_log.error(f"unknown mapType={queue_config.mapType}")
+                                continue
+
+                            stageStats.record("get_job_chunks", time.monotonic() - timeStart, n_rows=len(jobChunks))
+                            tmp_log.debug(f"got {len(jobChunks)} job chunks")
+                            if len(jobChunks) == 0:
+                                continue
+                            # make workers
+                            timeStart = time.monotonic()
+                            okChunks, ngChunks = self.workerMaker.make_workers(
+                                jobChunks,
+                                queue_config,
+                                nReady,
+                                job_type,
+                                resource_type,
+                                prod_source_label=prod_source_label,
+                                maker=workerMakerCore,
+                            )
+
+                            stageStats.record("make_workers", time.monotonic() - timeStart, n_rows=len(okChunks), is_error=len(ngChunks) > 0)
+                            if len(ngChunks) == 0:
+                                tmp_log.debug(f"successfully made {len(okChunks)} workers")
+                            else:
+                                tmp_log.debug(f"made {len(okChunks)} workers, while {len(ngChunks)} workers failed")
+                            timeNow = core_utils.naive_utcnow()
+                            timeNow_timestamp = time.time()
+                            pandaIDs = set()
+                            # NG (=not good)
+                            for ngJobs in ngChunks:
+                                for job_spec in ngJobs:
+                                    if skipOnFail:
+                                        # release jobs when workers are not made
+                                        pandaIDs.add(job_spec.PandaID)
+                                    else:
+                                        job_spec.status = "failed"
+                                        job_spec.subStatus = "failed_to_make"
+                                        job_spec.stateChangeTime = timeNow
+                                        job_spec.locked_by = None
+                                        errStr = "failed to make a worker"
+                                        job_spec.set_pilot_error(PilotErrors.SETUPFAILURE, errStr)
+                                        job_spec.trigger_propagation()
+                                        self.dbProxy.update_job(job_spec, {"locked_by": locked_by, "subStatus": "prepared"})
+                            # OK
+                            work_specList = []
+                            if len(okChunks) > 0:
+                                for work_spec, okJobs in okChunks:
+                                    # has job
+                                    if (queue_config.useJobLateBinding and work_spec.workerID is None) or queue_config.mapType == WorkSpec.MT_NoJob:
+                                        work_spec.hasJob = 0
+                                    else:
+                                        work_spec.hasJob = 1
+                                        if work_spec.nJobsToReFill in [None, 0]:
+                                            work_spec.set_jobspec_list(okJobs)
+                                        else:
+                                            # refill free slots during the worker is running
+                                            work_spec.set_jobspec_list(okJobs[: work_spec.nJobsToReFill])
+                                            work_spec.nJobsToReFill = None
+                                            for job_spec in okJobs[work_spec.nJobsToReFill :]:
+                                                pandaIDs.add(job_spec.PandaID)
+                                        work_spec.set_num_jobs_with_list()
+                                    # map type
+                                    work_spec.mapType = queue_config.mapType
+                                    # queue name
+                                    work_spec.computingSite = queue_config.queueName
+                                    # set access point
+                                    work_spec.accessPoint = queue_config.messenger["accessPoint"]
+                                    # sync level
+                                    work_spec.syncLevel = queue_config.get_synchronization_level()
+                                    # events
+                                    if len(okJobs) > 0 and (
+                                        "eventService" in okJobs[0].jobParams or "cloneJob" in okJobs[0].jobParams or "isHPO" in okJobs[0].jobParams
+                                    ):
+                                        work_spec.eventsRequest = WorkSpec.EV_useEvents
+                                    work_specList.append(work_spec)
+                            if len(work_specList) > 0:
+                                sw = core_utils.get_stopwatch()
+                                # get plugin for submitter
+                                submitterCore = self.pluginFactory.get_plugin(queue_config.submitter)
+                                if submitterCore is None:
+                                    # not found
+                                    tmp_log.error(f"submitter plugin for {job_spec.computingSite} not found")
+                                    continue
+                                # get plugin for messenger
+                                messenger = self.pluginFactory.get_plugin(queue_config.messenger)
+                                if messenger is None:
+                                    # not found
+                                    tmp_log.error(f"messenger plugin for {job_spec.computingSite} not found")
+                                    continue
+                                # setup access points
+                                messenger.setup_access_points(work_specList)
+                                # feed jobs
+                                for work_spec in work_specList:
+                                    if work_spec.hasJob == 1:
+                                        tmpStat = messenger.feed_jobs(work_spec, work_spec.get_jobspec_list())
+                                        if tmpStat is False:
+                                            tmp_log.error(f"failed to send jobs to workerID={work_spec.workerID}")
+                                        else:
+                                            tmp_log.debug(f"sent jobs to workerID={work_spec.workerID} with {tmpStat}")
+                                # insert workers
+                                self.dbProxy.insert_workers(work_specList, locked_by)
+                                # submit
+                                sw.reset()
+                                tmp_log.info(f"submitting {len(work_specList)} workers")
+                                work_specList, tmpRetList, tmpStrList = self.submit_workers(submitterCore, work_specList)
+                                stageStats.record("submit_workers", sw.get_elapsed_time_in_sec(), n_rows=len(work_specList), is_error=not all(tmpRetList))
+                                tmp_log.debug(f"done submitting {len(work_specList)} workers" + sw.get_elapsed_time())
+                                sw.reset()
+                                # collect successful jobs
+                                okPandaIDs = set()
+                                for iWorker, (tmpRet, tmpStr) in enumerate(zip(tmpRetList, tmpStrList)):
+                                    if tmpRet:
+                                        work_spec, jobList = okChunks[iWorker]
+                                        jobList = work_spec.get_jobspec_list()
+                                        if jobList is not None:
+                                            for job_spec in jobList:
+                                                okPandaIDs.add(job_spec.PandaID)
+                                # loop over all workers
+                                for iWorker, (tmpRet, tmpStr) in enumerate(zip(tmpRetList, tmpStrList)):
+                                    work_spec, jobList = okChunks[iWorker]
+                                    # set harvesterHost
+                                    work_spec.harvesterHost = socket.gethostname()
+                                    # use associated job list since it can be truncated for re-filling
+                                    jobList = work_spec.get_jobspec_list()
+                                    # set status
+                                    if not tmpRet:
+                                        # failed submission
+                                        errStr = f"failed to submit a workerID={work_spec.workerID} with {tmpStr}"
+                                        tmp_log.error(errStr)
+                                        work_spec.set_status(WorkSpec.ST_missed)
+                                        work_spec.set_dialog_message(tmpStr)
+                                        work_spec.set_pilot_error(PilotErrors.SETUPFAILURE, errStr)
+                                        work_spec.set_pilot_closed()
+                                        if jobList is not None:
+                                            # increment attempt number
+                                            newJobList = []
+                                            for job_spec in jobList:
+                                                # skip if successful with another worker
+                                                if job_spec.PandaID in okPandaIDs:
+                                                    continue
+                                                if job_spec.submissionAttempts is None:
+                                                    job_spec.submissionAttempts = 0
+                                                job_spec.submissionAttempts += 1
+                                                # max attempt or permanent error
+                                                if tmpRet is False or job_spec.submissionAttempts >= queue_config.maxSubmissionAttempts:
+                                                    newJobList.append(job_spec)
+                                                else:
+                                                    self.dbProxy.increment_submission_attempt(job_spec.PandaID, job_spec.submissionAttempts)
+                                            jobList = newJobList
+                                    elif queue_config.useJobLateBinding and work_spec.hasJob == 1:
+                                        # directly go to running after feeding jobs for late biding
+                                        work_spec.set_status(WorkSpec.ST_running)
+                                    else:
+                                        # normal successful submission
+                                        work_spec.set_status(WorkSpec.ST_submitted)
+                                    work_spec.submitTime = timeNow
+                                    work_spec.modificationTime = timeNow
+                                    work_spec.checkTime = timeNow
+                                    if self.monitor_fifo.enabled:
+                                        work_spec.set_work_params({"lastCheckAt": timeNow_timestamp})
+                                    # prefetch events
+                                    if tmpRet and work_spec.hasJob == 1 and work_spec.eventsRequest == WorkSpec.EV_useEvents and queue_config.prefetchEvents:
+                                        work_spec.eventsRequest = WorkSpec.EV_requestEvents
+                                        eventsRequestParams = dict()
+                                        for job_spec in jobList:
+                                            eventsRequestParams[job_spec.PandaID] = {
+                                                "pandaID": job_spec.PandaID,
+                                                "taskID": job_spec.taskID,
+                                                "jobsetID": job_spec.jobParams["jobsetID"],
+                                                "nRanges": max(int(math.ceil(work_spec.nCore / len(jobList))), job_spec.jobParams["coreCount"])
+                                                * queue_config.initEventsMultipler,
+                                            }
+                                            if "isHPO" in job_spec.jobParams:
+                                                if "sourceURL" in job_spec.jobParams:
+                                                    sourceURL = job_spec.jobParams["sourceURL"]
+                                                else:
+                                                    sourceURL = None
+                                                eventsRequestParams[job_spec.PandaID].update({"isHPO": True, "jobsetID": 0, "sourceURL": sourceURL})
+                                        work_spec.eventsRequestParams = eventsRequestParams
+                                    # register worker
+                                    tmpStat = self.dbProxy.register_worker(work_spec, jobList, locked_by)
+                                    if jobList is not None:
+                                        for job_spec in jobList:
+                                            pandaIDs.add(job_spec.PandaID)
+                                            if tmpStat:
+                                                if tmpRet:
+                                                    tmpStr = "submitted a workerID={0} for PandaID={1} with submissionHost={2} batchID={3}"
+                                                    tmp_log.info(
+                                                        tmpStr.format(work_spec.workerID, job_spec.PandaID, work_spec.submissionHost, work_spec.batchID)
+                                                    )
+                                                else:
+                                                    tmpStr = "failed to submit a workerID={0} for PandaID={1}"
+                                                    tmp_log.error(tmpStr.format(work_spec.workerID, job_spec.PandaID))
+                                            else:
+                                                tmpStr = "failed to register a worker for PandaID={0} with submissionHost={1} batchID={2}"
+                                                tmp_log.error(tmpStr.format(job_spec.PandaID, work_spec.submissionHost, work_spec.batchID))
+                                stageStats.record("register_workers", sw.get_elapsed_time_in_sec(), n_rows=len(work_specList))
+                                # enqueue to monitor fifo
+                                if self.monitor_fifo.enabled and queue_config.mapType != WorkSpec.MT_MultiWorkers:
+                                    work_specsToEnqueue = [[w] for w in work_specList if w.status in (WorkSpec.ST_submitted, WorkSpec.ST_running)]
+                                    check_delay = min(
+                                        getattr(harvester_config.monitor, "eventBasedCheckInterval", harvester_config.monitor.checkInterval),
+                                        getattr(harvester_config.monitor, "fifoCheckInterval", harvester_config.monitor.checkInterval),
+                                    )
+                                    self.monitor_fifo.put((queue_name, work_specsToEnqueue), time.time() + check_delay)
+                                    main_log.debug("put workers to monitor FIFO")
+                                submitted = True
+                            # release jobs
+                            self.dbProxy.release_jobs(pandaIDs, locked_by)
+                            tmp_log.info("done")
+                        except Exception:
+                            core_utils.dump_error_message(tmp_log)
+        # release the site
+        self.dbProxy.release_site(site_name, locked_by)
+        return submitted
+
     # wrapper for submitWorkers to skip ready workers
     def submit_workers(self, submitter_core, workspec_list):
         retList = []
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from os import walk
 
 from pandaharvester.harvesterbody.agent_base import AgentBase
@@ -163,21 +164,15 @@ class Sweeper(AgentBase):
                         core_utils.dump_error_message(main_log)
                     main_log.debug("made sure workers to clean up are all terminated")
                     # start cleanup
-                    for workspec in workspec_list:
-                        tmp_log = self.make_logger(_logger, f"workerID={workspec.workerID}", method_name="run")
-                        try:
-                            tmp_log.debug("start cleaning up one worker")
-                            # sweep worker
-                            tmp_stat, tmp_out = sweeper_core.sweep_worker(workspec)
-                            tmp_log.debug(f"swept_worker with status={tmp_stat} diag={tmp_out}")
-                            tmp_log.debug("start messenger cleanup")
-                            mc_tmp_stat, mc_tmp_out = messenger.clean_up(workspec)
-                            tmp_log.debug(f"messenger cleaned up with status={mc_tmp_stat} diag={mc_tmp_out}")
-                            if tmp_stat:
-                                self.dbProxy.delete_worker(workspec.workerID)
-                        except Exception:
-                            core_utils.dump_error_message(tmp_log)
-                    main_log.debug(f"done cleaning up {n_workers} workers" + sw.get_elapsed_time())
+                    n_threads = min(getattr(harvester_config.sweeper, "nThreadsForCleanup", 1), n_workers)
+                    if n_threads > 1:
+                        # remove directories of workers in parallel
+                        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                            list(pool.map(lambda workspec: self.clean_up_worker(sweeper_core, messenger, workspec), workspec_list))
+                    else:
+                        for workspec in workspec_list:
+                            self.clean_up_worker(sweeper_core, messenger, workspec)
+                    main_log.debug(f"done cleaning up {n_workers} workers with {max(n_threads, 1)} threads" + sw.get_elapsed_time())
             main_log.debug("done all cleanup" + sw_cleanup.get_elapsed_time())
 
             # old-job-deletion stage
@@ -236,9 +231,33 @@ class Sweeper(AgentBase):
                                         break
                     except Exception:
                         core_utils.dump_error_message(main_log)
+            # reconcile the summary table of worker counts
+            if self.dbProxy.use_worker_count_summary():
+                reconcile_interval = getattr(harvester_config.db, "workerCountReconcileInterval", 21600)
+                locked = self.dbProxy.get_process_lock("worker_count", self.get_pid(), reconcile_interval)
+                if locked:
+                    sw_reconcile = core_utils.get_stopwatch()
+                    self.dbProxy.reconcile_worker_counts()
+                    main_log.debug("done reconciliation of worker counts" + sw_reconcile.get_elapsed_time())
             # time the cycle
             main_log.debug("done a sweeper cycle" + sw_main.get_elapsed_time())
             # check if being terminated
             if self.terminated(harvester_config.sweeper.sleepTime):
                 main_log.debug("terminated")
                 return
+
+    # clean up a worker
+    def clean_up_worker(self, sweeper_core, messenger, workspec):
+        tmp_log = self.make_logger(_logger, f"workerID={workspec.workerID}", method_name="run")
+        try:
+            tmp_log.debug("start cleaning up one worker")
+            # sweep worker
+            tmp_stat, tmp_out = sweeper_core.sweep_worker(workspec)
+            tmp_log.debug(f"swept_worker with status={tmp_stat} diag={tmp_out}")
+            tmp_log.debug("start messenger cleanup")
+            mc_tmp_stat, mc_tmp_out = messenger.clean_up(workspec)
+            tmp_log.debug(f"messenger cleaned up with status={mc_tmp_stat} diag={mc_tmp_out}")
+            if tmp_stat:
+                self.dbProxy.delete_worker(workspec.workerID)
+        except Exception:
+            core_utils.dump_error_message(tmp_log)
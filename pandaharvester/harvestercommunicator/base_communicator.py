@@ -75,3 +75,7 @@ class BaseCommunicator(metaclass=abc.ABCMeta):
     # force credential renewal
     def force_credential_renewal(self):
         return True
+
+    # get connection statistics
+    def get_connection_stats(self):
+        return {}
@@ -10,10 +10,15 @@ try:
     ssl.HAS_SNI = False
 except Exception:
     pass
+import copy
 import datetime
+import gzip
 import json
 import os
+import random
 import sys
+import threading
+import time
 import traceback
 import uuid
 import zlib
@@ -27,7 +32,13 @@ try:
 except Exception:
     pass
 
-from pandacommon.pandautils.net_utils import get_http_adapter_with_random_dns_resolution
+from pandacommon.pandautils.net_utils import (
+    HTTPAdapterWithRandomDnsResolver,
+    replace_hostname_in_url,
+    resolve_host_in_url,
+)
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 from pandaharvester.harvesterconfig import harvester_config
 from pandaharvester.harvestercore import core_utils
@@ -35,6 +46,100 @@ from pandaharvester.harvestermisc import idds_utils
 
 from .base_communicator import BaseCommunicator
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# counters of the endpoint which the current thread is talking to
+_active_stats = threading.local()
+
+
+# HTTPS connection pool to count TLS handshakes
+class HTTPSConnectionPoolWithStats(HTTPSConnectionPool):
+    def _validate_conn(self, conn):
+        to_connect = getattr(conn, "sock", None) is None
+        sw = core_utils.get_stopwatch()
+        HTTPSConnectionPool._validate_conn(self, conn)
+        if to_connect:
+            stats = getattr(_active_stats, "stats", None)
+            if stats is not None:
+                stats["n_handshakes"] += 1
+                stats["handshake_time"] += sw.get_elapsed_time_in_sec()
+
+
+# HTTP adapter with bounded connection pools which count TLS handshakes
+class HTTPAdapterWithStats(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": HTTPConnectionPool, "https": HTTPSConnectionPoolWithStats}
+
+
+# HTTP adapter with randomized DNS resolution and connection pools which count TLS handshakes
+class HTTPAdapterWithRandomDnsResolverAndStats(HTTPAdapterWithRandomDnsResolver):
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapterWithRandomDnsResolver.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": HTTPConnectionPool, "https": HTTPSConnectionPoolWithStats}
+
+    # get connection to random host for newer requests which no longer use get_connection
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        dns_records = resolve_host_in_url(request.url)
+        random.shuffle(dns_records)
+        err = None
+        for hostname in dns_records:
+            tmp_request = request.copy()
+            tmp_request.url = replace_hostname_in_url(request.url, hostname)
+            try:
+                con = HTTPAdapter.get_connection_with_tls_context(self, tmp_request, verify, proxies=proxies, cert=cert)
+                if con is not None:
+                    return con
+            except Exception as e:
+                err = e
+        if err is not None:
+            raise err
+        return None
+
+
+# period in seconds to keep an encoding negotiated with the server before trying the configured one again
+_negotiation_lifetime = 3600
+
+
+# compress a request body
+def compress_request_body(body, algorithm):
+    if algorithm == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+# parse configuration per endpoint like "path1:value1,path2:value2,*:value_for_others". A bare value is for all endpoints
+def parse_endpoint_config(config_value, value_type):
+    ret_map = {}
+    if config_value is None or config_value == "":
+        return ret_map
+    for tmp_item in str(config_value).split(","):
+        tmp_item = tmp_item.strip()
+        if not tmp_item:
+            continue
+        if ":" in tmp_item:
+            tmp_path, tmp_value = tmp_item.rsplit(":", 1)
+        else:
+            tmp_path, tmp_value = "*", tmp_item
+        ret_map[tmp_path.strip()] = value_type(tmp_value.strip())
+    return ret_map
+
+
+# make a session with bounded connection pools
+def make_http_session(max_hosts, max_connections_per_host):
+    session = requests.Session()
+    # no randomization if panda is behind real load balancer than DNS LB
+    if "PANDA_BEHIND_REAL_LB" in os.environ:
+        adapter = HTTPAdapterWithStats(pool_connections=max_hosts, pool_maxsize=max_connections_per_host, max_retries=0)
+    else:
+        adapter = HTTPAdapterWithRandomDnsResolverAndStats(pool_connections=max_hosts, pool_maxsize=max_connections_per_host, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
 # connection class
 class PandaCommunicator(BaseCommunicator):
@@ -98,6 +203,28 @@ class PandaCommunicator(BaseCommunicator):
 
         # mapping between base URL and host
         self.base_url_host_map = {}
+
+        # persistent connections
+        self.keep_alive = getattr(harvester_config.pandacon, "keep_alive", False)
+        self.max_hosts = getattr(harvester_config.pandacon, "max_hosts", 10)
+        self.max_connections_per_host = getattr(harvester_config.pandacon, "max_connections_per_host", 2)
+        self.connection_idle_timeout = getattr(harvester_config.pandacon, "connection_idle_timeout", 30)
+        self.connection_max_lifetime = getattr(harvester_config.pandacon, "connection_max_lifetime", 600)
+        self.session = None
+        self.session_creation_time = None
+        self.session_last_used = None
+        self.session_to_reset = False
+        # counters per endpoint
+        self.connection_stats = {}
+        self.connection_stats_lock = threading.Lock()
+
+        # compression algorithm of request bodies and max size of uncompressed bulk request bodies per endpoint
+        self.request_compression = parse_endpoint_config(getattr(harvester_config.pandacon, "request_compression", None), str)
+        self.request_compression_min_size = getattr(harvester_config.pandacon, "request_compression_min_size", 1024)
+        self.max_request_size = parse_endpoint_config(getattr(harvester_config.pandacon, "max_request_size", None), int)
+        # encodings negotiated with the server per endpoint; path -> (algorithm or None, time)
+        self.negotiated_compression = {}
+
         # renew token
         try:
             self.renew_token()
@@ -107,9 +234,10 @@ class PandaCommunicator(BaseCommunicator):
     # force token renewal
     def force_credential_renewal(self):
         """
-        Unset timestamp to trigger token renewal
+        Unset timestamp to trigger token renewal, and drop persistent connections at the next request to use new credentials
         """
         self.auth_token_last_update = None
+        self.session_to_reset = True
 
     # renew token
     def renew_token(self):
@@ -157,6 +285,151 @@ class PandaCommunicator(BaseCommunicator):
         else:
             return self.auth_type, self.cert_file, self.key_file, self.ca_cert, self.auth_token
 
+    # get HTTP session
+    def get_session(self):
+        """
+        Get a session to send a request. A new session is made for each request unless keep_alive is set in pandacon.
+        The persistent session is recycled when it is idle or old, or when credentials are renewed, so that hosts are
+        resolved again and new connections use the new credentials
+
+        Returns:
+            requests.Session: session object
+        """
+        if not self.keep_alive:
+            return make_http_session(self.max_hosts, self.max_connections_per_host)
+        time_now = time.monotonic()
+        if self.session is not None and (
+            self.session_to_reset
+            or time_now - self.session_last_used > self.connection_idle_timeout
+            or time_now - self.session_creation_time > self.connection_max_lifetime
+        ):
+            self.close_session()
+        if self.session is None:
+            self.session = make_http_session(self.max_hosts, self.max_connections_per_host)
+            self.session_creation_time = time_now
+            self.session_to_reset = False
+        self.session_last_used = time_now
+        return self.session
+
+    # close persistent session
+    def close_session(self):
+        if self.session is not None:
+            try:
+                self.session.close()
+            except Exception:
+                pass
+        self.session = None
+
+    # get counters of an endpoint
+    def get_endpoint_stats(self, path: str) -> dict:
+        with self.connection_stats_lock:
+            if path not in self.connection_stats:
+                self.connection_stats[path] = {
+                    "n_requests": 0,
+                    "n_handshakes": 0,
+                    "handshake_time": 0.0,
+                    "request_time": 0.0,
+                    "bytes_raw": 0,
+                    "bytes_sent": 0,
+                    "n_compression_rejected": 0,
+                }
+            return self.connection_stats[path]
+
+    # get connection statistics
+    def get_connection_stats(self) -> dict:
+        """
+        Get counters of requests and TLS handshakes per endpoint
+
+        Returns:
+            dict: endpoint path -> {"n_requests", "n_handshakes", "handshake_time", "request_time", "bytes_raw", "bytes_sent",
+                                    "n_compression_rejected"}, where bytes_raw and bytes_sent are sizes of request bodies
+                                    before and after compression
+        """
+        with self.connection_stats_lock:
+            return copy.deepcopy(self.connection_stats)
+
+    # get compression algorithm for request bodies to an endpoint
+    def get_request_compression(self, path: str) -> str:
+        """
+        Get the compression algorithm for request bodies to an endpoint. The algorithm negotiated with the server is used
+        for a while if the server rejected the configured one. zstd falls back to gzip when zstandard is unavailable
+
+        Args:
+            path: endpoint path
+
+        Returns:
+            str: gzip, zstd, or None not to compress
+        """
+        negotiated = self.negotiated_compression.get(path)
+        if negotiated is not None:
+            algorithm, negotiation_time = negotiated
+            if time.monotonic() - negotiation_time < _negotiation_lifetime:
+                return algorithm
+            # expired. Other threads could have removed it already
+            self.negotiated_compression.pop(path, None)
+        algorithm = self.request_compression.get(path, self.request_compression.get("*"))
+        if algorithm not in ("gzip", "zstd"):
+            return None
+        if algorithm == "zstd" and zstandard is None:
+            return "gzip"
+        return algorithm
+
+    # negotiate compression algorithm with the server
+    def negotiate_request_compression(self, path: str, accept_encoding: str, rejected_algorithm: str) -> str:
+        """
+        Choose an algorithm after the server rejected a compressed body with 415, using Accept-Encoding in the response as per RFC 7694
+
+        Args:
+            path: endpoint path
+            accept_encoding: Accept-Encoding header of the response
+            rejected_algorithm: algorithm rejected by the server
+
+        Returns:
+            str: gzip, zstd, or None not to compress
+        """
+        accepted = set()
+        if accept_encoding:
+            for tmp_item in accept_encoding.split(","):
+                accepted.add(tmp_item.split(";")[0].strip().lower())
+        algorithm = None
+        for tmp_algorithm in ("zstd", "gzip"):
+            if tmp_algorithm == rejected_algorithm or (tmp_algorithm == "zstd" and zstandard is None):
+                continue
+            if tmp_algorithm in accepted:
+                algorithm = tmp_algorithm
+                break
+        self.negotiated_compression[path] = (algorithm, time.monotonic())
+        return algorithm
+
+    # split items of a bulk request into shards
+    def make_request_shards(self, path: str, items: list, max_items: int = None) -> list:
+        """
+        Split items of a bulk request into shards so that each shard has at most max_items items and its JSON is
+        not larger than max_request_size configured for the endpoint. A single item larger than the limit makes its own shard
+
+        Args:
+            path: endpoint path
+            items: list of JSON-serializable items
+            max_items: max number of items in a shard. None for no limit
+
+        Returns:
+            list: list of (start index, end index) of shards
+        """
+        max_size = self.max_request_size.get(path, self.max_request_size.get("*"))
+        shards = []
+        i_start = 0
+        shard_size = 0
+        for i_item, item in enumerate(items):
+            item_size = len(json.dumps(item)) + 1 if max_size else 0
+            if i_item > i_start and ((max_items and i_item - i_start >= max_items) or (max_size and shard_size + item_size > max_size)):
+                shards.append((i_start, i_item))
+                i_start = i_item
+                shard_size = 0
+            shard_size += item_size
+        if i_start < len(items):
+            shards.append((i_start, len(items)))
+        return shards
+
     def request_ssl(self, method: str, path: str, data: dict = None, files: dict = None, cert: tuple[str, str] = None, base_url: str = None):
         """
         Generic HTTPS request function for GET, POST, and file uploads.
@@ -191,7 +464,9 @@ class PandaCommunicator(BaseCommunicator):
             if self.verbose:
                 tmp_log.debug(f"exec={tmp_exec} URL={url} data={data} files={files}")
 
-            headers = {"Accept": "application/json", "Connection": "close"}
+            headers = {"Accept": "application/json"}
+            if not self.keep_alive:
+                headers["Connection"] = "close"
             if auth_type == "oidc":
                 self.renew_token()
                 cert = None
@@ -201,20 +476,58 @@ class PandaCommunicator(BaseCommunicator):
                 if cert is None:
                     cert = (cert_file, key_file)
 
-            session = get_http_adapter_with_random_dns_resolution()
+            session = self.get_session()
+            endpoint_stats = self.get_endpoint_stats(path)
             sw = core_utils.get_stopwatch()
 
             # Determine request type
-            if method == "GET":
-                # URL encoding
-                response = session.request(method, url, params=data, headers=headers, timeout=harvester_config.pandacon.timeout, verify=ca_cert, cert=cert)
-            elif method == "POST":
-                # JSON encoding in body
-                headers["Content-Type"] = "application/json"
-                response = session.request(method, url, json=data, headers=headers, timeout=harvester_config.pandacon.timeout, verify=ca_cert, cert=cert)
-            if method == "UPLOAD":
-                # Upload files
-                response = session.post(url, files=files, headers=headers, timeout=harvester_config.pandacon.timeout, verify=ca_cert, cert=cert)
+            _active_stats.stats = endpoint_stats
+            try:
+                if method == "GET":
+                    # URL encoding
+                    response = session.request(method, url, params=data, headers=headers, timeout=harvester_config.pandacon.timeout, verify=ca_cert, cert=cert)
+                elif method == "POST":
+                    # JSON encoding in body
+                    headers["Content-Type"] = "application/json"
+                    raw_body = json.dumps(data, allow_nan=False).encode("utf-8")
+                    algorithm = self.get_request_compression(path) if len(raw_body) >= self.request_compression_min_size else None
+                    retried = False
+                    while True:
+                        if algorithm is None:
+                            body = raw_body
+                            headers.pop("Content-Encoding", None)
+                        else:
+                            body = compress_request_body(raw_body, algorithm)
+                            headers["Content-Encoding"] = algorithm
+                        endpoint_stats["bytes_raw"] += len(raw_body)
+                        endpoint_stats["bytes_sent"] += len(body)
+                        response = session.request(
+                            method, url, data=body, headers=headers, timeout=harvester_config.pandacon.timeout, verify=ca_cert, cert=cert
+                        )
+                        # the server does not accept the encoding. Retried with the negotiated encoding, and then without compression
+                        if algorithm is not None and response.status_code == 415:
+                            endpoint_stats["n_compression_rejected"] += 1
+                            if not retried:
+                                algorithm = self.negotiate_request_compression(path, response.headers.get("Accept-Encoding"), algorithm)
+                                retried = True
+                            else:
+                                algorithm = None
+                                self.negotiated_compression[path] = (None, time.monotonic())
+                            continue
+                        break
+                if method == "UPLOAD":
+                    # Upload files
+                    response = session.post(url, files=files, headers=headers, timeout=harvester_config.pandacon.timeout, verify=ca_cert, cert=cert)
+            except Exception:
+                # reconnect at the next request
+                self.session_to_reset = True
+                raise
+            finally:
+                _active_stats.stats = None
+                endpoint_stats["n_requests"] += 1
+                endpoint_stats["request_time"] += sw.get_elapsed_time_in_sec()
+                if not self.keep_alive:
+                    session.close()
 
             if self.verbose:
                 tmp_log.debug(f"exec={tmp_exec} code={response.status_code} {sw.get_elapsed_time()}. return={response.text}")
@@ -345,46 +658,45 @@ class PandaCommunicator(BaseCommunicator):
                         if ret_value in [True, False] and event_spec.is_final_status():
                             event_spec.subStatus = "done"
 
-        # update jobs in bulk
-        n_lookup = 100
-        i_lookup = 0
-        while i_lookup < len(jobspec_list):
+        # prepare job data
+        job_dict_list = []
+        for job_spec in jobspec_list:
+            # pre-fill job data
+            # TODO: this function needs to be reviewed, since now we changed the names
+            job_dict = job_spec.get_job_attributes_for_panda()
+
+            # basic fields
+            job_dict["job_id"] = job_spec.PandaID
+            job_dict["site_name"] = job_spec.computingSite
+            job_dict["job_status"] = job_spec.get_status()
+            job_dict["job_sub_status"] = job_spec.subStatus
+            job_dict["attempt_nr"] = job_spec.attemptNr
+
+            # change cancelled/missed to failed to be accepted by panda server
+            if job_dict["job_status"] in ["cancelled", "missed"]:
+                if job_spec.is_pilot_closed():
+                    job_dict["job_sub_status"] = "pilot_closed"
+                else:
+                    job_dict["job_sub_status"] = job_dict["job_status"]
+                job_dict["job_status"] = "failed"
 
-            # break down the jobspec_list into chunks of n_lookup
-            job_list = []
-            jobspec_shard = jobspec_list[i_lookup : i_lookup + n_lookup]
-            for job_spec in jobspec_shard:
-
-                # pre-fill job data
-                # TODO: this function needs to be reviewed, since now we changed the names
-                job_dict = job_spec.get_job_attributes_for_panda()
-
-                # basic fields
-                job_dict["job_id"] = job_spec.PandaID
-                job_dict["site_name"] = job_spec.computingSite
-                job_dict["job_status"] = job_spec.get_status()
-                job_dict["job_sub_status"] = job_spec.subStatus
-                job_dict["attempt_nr"] = job_spec.attemptNr
-
-                # change cancelled/missed to failed to be accepted by panda server
-                if job_dict["job_status"] in ["cancelled", "missed"]:
-                    if job_spec.is_pilot_closed():
-                        job_dict["job_sub_status"] = "pilot_closed"
-                    else:
-                        job_dict["job_sub_status"] = job_dict["job_status"]
-                    job_dict["job_status"] = "failed"
+            if "core_count" not in job_dict and job_spec.nCore is not None:
+                job_dict["core_count"] = job_spec.nCore
 
-                if "core_count" not in job_dict and job_spec.nCore is not None:
-                    job_dict["core_count"] = job_spec.nCore
+            # for jobs in final status we upload metadata and the job output report
+            if job_spec.is_final_status() and job_spec.status == job_spec.get_status():
+                if job_spec.metaData is not None:
+                    job_dict["meta_data"] = json.dumps(job_spec.metaData)
+                if job_spec.outputFilesToReport is not None:
+                    job_dict["job_output_report"] = job_spec.outputFilesToReport
 
-                # for jobs in final status we upload metadata and the job output report
-                if job_spec.is_final_status() and job_spec.status == job_spec.get_status():
-                    if job_spec.metaData is not None:
-                        job_dict["meta_data"] = json.dumps(job_spec.metaData)
-                    if job_spec.outputFilesToReport is not None:
-                        job_dict["job_output_report"] = job_spec.outputFilesToReport
+            job_dict_list.append(job_dict)
 
-                job_list.append(job_dict)
+        # update jobs in bulk with at most n_lookup jobs and max_request_size bytes in one request
+        n_lookup = 100
+        for i_start, i_end in self.make_request_shards("pilot/update_jobs_bulk", job_dict_list, n_lookup):
+            job_list = job_dict_list[i_start:i_end]
+            jobspec_shard = jobspec_list[i_start:i_end]
 
             # data dictionary to be sent to PanDA server
             data = {"job_list": job_list, "harvester_id": harvester_config.master.harvester_id}
@@ -430,8 +742,6 @@ class PandaCommunicator(BaseCommunicator):
 
                 ret_list.append(job_ret_map)
 
-            i_lookup += n_lookup
-
         tmp_logger.debug(f"Done. Took {sw.get_elapsed_time()} seconds")
         return ret_list
 
@@ -772,33 +1082,46 @@ class PandaCommunicator(BaseCommunicator):
         for workSpec in workspec_list:
             data_list.append(workSpec.convert_to_propagate())
 
-        data = {
-            "harvester_id": harvester_config.master.harvester_id,
-            "workers": data_list,
-        }
-
         tmp_log.debug(f"Update {len(data_list)} workers")
-        tmp_status, tmp_response = self.request_ssl("POST", "harvester/update_workers", data)
 
-        ret_list = None
+        ret_list = []
         ret_message = "OK"
+        n_failed_shards = 0
 
-        # Communication issue
-        if tmp_status is False:
-            ret_message = core_utils.dump_error_message(tmp_log, tmp_response)
-            return ret_list, ret_message
+        # split by max_request_size
+        shards = self.make_request_shards("harvester/update_workers", data_list)
+        for i_start, i_end in shards:
+            data = {
+                "harvester_id": harvester_config.master.harvester_id,
+                "workers": data_list[i_start:i_end],
+            }
+            tmp_status, tmp_response = self.request_ssl("POST", "harvester/update_workers", data)
 
-        # Parse the response
-        tmp_success = tmp_response.get("success", False)
-        tmp_message = tmp_response.get("message")
-        tmp_data = tmp_response.get("data")
+            # Communication issue
+            if tmp_status is False:
+                ret_message = core_utils.dump_error_message(tmp_log, tmp_response)
+                n_failed_shards += 1
+                ret_list += [False] * (i_end - i_start)
+                continue
 
-        # Update was not done correctly
-        if not tmp_success:
-            ret_message = core_utils.dump_error_message(tmp_log, tmp_message)
-            return ret_list, ret_message
+            # Parse the response
+            tmp_success = tmp_response.get("success", False)
+            tmp_message = tmp_response.get("message")
+            tmp_data = tmp_response.get("data")
+
+            # Update was not done correctly
+            if not tmp_success:
+                ret_message = core_utils.dump_error_message(tmp_log, tmp_message)
+                n_failed_shards += 1
+                ret_list += [False] * (i_end - i_start)
+                continue
+
+            ret_list += tmp_data
+
+        # all failed
+        if n_failed_shards == len(shards) and n_failed_shards > 0:
+            return None, ret_message
 
-        ret_list = tmp_data
         tmp_log.debug(f"Done with {ret_message}")
 
         return ret_list, ret_message
@@ -982,6 +1305,28 @@ class PandaCommunicator(BaseCommunicator):
         tmp_log.debug(f"Done with {n_event_ranges}")
         return tmp_success, n_event_ranges
 
+    # post items of a bulk request in shards split by max_request_size. Stop at the first failure
+    def post_in_shards(self, path, items_key, items, tmp_log):
+        tmp_success, tmp_message = True, None
+        for i_start, i_end in self.make_request_shards(path, items):
+            data = {"harvester_id": harvester_config.master.harvester_id, items_key: items[i_start:i_end]}
+            tmp_status, tmp_response = self.request_ssl("POST", path, data)
+
+            # Communication issue
+            if tmp_status is False:
+                ret_message = core_utils.dump_error_message(tmp_log, tmp_response)
+                return tmp_status, ret_message
+
+            # Parse the response
+            tmp_success = tmp_response.get("success", False)
+            tmp_message = tmp_response.get("message")
+
+            (tmp_log.error if not tmp_success else tmp_log.debug)(f"Done with {tmp_success}:{tmp_message}")
+            if not tmp_success:
+                break
+
+        return tmp_success, tmp_message
+
     # send dialog messages
     def send_dialog_messages(self, dialog_list):
         tmp_log = self.make_logger(method_name="send_dialog_messages")
@@ -991,46 +1336,16 @@ class PandaCommunicator(BaseCommunicator):
         for diagSpec in dialog_list:
             data_list.append(diagSpec.convert_to_propagate())
 
-        data = {"harvester_id": harvester_config.master.harvester_id, "dialogs": data_list}
-
         tmp_log.debug(f"Sending {len(data_list)} messages")
-        tmp_status, tmp_response = self.request_ssl("POST", "harvester/add_dialogs", data)
-
-        # Communication issue
-        if tmp_status is False:
-            ret_message = core_utils.dump_error_message(tmp_log, tmp_response)
-            return tmp_status, ret_message
-
-        # Parse the response
-        tmp_success = tmp_response.get("success", False)
-        tmp_message = tmp_response.get("message")
-
-        (tmp_log.error if not tmp_success else tmp_log.debug)(f"Done with {tmp_success}:{tmp_message}")
-
-        return tmp_success, tmp_message
+        return self.post_in_shards("harvester/add_dialogs", "dialogs", data_list, tmp_log)
 
     # update service metrics
     def update_service_metrics(self, service_metrics_list):
         tmp_log = self.make_logger(method_name="update_service_metrics")
         tmp_log.debug("Start")
 
-        data = {"harvester_id": harvester_config.master.harvester_id, "metrics": service_metrics_list}
-
         tmp_log.debug("Updating metrics")
-        tmp_status, tmp_response = self.request_ssl("POST", "harvester/update_service_metrics", data)
-
-        # Communication issue
-        if tmp_status is False:
-            ret_message = core_utils.dump_error_message(tmp_log, tmp_response)
-            return tmp_status, ret_message
-
-        # Parse the response
-        tmp_success = tmp_response.get("success", False)
-        tmp_message = tmp_response.get("message")
-
-        (tmp_log.error if not tmp_success else tmp_log.debug)(f"Done with {tmp_success}:{tmp_message}")
-
-        return tmp_success, tmp_message
+        return self.post_in_shards("harvester/update_service_metrics", "metrics", service_metrics_list, tmp_log)
 
     # upload checkpoint
     def upload_checkpoint(self, base_url, task_id, panda_id, file_name, file_path):
@@ -8,7 +8,18 @@ from .spec_base import SpecBase
 
 class CacheSpec(SpecBase):
     # attributes
-    attributesWithTypes = ("mainKey:text primary key", "subKey:text", "data:blob", "lastUpdate:timestamp")
+    attributesWithTypes = (
+        "mainKey:text primary key",
+        "subKey:text",
+        "data:blob",
+        "lastUpdate:timestamp",
+        "contentHash:text",
+        "etag:text",
+        "lastModified:text",
+    )
+
+    # attributes to check freshness without reading data
+    metaAttrs = ("lastUpdate", "contentHash", "etag", "lastModified")
 
     # constructor
     def __init__(self):
@@ -40,6 +40,7 @@ class CommunicatorPool(object):
     def __init__(self):
         # install members
         object.__setattr__(self, "pool", None)
+        object.__setattr__(self, "connections", [])
         # connection pool
         try:
             nConnections = harvester_config.communicator.nConnections
@@ -54,6 +55,7 @@ class CommunicatorPool(object):
             )
         for i in range(nConnections):
             con = Communicator()
+            self.connections.append(con)
             self.pool.put(con)
 
     # override __getattribute__
@@ -69,5 +71,16 @@ class CommunicatorPool(object):
 
     # force credential renewal
     def force_credential_renewal(self):
-        for con in list(self.pool.queue):
+        for con in self.connections:
             con.force_credential_renewal()
+
+    # get connection statistics summed over all connections
+    def get_connection_stats(self):
+        retMap = dict()
+        for con in self.connections:
+            for endpoint, stats in con.get_connection_stats().items():
+                retMap.setdefault(endpoint, dict())
+                for key, val in stats.items():
+                    retMap[endpoint].setdefault(key, 0)
+                    retMap[endpoint][key] += val
+        return retMap
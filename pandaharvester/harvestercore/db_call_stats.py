@@ -0,0 +1,131 @@
+"""
+aggregated statistics of DB calls for each DBProxy method and each normalized SQL statement
+
+"""
+
+import collections
+import re
+import threading
+
+# number of recent latencies kept for each key to calculate percentiles
+nLatencySamples = 256
+
+# max number of keys. Calls with new keys beyond this are aggregated into one entry
+maxKeys = 1000
+overflowKey = "OTHERS"
+
+# cache of normalized SQL statements
+_normalizedSqlCache = dict()
+maxNormalizedSqlCacheSize = 2000
+
+# patterns to normalize SQL statements
+_whiteSpacePattern = re.compile(r"\s+")
+_stringLiteralPattern = re.compile(r"'[^']*'")
+_numberLiteralPattern = re.compile(r"\b\d+(\.\d+)?\b")
+_bindListPattern = re.compile(r"\(\s*:\w+(\s*,\s*:\w+)*\s*\)")
+
+
+# normalize SQL statement to aggregate statements which differ only in literals or the number of bind variables in IN clauses
+def normalize_sql(sql):
+    normalizedSql = _normalizedSqlCache.get(sql)
+    if normalizedSql is not None:
+        return normalizedSql
+    normalizedSql = _whiteSpacePattern.sub(" ", sql).strip()
+    normalizedSql = _stringLiteralPattern.sub("'?'", normalizedSql)
+    normalizedSql = _numberLiteralPattern.sub("?", normalizedSql)
+    normalizedSql = _bindListPattern.sub("(:list)", normalizedSql)
+    if len(_normalizedSqlCache) < maxNormalizedSqlCacheSize:
+        _normalizedSqlCache[sql] = normalizedSql
+    return normalizedSql
+
+
+# get percentile from sorted values
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    idx = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[idx]
+
+
+# aggregated statistics of calls
+class CallStats(object):
+    # constructor
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    # get entry for a key
+    def _get_entry(self, key):
+        entry = self.stats.get(key)
+        if entry is None:
+            if len(self.stats) >= maxKeys:
+                key = overflowKey
+                entry = self.stats.get(key)
+            if entry is None:
+                entry = {
+                    "n_calls": 0,
+                    "n_errors": 0,
+                    "n_rows": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "wait_time": 0.0,
+                    "max_wait_time": 0.0,
+                    "latencies": collections.deque(maxlen=nLatencySamples),
+                }
+                self.stats[key] = entry
+        return entry
+
+    # record a call
+    def record(self, key, latency, n_rows=0, wait_time=0.0, is_error=False):
+        with self.lock:
+            entry = self._get_entry(key)
+            entry["n_calls"] += 1
+            if is_error:
+                entry["n_errors"] += 1
+            if n_rows > 0:
+                entry["n_rows"] += n_rows
+            entry["total_time"] += latency
+            if latency > entry["max_time"]:
+                entry["max_time"] = latency
+            if wait_time:
+                entry["wait_time"] += wait_time
+                if wait_time > entry["max_wait_time"]:
+                    entry["max_wait_time"] = wait_time
+            entry["latencies"].append(latency)
+
+    # add rows fetched after a call
+    def add_rows(self, key, n_rows):
+        if n_rows <= 0:
+            return
+        with self.lock:
+            self._get_entry(key)["n_rows"] += n_rows
+
+    # get statistics with latency percentiles, sorted by sort_key in descending order
+    def get_stats(self, top_n=None, sort_key="total_time"):
+        with self.lock:
+            items = [(key, dict(entry), sorted(entry["latencies"])) for key, entry in self.stats.items()]
+        retList = []
+        for key, entry, latencies in items:
+            del entry["latencies"]
+            entry["key"] = key
+            entry["avg_time"] = entry["total_time"] / entry["n_calls"] if entry["n_calls"] else 0.0
+            entry["p50_time"] = _percentile(latencies, 0.5)
+            entry["p90_time"] = _percentile(latencies, 0.9)
+            entry["p99_time"] = _percentile(latencies, 0.99)
+            retList.append(entry)
+        retList.sort(key=lambda x: x.get(sort_key, 0), reverse=True)
+        if top_n is not None:
+            retList = retList[:top_n]
+        return retList
+
+    # clear statistics
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+
+# statistics for each DBProxy method called through DBProxyPool
+methodStats = CallStats()
+
+# statistics for each normalized SQL statement
+sqlStats = CallStats()
@@ -5,7 +5,9 @@ database connection
 
 import copy
 import datetime
+import hashlib
 import inspect
+import json
 import math
 import os
 import random
@@ -16,7 +18,7 @@ import time
 
 from pandaharvester.harvesterconfig import harvester_config
 
-from . import core_utils
+from . import core_utils, db_call_stats
 from .cache_spec import CacheSpec
 from .command_spec import CommandSpec
 from .diag_spec import DiagSpec
@@ -30,7 +32,9 @@ from .queue_config_dump_spec import QueueConfigDumpSpec
 from .resource_type_constants import BASIC_RESOURCE_TYPE_SINGLE_CORE
 from .seq_number_spec import SeqNumberSpec
 from .service_metrics_spec import ServiceMetricSpec
+from .spec_base import PythonObjectEncoder, decode_json_blob
 from .work_spec import WorkSpec
+from .worker_count_spec import WorkerCountSpec
 
 # logger
 _logger = core_utils.setup_logger("db_proxy")
@@ -49,10 +53,39 @@ processLockTableName = "lock_table"
 diagTableName = "diag_table"
 queueConfigDumpTableName = "qcdump_table"
 serviceMetricsTableName = "sm_table"
+workerCountTableName = "wc_table"
 
 # connection lock
 conLock = threading.Lock()
 
+# contention statistics of the application side lock
+_appLockStats = {
+    "n_locks": 0,
+    "n_lock_free_reads": 0,
+    "wait_time": 0.0,
+    "max_wait_time": 0.0,
+    "hold_time": 0.0,
+    "max_hold_time": 0.0,
+}
+_appLockStatsLock = threading.Lock()
+
+# max number of bind variables in an IN clause
+maxInClauseSize = 500
+
+# max number of rows written by one executemany in bulk writes
+maxRowsInBulkWrite = getattr(harvester_config.db, "maxRowsInBulkWrite", 1000)
+
+# lifetime in sec of cached info in the local memory before checking its freshness in the database
+cacheLocalTTL = getattr(harvester_config.db, "cacheLocalTTL", 60)
+
+# attributes of workers in the summary table of worker counts
+workerCountAttrs = WorkerCountSpec.countKeys + ("nCore", "minRamCount")
+
+# cache of converted SQL statements
+_sqlConversionCache = dict()
+_sqlConversionCacheLock = threading.Lock()
+maxSqlConversionCacheSize = 2000
+
 
 # connection class
 class DBProxy(object):
@@ -76,11 +109,18 @@ class DBProxy(object):
         # connect DB
         self._connect_db()
         self.lockDB = False
+        self.lockTime = None
+        # number of rows affected by statements or returned by MariaDB queries
+        self.nRows = 0
         # using application side lock if DB doesn't have a mechanism for exclusive access
         if harvester_config.db.engine == "mariadb":
             self.usingAppLock = False
         else:
             self.usingAppLock = True
+        # take the application side lock only for writes and let reads run concurrently in WAL mode
+        self.lockOnlyForWrite = False
+        if self.usingAppLock and not self.read_only and getattr(harvester_config.db, "sqliteConcurrentRead", False) is True:
+            self.lockOnlyForWrite = True
 
     # connect DB
     def _connect_db(self):
@@ -93,6 +133,10 @@ class DBProxy(object):
                 port = harvester_config.db.port
             else:
                 port = 3306
+            # read-only connections go to the replica if any
+            if self.read_only and getattr(harvester_config.db, "readReplicaHost", None):
+                host = harvester_config.db.readReplicaHost
+                port = getattr(harvester_config.db, "readReplicaPort", port)
             if hasattr(harvester_config.db, "useMySQLdb") and harvester_config.db.useMySQLdb is True:
                 import MySQLdb
                 import MySQLdb.cursors
@@ -147,7 +191,34 @@ class DBProxy(object):
             core_utils.set_file_permission(harvester_config.db.database_filename)
             # change the row factory to use Row
             self.con.row_factory = sqlite3.Row
-            self.cur = self.con.cursor()
+
+            # cursor to count rows fetched since sqlite doesn't give the number of rows for queries
+            class CountingCursor(sqlite3.Cursor):
+                sqlKey = None
+                nFetched = 0
+
+                def _count(self, n_rows):
+                    self.nFetched += n_rows
+                    if self.sqlKey is not None:
+                        db_call_stats.sqlStats.add_rows(self.sqlKey, n_rows)
+
+                def fetchone(self):
+                    tmpRet = sqlite3.Cursor.fetchone(self)
+                    if tmpRet is not None:
+                        self._count(1)
+                    return tmpRet
+
+                def fetchmany(self, *args, **kwargs):
+                    tmpRets = sqlite3.Cursor.fetchmany(self, *args, **kwargs)
+                    self._count(len(tmpRets))
+                    return tmpRets
+
+                def fetchall(self):
+                    tmpRets = sqlite3.Cursor.fetchall(self)
+                    self._count(len(tmpRets))
+                    return tmpRets
+
+            self.cur = self.con.cursor(factory=CountingCursor)
             self.cur.execute("PRAGMA journal_mode")
             resJ = self.cur.fetchone()
             if resJ[0] != "wal":
@@ -200,53 +271,245 @@ class DBProxy(object):
                             time.sleep(sleep_time)
                             n_retry += 1
 
-    # convert param dict to list
-    def convert_params(self, sql, varmap):
-        # lock database if application side lock is used
-        if self.usingAppLock and (
+    # convert SQL statement and get placeholders, with cache since the same statements are executed repeatedly
+    def _convert_sql(self, sql):
+        tmpItem = _sqlConversionCache.get(sql)
+        if tmpItem is not None:
+            return tmpItem
+        # check if database needs to be locked
+        needLock = (
             re.search("^INSERT", sql, re.I) is not None
             or re.search("^UPDATE", sql, re.I) is not None
             or re.search(" FOR UPDATE", sql, re.I) is not None
             or re.search("^DELETE", sql, re.I) is not None
-        ):
-            self.lockDB = True
+        )
+        newSQL = sql
         # remove FOR UPDATE for sqlite
         if harvester_config.db.engine == "sqlite":
-            sql = re.sub(" FOR UPDATE", " ", sql, re.I)
-            sql = re.sub("INSERT IGNORE", "INSERT OR IGNORE", sql, re.I)
+            newSQL = re.sub(" FOR UPDATE", " ", newSQL, re.I)
+            newSQL = re.sub("INSERT IGNORE", "INSERT OR IGNORE", newSQL, re.I)
         else:
-            sql = re.sub("INSERT OR IGNORE", "INSERT IGNORE", sql, re.I)
-        # no conversation unless dict
-        if not isinstance(varmap, dict):
-            # using the printf style syntax for mariaDB
-            if harvester_config.db.engine == "mariadb":
-                sql = re.sub(":[^ $,)]+", "%s", sql)
-            return sql, varmap
-        paramList = []
+            newSQL = re.sub("INSERT OR IGNORE", "INSERT IGNORE", newSQL, re.I)
         # extract placeholders
-        items = re.findall(":[^ $,)]+", sql)
-        for item in items:
-            if item not in varmap:
-                raise KeyError(f"{item} is missing in SQL parameters")
-            if item not in paramList:
-                paramList.append(varmap[item])
+        placeHolders = tuple(re.findall(":[^ $,)]+", newSQL))
         # using the printf style syntax for mariaDB
         if harvester_config.db.engine == "mariadb":
-            sql = re.sub(":[^ $,)]+", "%s", sql)
-        return sql, paramList
+            newSQL = re.sub(":[^ $,)]+", "%s", newSQL)
+        tmpItem = (newSQL, placeHolders, needLock)
+        with _sqlConversionCacheLock:
+            # evict the oldest entry
+            if len(_sqlConversionCache) >= maxSqlConversionCacheSize:
+                try:
+                    del _sqlConversionCache[next(iter(_sqlConversionCache))]
+                except (KeyError, StopIteration, RuntimeError):
+                    pass
+            _sqlConversionCache[sql] = tmpItem
+        return tmpItem
+
+    # convert param dict to list
+    def convert_params(self, sql, varmap):
+        newSQL, placeHolders, needLock = self._convert_sql(sql)
+        # lock database if application side lock is used
+        if self.usingAppLock and needLock:
+            self.lockDB = True
+        # no conversation unless dict
+        if not isinstance(varmap, dict):
+            return newSQL, varmap
+        try:
+            paramList = [varmap[item] for item in placeHolders]
+        except KeyError as e:
+            raise KeyError(f"{e.args[0]} is missing in SQL parameters")
+        return newSQL, paramList
+
+    # make bind variables for IN clause
+    def _make_in_clause_bind_variables(self, values, var_map, prefix):
+        var_names = []
+        for j, value in enumerate(values):
+            var_name = f":{prefix}{j}"
+            var_names.append(var_name)
+            var_map[var_name] = value
+        return ",".join(var_names)
+
+    # execute a statement for many rows in batches of bounded size
+    def _executemany_in_batches(self, sql, varmap_list):
+        for tmpVarMaps in core_utils.create_shards(varmap_list, maxRowsInBulkWrite):
+            self.executemany(sql, tmpVarMaps)
+
+    # check if worker stats are taken from the summary table of worker counts
+    def use_worker_count_summary(self):
+        return getattr(harvester_config.db, "useWorkerCountSummary", False)
+
+    # lock workers and get their attributes counted in the summary table. Return {workerID: values of workerCountAttrs}
+    def _get_worker_count_values(self, worker_ids):
+        retMap = dict()
+        if not self.use_worker_count_summary():
+            return retMap
+        for workerIDs in core_utils.create_shards(worker_ids, maxInClauseSize):
+            varMap = dict()
+            sqlC = f"SELECT workerID,{','.join(workerCountAttrs)} FROM {workTableName} "
+            sqlC += f"WHERE workerID IN ({self._make_in_clause_bind_variables(workerIDs, varMap, 'workerID')}) FOR UPDATE "
+            self.execute(sqlC, varMap)
+            resC = self.cur.fetchall()
+            for tmpItem in resC:
+                retMap[tmpItem[0]] = tuple(tmpItem[1:])
+        return retMap
+
+    # lock workers whose attributes counted in the summary table are changed, and get old values of the attributes
+    def _lock_changed_worker_counts(self, workspec_list):
+        if not self.use_worker_count_summary():
+            return dict()
+        workerIDs = [workSpec.workerID for workSpec in workspec_list if any(attr in workSpec.changedAttrs for attr in workerCountAttrs)]
+        return self._get_worker_count_values(workerIDs)
+
+    # get values of workerCountAttrs after update
+    def _make_worker_count_values(self, workspec, old_values=None):
+        if old_values is None:
+            return tuple(getattr(workspec, attr) for attr in workerCountAttrs)
+        return tuple(workspec.changedAttrs[attr] if attr in workspec.changedAttrs else oldVal for attr, oldVal in zip(workerCountAttrs, old_values))
+
+    # record changes in worker counts to the summary table in the same transaction as workers.
+    # changes is a list of (old values, new values) of workerCountAttrs, where None means no worker
+    def _record_worker_count_changes(self, changes):
+        if not self.use_worker_count_summary():
+            return
+        nKeys = len(WorkerCountSpec.countKeys)
+        deltaMap = dict()
+        for oldValues, newValues in changes:
+            if oldValues == newValues:
+                continue
+            for tmpValues, sign in [(oldValues, -1), (newValues, 1)]:
+                if tmpValues is None:
+                    continue
+                deltas = deltaMap.setdefault(tmpValues[:nKeys], [0, 0, 0])
+                deltas[0] += sign
+                deltas[1] += sign * (tmpValues[nKeys] or 0)
+                deltas[2] += sign * (tmpValues[nKeys + 1] or 0)
+        varMaps = []
+        for tmpKey, deltas in deltaMap.items():
+            if deltas == [0, 0, 0]:
+                continue
+            workerCountSpec = WorkerCountSpec()
+            for attr, val in zip(WorkerCountSpec.countKeys, tmpKey):
+                setattr(workerCountSpec, attr, val)
+            workerCountSpec.nWorkers, workerCountSpec.nCore, workerCountSpec.minRamCount = deltas
+            varMaps.append(workerCountSpec.values_list())
+        if len(varMaps) > 0:
+            sqlI = f"INSERT INTO {workerCountTableName} ({WorkerCountSpec.column_names()}) "
+            sqlI += WorkerCountSpec.bind_values_expression()
+            self._executemany_in_batches(sqlI, varMaps)
+
+    # get worker counts from the summary table grouped by group_by.
+    # Return a list of (values of group_by, nWorkers, sum of nCore, sum of minRamCount)
+    def _get_worker_counts(self, group_by, criteria=None, statuses=None, computing_sites=None):
+        groupStr = ",".join(group_by)
+        varMap = dict()
+        sqlW = f"SELECT {groupStr},SUM(nWorkers),SUM(nCore),SUM(minRamCount) FROM {workerCountTableName} WHERE 1=1 "
+        if computing_sites is not None:
+            sqlW += f"AND computingSite IN ({self._make_in_clause_bind_variables(computing_sites, varMap, 'site')}) "
+        if statuses is not None:
+            sqlW += f"AND status IN ({self._make_in_clause_bind_variables(statuses, varMap, 'status')}) "
+        if criteria is not None:
+            for attr, val in criteria.items():
+                sqlW += f"AND {attr}=:{attr} "
+                varMap[f":{attr}"] = val
+        sqlW += f"GROUP BY {groupStr} HAVING SUM(nWorkers)>0 "
+        self.execute(sqlW, varMap)
+        return self.cur.fetchall()
+
+    # get application side lock if needed. Return True if the lock is acquired
+    def _acquire_app_lock(self, sql):
+        if not self.usingAppLock or self.lockDB:
+            return False
+        # no lock for reads
+        if self.lockOnlyForWrite and not self._convert_sql(sql)[2]:
+            with _appLockStatsLock:
+                _appLockStats["n_lock_free_reads"] += 1
+            return False
+        if harvester_config.db.verbose:
+            self.verbLog.debug(f"thr={self.thrName} locking")
+        timeStart = time.monotonic()
+        conLock.acquire()
+        self.lockTime = time.monotonic()
+        waitTime = self.lockTime - timeStart
+        with _appLockStatsLock:
+            _appLockStats["n_locks"] += 1
+            _appLockStats["wait_time"] += waitTime
+            _appLockStats["max_wait_time"] = max(_appLockStats["max_wait_time"], waitTime)
+        if harvester_config.db.verbose:
+            self.verbLog.debug(f"thr={self.thrName} locked")
+        # begin a write transaction immediately to be the single writer also across processes
+        if self.lockOnlyForWrite and not self.con.in_transaction:
+            try:
+                self.cur.execute("BEGIN IMMEDIATE")
+            except Exception:
+                self._release_app_lock()
+                raise
+        return True
+
+    # release application side lock
+    def _release_app_lock(self):
+        holdTime = time.monotonic() - self.lockTime
+        conLock.release()
+        with _appLockStatsLock:
+            _appLockStats["hold_time"] += holdTime
+            _appLockStats["max_hold_time"] = max(_appLockStats["max_hold_time"], holdTime)
+
+    # get contention statistics of application side lock
+    def get_app_lock_stats(self):
+        with _appLockStatsLock:
+            return dict(_appLockStats)
+
+    # check if the connection is alive with a trivial query
+    def check_connection(self):
+        try:
+            self.cur.execute("SELECT 1")
+            self.cur.fetchall()
+            # end the transaction to avoid reading a stale snapshot later
+            self.con.commit()
+            return True
+        except Exception:
+            return False
+
+    # close the connection
+    def close_connection(self):
+        for tmpObj in [self.cur, self.con]:
+            try:
+                tmpObj.close()
+            except Exception:
+                pass
+
+    # record statistics of a statement
+    def _record_sql_stats(self, sql, time_start, is_error=False):
+        sqlKey = db_call_stats.normalize_sql(sql)
+        nRows = 0
+        if not is_error:
+            nRows = self.cur.rowcount
+            if nRows > 0:
+                self.nRows += nRows
+        db_call_stats.sqlStats.record(sqlKey, time.monotonic() - time_start, n_rows=nRows, is_error=is_error)
+        # rows fetched later are added to the statement
+        if hasattr(self.cur, "sqlKey"):
+            self.cur.sqlKey = sqlKey
+
+    # get the number of rows processed so far
+    def get_n_rows(self):
+        return self.nRows + getattr(self.cur, "nFetched", 0)
+
+    # get statistics of DB calls for each method and each SQL statement
+    def get_call_stats(self, top_n=None, sort_key="total_time"):
+        return {
+            "methods": db_call_stats.methodStats.get_stats(top_n, sort_key),
+            "sql": db_call_stats.sqlStats.get_stats(top_n, sort_key),
+        }
 
     # wrapper for execute
     def execute(self, sql, varmap=None):
         sw = core_utils.get_stopwatch()
+        timeStart = time.monotonic()
         if varmap is None:
             varmap = dict()
         # get lock if application side lock is used
-        if self.usingAppLock and not self.lockDB:
-            if harvester_config.db.verbose:
-                self.verbLog.debug(f"thr={self.thrName} locking")
-            conLock.acquire()
-            if harvester_config.db.verbose:
-                self.verbLog.debug(f"thr={self.thrName} locked")
+        locked = self._acquire_app_lock(sql)
         # execute
         try:
             # verbose
@@ -261,16 +524,18 @@ class DBProxy(object):
             try:
                 retVal = self.cur.execute(newSQL, params)
             except Exception as e:
+                self._record_sql_stats(sql, timeStart, is_error=True)
                 self._handle_exception(e)
                 if harvester_config.db.verbose:
                     self.verbLog.debug(f"thr={self.thrName} exception during execute")
                 raise
+            self._record_sql_stats(sql, timeStart)
         finally:
             # release lock
-            if self.usingAppLock and not self.lockDB:
+            if locked and not self.lockDB:
                 if harvester_config.db.verbose:
                     self.verbLog.debug(f"thr={self.thrName} release")
-                conLock.release()
+                self._release_app_lock()
         # return
         if harvester_config.db.verbose:
             sql_str = newSQL.replace("\n", " ").strip()
@@ -279,13 +544,9 @@ class DBProxy(object):
 
     # wrapper for executemany
     def executemany(self, sql, varmap_list):
+        timeStart = time.monotonic()
         # get lock
-        if self.usingAppLock and not self.lockDB:
-            if harvester_config.db.verbose:
-                self.verbLog.debug(f"thr={self.thrName} locking")
-            conLock.acquire()
-            if harvester_config.db.verbose:
-                self.verbLog.debug(f"thr={self.thrName} locked")
+        locked = self._acquire_app_lock(sql)
         try:
             # verbose
             if harvester_config.db.verbose:
@@ -295,12 +556,19 @@ class DBProxy(object):
                     self.verbLog.debug(f"thr={self.thrName} sql={sql} var={str(varmap_list)} exec={inspect.stack()[1][3]}")
             # convert param dict
             paramList = []
-            newSQL = sql
+            newSQL, placeHolders, needLock = self._convert_sql(sql)
+            if self.usingAppLock and needLock:
+                self.lockDB = True
             for varMap in varmap_list:
                 if varMap is None:
                     varMap = dict()
-                newSQL, params = self.convert_params(sql, varMap)
-                paramList.append(params)
+                if not isinstance(varMap, dict):
+                    paramList.append(varMap)
+                    continue
+                try:
+                    paramList.append([varMap[item] for item in placeHolders])
+                except KeyError as e:
+                    raise KeyError(f"{e.args[0]} is missing in SQL parameters")
             # execute
             try:
                 if harvester_config.db.engine == "sqlite":
@@ -313,16 +581,18 @@ class DBProxy(object):
                 else:
                     retVal = self.cur.executemany(newSQL, paramList)
             except Exception as e:
+                self._record_sql_stats(sql, timeStart, is_error=True)
                 self._handle_exception(e)
                 if harvester_config.db.verbose:
                     self.verbLog.debug(f"thr={self.thrName} exception during executemany")
                 raise
+            self._record_sql_stats(sql, timeStart)
         finally:
             # release lock
-            if self.usingAppLock and not self.lockDB:
+            if locked and not self.lockDB:
                 if harvester_config.db.verbose:
                     self.verbLog.debug(f"thr={self.thrName} release")
-                conLock.release()
+                self._release_app_lock()
         # return
         return retVal
 
@@ -338,7 +608,7 @@ class DBProxy(object):
         if self.usingAppLock and self.lockDB:
             if harvester_config.db.verbose:
                 self.verbLog.debug(f"thr={self.thrName} release with commit")
-            conLock.release()
+            self._release_app_lock()
             self.lockDB = False
 
     # rollback
@@ -353,7 +623,7 @@ class DBProxy(object):
             if self.usingAppLock and self.lockDB:
                 if harvester_config.db.verbose:
                     self.verbLog.debug(f"thr={self.thrName} release with rollback")
-                conLock.release()
+                self._release_app_lock()
                 self.lockDB = False
 
     # type conversion
@@ -522,6 +792,7 @@ class DBProxy(object):
         outStrs += self.make_table(DiagSpec, diagTableName)
         outStrs += self.make_table(QueueConfigDumpSpec, queueConfigDumpTableName)
         outStrs += self.make_table(ServiceMetricSpec, serviceMetricsTableName)
+        outStrs += self.make_table(WorkerCountSpec, workerCountTableName)
 
         # dump error messages
         if len(outStrs) > 0:
@@ -552,6 +823,9 @@ class DBProxy(object):
         queue_config_mapper.load_data()
         # delete process locks
         self.clean_process_locks()
+        # initialize the summary table of worker counts
+        if self.use_worker_count_summary():
+            self.reconcile_worker_counts()
         tmpLog.debug("done")
 
     # check table
@@ -681,9 +955,7 @@ class DBProxy(object):
                 varMap[":PandaID"] = panda_id
                 self.execute(sqlF, varMap)
                 resFileList = self.cur.fetchall()
-                for resFile in resFileList:
-                    fileSpec = FileSpec()
-                    fileSpec.pack(resFile)
+                for fileSpec in FileSpec.pack_rows(resFileList):
                     jobSpec.add_file(fileSpec)
             # commit
             self.commit()
@@ -809,6 +1081,106 @@ class DBProxy(object):
             # return
             return None
 
+    # update changed attributes of specs in bulk, grouping specs with the same set of changed attributes
+    def _update_changes_in_bulk(self, table_name, key_name, spec_list, criteria=None):
+        sqlVarMaps = dict()
+        for spec in spec_list:
+            varMap = spec.values_map(only_changed=True)
+            if varMap == {}:
+                continue
+            sql = f"UPDATE {table_name} SET {spec.bind_update_changes_expression()} "
+            sql += f"WHERE {key_name}=:{key_name} "
+            if criteria is not None:
+                for tmpKey, tmpVal in criteria.items():
+                    mapKey = f":{tmpKey}_cr"
+                    sql += f"AND {tmpKey}={mapKey} "
+                    varMap[mapKey] = tmpVal
+            varMap[f":{key_name}"] = getattr(spec, key_name)
+            sqlVarMaps.setdefault(sql, [])
+            sqlVarMaps[sql].append(varMap)
+        for sql, varMaps in sqlVarMaps.items():
+            self.executemany(sql, varMaps)
+
+    # update jobs in bulk with one transaction. Return a list of the numbers of updated rows in the same order
+    # as jobspec_list, which are the same as update_job would return for each job, or None if failed
+    def update_jobs_bulk(self, jobspec_list, criteria=None, update_in_file=False, update_out_file=False):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, method_name="update_jobs_bulk")
+            tmpLog.debug(f"start for {len(jobspec_list)} jobs")
+            if criteria is None:
+                criteria = {}
+            # sql to check jobs which satisfy the criteria
+            sqlC = f"SELECT PandaID FROM {jobTableName} "
+            sqlC += "WHERE PandaID IN ({ids_str}) "
+            for tmpKey in criteria:
+                sqlC += f"AND {tmpKey}=:{tmpKey}_cr "
+            sqlC += "FOR UPDATE "
+            # sql to set file status to done
+            sqlFD = f"UPDATE {fileTableName} SET status=:status "
+            sqlFD += "WHERE PandaID=:PandaID AND fileType IN (:type1,:type2) "
+            # sql to set to_delete flag
+            sqlD = f"UPDATE {fileTableName} SET todelete=:to_delete "
+            sqlD += "WHERE PandaID=:PandaID "
+            # check jobs
+            matchedIDs = set()
+            for tmpPandaIDs in core_utils.create_shards(set([jobSpec.PandaID for jobSpec in jobspec_list]), maxInClauseSize):
+                varMap = dict()
+                for tmpKey, tmpVal in criteria.items():
+                    varMap[f":{tmpKey}_cr"] = tmpVal
+                ids_str = self._make_in_clause_bind_variables(tmpPandaIDs, varMap, "PandaID")
+                self.execute(sqlC.format(ids_str=ids_str), varMap)
+                resC = self.cur.fetchall()
+                for (tmpPandaID,) in resC:
+                    matchedIDs.add(tmpPandaID)
+            jobsToUpdate = [jobSpec for jobSpec in jobspec_list if jobSpec.PandaID in matchedIDs]
+            # update jobs
+            self._update_changes_in_bulk(jobTableName, "PandaID", jobsToUpdate, criteria)
+            # update events
+            self._update_changes_in_bulk(eventTableName, "eventRangeID", [eventSpec for jobSpec in jobsToUpdate for eventSpec in jobSpec.events])
+            # update input files
+            if update_in_file:
+                self._update_changes_in_bulk(fileTableName, "fileID", [fileSpec for jobSpec in jobsToUpdate for fileSpec in jobSpec.inFiles])
+            else:
+                # set file status to done if jobs are done
+                varMaps = []
+                for jobSpec in jobsToUpdate:
+                    if jobSpec.is_final_status():
+                        varMap = dict()
+                        varMap[":PandaID"] = jobSpec.PandaID
+                        varMap[":type1"] = "input"
+                        varMap[":type2"] = FileSpec.AUX_INPUT
+                        varMap[":status"] = "done"
+                        varMaps.append(varMap)
+                if varMaps:
+                    self.executemany(sqlFD, varMaps)
+            # update output files
+            if update_out_file:
+                self._update_changes_in_bulk(fileTableName, "fileID", [fileSpec for jobSpec in jobsToUpdate for fileSpec in jobSpec.outFiles])
+            # set to_delete flag
+            varMaps = []
+            for jobSpec in jobsToUpdate:
+                if jobSpec.subStatus == "done":
+                    varMap = dict()
+                    varMap[":PandaID"] = jobSpec.PandaID
+                    varMap[":to_delete"] = 1
+                    varMaps.append(varMap)
+            if varMaps:
+                self.executemany(sqlD, varMaps)
+            # commit
+            self.commit()
+            retList = [1 if jobSpec.PandaID in matchedIDs else 0 for jobSpec in jobspec_list]
+            tmpLog.debug(f"done with {sum(retList)} rows")
+            # return
+            return retList
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return None
+
     # insert output files into database
     def insert_files(self, jobspec_list):
         # get logger
@@ -857,8 +1229,13 @@ class DBProxy(object):
                     sql += f"AND {tmpKey}={mapKey} "
                     varMap[mapKey] = tmpVal
                 varMap[":workerID"] = workspec.workerID
+                oldCountMap = self._lock_changed_worker_counts([workspec])
                 self.execute(sql, varMap)
                 nRow = self.cur.rowcount
+                # update worker counts
+                if nRow > 0 and workspec.workerID in oldCountMap:
+                    oldValues = oldCountMap[workspec.workerID]
+                    self._record_worker_count_changes([(oldValues, self._make_worker_count_values(workspec, oldValues))])
                 # commit
                 self.commit()
                 tmpLog.debug(f"done with {nRow}")
@@ -1187,7 +1564,7 @@ class DBProxy(object):
             return {}
 
     # get jobs to propagate checkpoints
-    def get_jobs_to_propagate(self, max_jobs, lock_interval, update_interval, locked_by):
+    def get_jobs_to_propagate(self, max_jobs, lock_interval, update_interval, locked_by, n_jobs_in_lock=100):
         try:
             # get logger
             tmpLog = core_utils.make_logger(_logger, f"thr={locked_by}", method_name="get_jobs_to_propagate")
@@ -1198,14 +1575,14 @@ class DBProxy(object):
             sql += "AND ((propagatorTime<:lockTimeLimit AND propagatorLock IS NOT NULL) "
             sql += "OR (propagatorTime<:updateTimeLimit AND propagatorLock IS NULL)) "
             sql += f"ORDER BY propagatorTime LIMIT {max_jobs} "
-            # sql to get jobs
-            sqlJ = f"SELECT {JobSpec.column_names()} FROM {jobTableName} "
-            sqlJ += "WHERE PandaID=:PandaID "
-            # sql to lock job
+            # sql to lock jobs in bulk
             sqlL = f"UPDATE {jobTableName} SET propagatorTime=:timeNow,propagatorLock=:lockedBy "
-            sqlL += "WHERE PandaID=:PandaID "
+            sqlL += "WHERE PandaID IN ({ids_str}) "
             sqlL += "AND ((propagatorTime<:lockTimeLimit AND propagatorLock IS NOT NULL) "
             sqlL += "OR (propagatorTime<:updateTimeLimit AND propagatorLock IS NULL)) "
+            # sql to get jobs which were actually locked
+            sqlJ = f"SELECT {JobSpec.column_names()} FROM {jobTableName} "
+            sqlJ += "WHERE PandaID IN ({ids_str}) AND propagatorLock=:lockedBy AND propagatorTime=:timeNow "
             # sql to get events
             sqlE = f"SELECT {EventSpec.column_names()} FROM {eventTableName} "
             sqlE += "WHERE PandaID=:PandaID AND subStatus IN (:statusFinished,:statusFailed) "
@@ -1221,8 +1598,8 @@ class DBProxy(object):
             # sql to get checkpoint files
             sqlC = f"SELECT {FileSpec.column_names()} FROM {fileTableName} "
             sqlC += "WHERE PandaID=:PandaID AND fileType=:type AND status=:status "
-            # get jobs
-            timeNow = core_utils.naive_utcnow()
+            # get jobs. truncate to seconds so that the lock check works with DATETIME columns without fractional part
+            timeNow = core_utils.naive_utcnow().replace(microsecond=0)
             lockTimeLimit = timeNow - datetime.timedelta(seconds=lock_interval)
             updateTimeLimit = timeNow - datetime.timedelta(seconds=update_interval)
             varMap = dict()
@@ -1241,31 +1618,41 @@ class DBProxy(object):
             pandaIDs = pandaIDs[:max_jobs]
             jobSpecList = []
             iEvents = 0
-            for pandaID in pandaIDs:
+            for tmpPandaIDs in core_utils.create_shards(pandaIDs, min(n_jobs_in_lock, maxInClauseSize)):
                 # avoid a bulk update for many jobs with too many events
                 if iEvents > 10000:
                     break
-                # lock job
+                # lock jobs
                 varMap = dict()
-                varMap[":PandaID"] = pandaID
                 varMap[":timeNow"] = timeNow
                 varMap[":lockedBy"] = locked_by
                 varMap[":lockTimeLimit"] = lockTimeLimit
                 varMap[":updateTimeLimit"] = updateTimeLimit
-                self.execute(sqlL, varMap)
+                ids_str = self._make_in_clause_bind_variables(tmpPandaIDs, varMap, "PandaID")
+                self.execute(sqlL.format(ids_str=ids_str), varMap)
                 nRow = self.cur.rowcount
                 # commit
                 self.commit()
-                if nRow > 0:
-                    # read job
-                    varMap = dict()
-                    varMap[":PandaID"] = pandaID
-                    self.execute(sqlJ, varMap)
-                    res = self.cur.fetchone()
+                if nRow == 0:
+                    continue
+                # read jobs which were locked
+                varMap = dict()
+                varMap[":timeNow"] = timeNow
+                varMap[":lockedBy"] = locked_by
+                ids_str = self._make_in_clause_bind_variables(tmpPandaIDs, varMap, "PandaID")
+                self.execute(sqlJ.format(ids_str=ids_str), varMap)
+                resJs = self.cur.fetchall()
+                lockedJobs = dict()
+                for res in resJs:
                     # make job
                     jobSpec = JobSpec()
                     jobSpec.pack(res)
                     jobSpec.propagatorLock = locked_by
+                    lockedJobs[jobSpec.PandaID] = jobSpec
+                for pandaID in tmpPandaIDs:
+                    if pandaID not in lockedJobs:
+                        continue
+                    jobSpec = lockedJobs[pandaID]
                     zipFiles = {}
                     zipIdMap = dict()
                     # get zipIDs
@@ -1284,9 +1671,7 @@ class DBProxy(object):
                     varMap[":statusFailed"] = "failed"
                     self.execute(sqlF, varMap)
                     resFs = self.cur.fetchall()
-                    for resF in resFs:
-                        fileSpec = FileSpec()
-                        fileSpec.pack(resF)
+                    for fileSpec in FileSpec.pack_rows(resFs):
                         zipFiles[fileSpec.fileID] = fileSpec
                     # read events
                     varMap = dict()
@@ -1315,9 +1700,7 @@ class DBProxy(object):
                     varMap[":status"] = "renewed"
                     self.execute(sqlC, varMap)
                     resC = self.cur.fetchall()
-                    for resFile in resC:
-                        fileSpec = FileSpec()
-                        fileSpec.pack(resFile)
+                    for fileSpec in FileSpec.pack_rows(resC):
                         jobSpec.add_out_file(fileSpec)
                     # add to job list
                     jobSpecList.append(jobSpec)
@@ -1473,9 +1856,7 @@ class DBProxy(object):
                             varMap[tmpKey] = tmpStatus
                     self.execute(sqlGF, varMap)
                     resGF = self.cur.fetchall()
-                    for resFile in resGF:
-                        fileSpec = FileSpec()
-                        fileSpec.pack(resFile)
+                    for fileSpec in FileSpec.pack_rows(resGF):
                         jobSpec.add_in_file(fileSpec)
                     # append
                     jobSpecList.append(jobSpec)
@@ -1522,6 +1903,7 @@ class DBProxy(object):
                 sqlI += WorkSpec.bind_values_expression()
                 varMap = workspec.values_list()
                 self.execute(sqlI, varMap)
+                self._record_worker_count_changes([(None, self._make_worker_count_values(workspec))])
                 # decrement nNewWorkers
                 varMap = dict()
                 varMap[":queueName"] = workspec.computingSite
@@ -1534,7 +1916,11 @@ class DBProxy(object):
                 sqlU += "WHERE workerID=:workerID "
                 varMap = workspec.values_map(only_changed=True)
                 varMap[":workerID"] = workspec.workerID
+                oldCountMap = self._lock_changed_worker_counts([workspec])
                 self.execute(sqlU, varMap)
+                if self.cur.rowcount > 0 and workspec.workerID in oldCountMap:
+                    oldValues = oldCountMap[workspec.workerID]
+                    self._record_worker_count_changes([(oldValues, self._make_worker_count_values(workspec, oldValues))])
             # collect values to update jobs or insert job/worker mapping
             varMapsR = []
             if jobspec_list is not None:
@@ -1621,6 +2007,7 @@ class DBProxy(object):
             # sql to insert a worker
             sqlI = f"INSERT INTO {workTableName} ({WorkSpec.column_names()}) "
             sqlI += WorkSpec.bind_values_expression()
+            countChanges = []
             for workSpec in workspec_list:
                 tmpWorkSpec = copy.copy(workSpec)
                 # insert worker if new
@@ -1630,6 +2017,9 @@ class DBProxy(object):
                 tmpWorkSpec.status = WorkSpec.ST_pending
                 varMap = tmpWorkSpec.values_list()
                 self.execute(sqlI, varMap)
+                countChanges.append((None, self._make_worker_count_values(tmpWorkSpec)))
+            # update worker counts
+            self._record_worker_count_changes(countChanges)
             # commit
             self.commit()
             # return
@@ -1644,13 +2034,18 @@ class DBProxy(object):
 
     # get queues to submit workers
     def get_queues_to_submit(self, lookup_interval, lock_interval, locked_by, queue_lock_interval):
+        siteList = self.get_sites_to_submit(lookup_interval, lock_interval, locked_by, queue_lock_interval, 1)
+        if not siteList:
+            return {}, None, {}
+        return siteList[0]
+
+    # lock sites and get their queues to submit workers. Return a list of (queues, site name, resource map) for each site
+    def get_sites_to_submit(self, lookup_interval, lock_interval, locked_by, queue_lock_interval, n_sites):
         try:
             # get logger
-            tmpLog = core_utils.make_logger(_logger, method_name="get_queues_to_submit")
+            tmpLog = core_utils.make_logger(_logger, f"nSites={n_sites}", method_name="get_sites_to_submit")
             tmpLog.debug("start")
-            retMap = dict()
-            siteName = None
-            resourceMap = dict()
+            siteList = []
             # sql to get a site
             sql_get_site = (
                 f"SELECT siteName FROM {pandaQueueTableName} "
@@ -1709,6 +2104,8 @@ class DBProxy(object):
                 # skip if not locked
                 if nRow == 0:
                     continue
+                retMap = dict()
+                resourceMap = dict()
                 # get queues
                 varMap = dict()
                 varMap[":siteName"] = siteName
@@ -1732,25 +2129,37 @@ class DBProxy(object):
                     for (tmpWorkerID,) in resO:
                         varMap = dict()
                         varMap[":workerID"] = tmpWorkerID
+                        oldCountMap = self._get_worker_count_values([tmpWorkerID])
                         self.execute(sql_delete_orphaned_worker, varMap)
+                        if self.cur.rowcount > 0 and tmpWorkerID in oldCountMap:
+                            self._record_worker_count_changes([(oldCountMap[tmpWorkerID], None)])
                         # commit
                         self.commit()
 
                     # count nQueue
-                    varMap = dict()
-                    varMap[":computingSite"] = queueName
-                    varMap[":resourceType"] = resourceType
-                    sql_count_workers_tmp = sql_count_workers
-                    if jobType != "ANY":
-                        varMap[":jobType"] = jobType
-                        sql_count_workers_tmp += "AND jobType=:jobType "
-                    if resourceType != "ANY":
+                    if self.use_worker_count_summary():
+                        criteria = dict()
+                        criteria["computingSite"] = queueName
+                        if jobType != "ANY":
+                            criteria["jobType"] = jobType
+                        if resourceType != "ANY":
+                            criteria["resourceType"] = resourceType
+                        resW = [tmpItem[:3] for tmpItem in self._get_worker_counts(("pilotType", "status"), criteria)]
+                    else:
+                        varMap = dict()
+                        varMap[":computingSite"] = queueName
                         varMap[":resourceType"] = resourceType
-                        sql_count_workers_tmp += "AND resourceType=:resourceType "
-                    sql_count_workers_tmp += "GROUP BY pilotType, status "
-                    self.execute(sql_count_workers_tmp, varMap)
-                    # Fetch worker count results BEFORE executing any other query to preserve cursor state
-                    resW = self.cur.fetchall()
+                        sql_count_workers_tmp = sql_count_workers
+                        if jobType != "ANY":
+                            varMap[":jobType"] = jobType
+                            sql_count_workers_tmp += "AND jobType=:jobType "
+                        if resourceType != "ANY":
+                            varMap[":resourceType"] = resourceType
+                            sql_count_workers_tmp += "AND resourceType=:resourceType "
+                        sql_count_workers_tmp += "GROUP BY pilotType, status "
+                        self.execute(sql_count_workers_tmp, varMap)
+                        # Fetch worker count results BEFORE executing any other query to preserve cursor state
+                        resW = self.cur.fetchall()
 
                     # count nFillers once per queue/jobType/resourceType combination
                     varMap = dict()
@@ -1808,20 +2217,22 @@ class DBProxy(object):
                     resourceMap.setdefault(jobType, {})
                     resourceMap[jobType][resourceType] = queueName
 
-                # enough queues
-                if len(retMap) >= 0:
+                tmpLog.debug(f"got retMap {str(retMap)}")
+                tmpLog.debug(f"got siteName {str(siteName)}")
+                tmpLog.debug(f"got resourceMap {str(resourceMap)}")
+                siteList.append((retMap, siteName, resourceMap))
+                # enough sites
+                if len(siteList) >= n_sites:
                     break
-            tmpLog.debug(f"got retMap {str(retMap)}")
-            tmpLog.debug(f"got siteName {str(siteName)}")
-            tmpLog.debug(f"got resourceMap {str(resourceMap)}")
-            return retMap, siteName, resourceMap
+            tmpLog.debug(f"got {len(siteList)} sites")
+            return siteList
         except Exception:
             # roll back
             self.rollback()
             # dump error
             core_utils.dump_error_message(_logger)
             # return
-            return {}, None, {}
+            return []
 
     # get job chunks to make workers
     def get_job_chunks_for_workers(
@@ -1954,9 +2365,7 @@ class DBProxy(object):
                         varMap[":type2"] = FileSpec.AUX_INPUT
                         self.execute(sqlGF, varMap)
                         resGF = self.cur.fetchall()
-                        for resFile in resGF:
-                            fileSpec = FileSpec()
-                            fileSpec.pack(resFile)
+                        for fileSpec in FileSpec.pack_rows(resGF):
                             jobSpec.add_in_file(fileSpec)
                         # new chunk
                         if len(jobChunk) > 0 and jobChunk[0].taskID != jobSpec.taskID and not allow_job_mixture:
@@ -2022,30 +2431,33 @@ class DBProxy(object):
             sqlW += "AND ((modificationTime<:lockTimeLimit AND lockedBy IS NOT NULL) "
             sqlW += "OR (modificationTime<:checkTimeLimit AND lockedBy IS NULL)) "
             sqlW += f"ORDER BY modificationTime LIMIT {max_workers} "
-            # sql to lock worker without time check
-            sqlL = f"UPDATE {workTableName} SET modificationTime=:timeNow,lockedBy=:lockedBy "
-            sqlL += "WHERE workerID=:workerID "
+            # sql to get associated workerIDs in bulk
+            sqlA = "SELECT s.workerID,t.workerID FROM {0} t, {0} s, {1} w ".format(jobWorkerTableName, workTableName)
+            sqlA += "WHERE s.PandaID=t.PandaID AND s.workerID IN ({ids_str}) "
+            sqlA += "AND w.workerID=t.workerID AND w.status IN (:st_submitted,:st_running,:st_idle) "
             # sql to update modificationTime
             sqlLM = f"UPDATE {workTableName} SET modificationTime=:timeNow "
-            sqlLM += "WHERE workerID=:workerID "
-            # sql to lock worker with time check
+            sqlLM += "WHERE workerID IN ({ids_str}) "
+            # sql to lock workers with time check
             sqlLT = f"UPDATE {workTableName} SET modificationTime=:timeNow,lockedBy=:lockedBy "
-            sqlLT += "WHERE workerID=:workerID "
+            sqlLT += "WHERE workerID IN ({ids_str}) "
             sqlLT += "AND status IN (:st_submitted,:st_running,:st_idle) "
             sqlLT += "AND ((modificationTime<:lockTimeLimit AND lockedBy IS NOT NULL) "
             sqlLT += "OR (modificationTime<:checkTimeLimit AND lockedBy IS NULL)) "
-            # sql to get associated workerIDs
-            sqlA = "SELECT t.workerID FROM {0} t, {0} s, {1} w ".format(jobWorkerTableName, workTableName)
-            sqlA += "WHERE s.PandaID=t.PandaID AND s.workerID=:workerID "
-            sqlA += "AND w.workerID=t.workerID AND w.status IN (:st_submitted,:st_running,:st_idle) "
-            # sql to get associated workers
+            # sql to check which workers were locked
+            sqlLC = f"SELECT workerID FROM {workTableName} "
+            sqlLC += "WHERE workerID IN ({ids_str}) AND lockedBy=:lockedBy AND modificationTime=:timeNow "
+            # sql to lock associated workers without time check
+            sqlL = f"UPDATE {workTableName} SET modificationTime=:timeNow,lockedBy=:lockedBy "
+            sqlL += "WHERE workerID IN ({ids_str}) "
+            # sql to get workers in bulk
             sqlG = f"SELECT {WorkSpec.column_names()} FROM {workTableName} "
-            sqlG += "WHERE workerID=:workerID "
-            # sql to get associated PandaIDs
-            sqlP = f"SELECT PandaID FROM {jobWorkerTableName} "
-            sqlP += "WHERE workerID=:workerID "
-            # get workerIDs
-            timeNow = core_utils.naive_utcnow()
+            sqlG += "WHERE workerID IN ({ids_str}) "
+            # sql to get associated PandaIDs in bulk
+            sqlP = f"SELECT workerID,PandaID FROM {jobWorkerTableName} "
+            sqlP += "WHERE workerID IN ({ids_str}) "
+            # get workerIDs. truncate to seconds so that the lock check works with DATETIME columns without fractional part
+            timeNow = core_utils.naive_utcnow().replace(microsecond=0)
             lockTimeLimit = timeNow - datetime.timedelta(seconds=lock_interval)
             checkTimeLimit = timeNow - datetime.timedelta(seconds=check_interval)
             varMap = dict()
@@ -2056,45 +2468,53 @@ class DBProxy(object):
             varMap[":checkTimeLimit"] = checkTimeLimit
             self.execute(sqlW, varMap)
             resW = self.cur.fetchall()
-            tmpWorkers = set()
+            tmpWorkers = []
+            seenIDs = set()
             for workerID, configID, mapType in resW:
+                if workerID in seenIDs:
+                    continue
+                seenIDs.add(workerID)
                 # ignore configID
                 if not core_utils.dynamic_plugin_change():
                     configID = None
-                tmpWorkers.add((workerID, configID, mapType))
-            checkedIDs = set()
+                tmpWorkers.append((workerID, configID, mapType))
             retVal = {}
+            if not tmpWorkers:
+                self.commit()
+                tmpLog.debug(f"got {str(retVal)}")
+                return retVal
+            # get associated workerIDs. add original ID just in case since no relation when job is not yet bound
+            workerIDtoScanMap = dict()
             for workerID, configID, mapType in tmpWorkers:
-                # skip
-                if workerID in checkedIDs:
-                    continue
-                # get associated workerIDs
+                workerIDtoScanMap[workerID] = {workerID}
+            for workerIDs in core_utils.create_shards([w[0] for w in tmpWorkers], maxInClauseSize):
                 varMap = dict()
-                varMap[":workerID"] = workerID
                 varMap[":st_submitted"] = WorkSpec.ST_submitted
                 varMap[":st_running"] = WorkSpec.ST_running
                 varMap[":st_idle"] = WorkSpec.ST_idle
-                self.execute(sqlA, varMap)
+                ids_str = self._make_in_clause_bind_variables(workerIDs, varMap, "workerID")
+                self.execute(sqlA.format(ids_str=ids_str), varMap)
                 resA = self.cur.fetchall()
-                workerIDtoScan = set()
-                for (tmpWorkID,) in resA:
-                    workerIDtoScan.add(tmpWorkID)
-                # add original ID just in case since no relation when job is not yet bound
-                workerIDtoScan.add(workerID)
-                # use only the largest worker to avoid updating the same worker set concurrently
-                if mapType == WorkSpec.MT_MultiWorkers:
-                    if workerID != min(workerIDtoScan):
-                        # update modification time
-                        varMap = dict()
-                        varMap[":workerID"] = workerID
-                        varMap[":timeNow"] = timeNow
-                        self.execute(sqlLM, varMap)
-                        # commit
-                        self.commit()
-                        continue
-                # lock worker
+                for workerID, tmpWorkID in resA:
+                    workerIDtoScanMap[workerID].add(tmpWorkID)
+            # use only the smallest worker to avoid updating the same worker set concurrently
+            workersToLock = []
+            workersToTouch = []
+            for workerID, configID, mapType in tmpWorkers:
+                if mapType == WorkSpec.MT_MultiWorkers and workerID != min(workerIDtoScanMap[workerID]):
+                    workersToTouch.append(workerID)
+                else:
+                    workersToLock.append(workerID)
+            # update modification time
+            for workerIDs in core_utils.create_shards(workersToTouch, maxInClauseSize):
+                varMap = dict()
+                varMap[":timeNow"] = timeNow
+                ids_str = self._make_in_clause_bind_variables(workerIDs, varMap, "workerID")
+                self.execute(sqlLM.format(ids_str=ids_str), varMap)
+            # lock workers and check which were actually locked
+            lockedIDs = set()
+            for workerIDs in core_utils.create_shards(workersToLock, maxInClauseSize):
                 varMap = dict()
-                varMap[":workerID"] = workerID
                 varMap[":lockedBy"] = locked_by
                 varMap[":timeNow"] = timeNow
                 varMap[":st_submitted"] = WorkSpec.ST_submitted
@@ -2102,49 +2522,73 @@ class DBProxy(object):
                 varMap[":st_idle"] = WorkSpec.ST_idle
                 varMap[":lockTimeLimit"] = lockTimeLimit
                 varMap[":checkTimeLimit"] = checkTimeLimit
-                self.execute(sqlLT, varMap)
+                ids_str = self._make_in_clause_bind_variables(workerIDs, varMap, "workerID")
+                self.execute(sqlLT.format(ids_str=ids_str), varMap)
                 nRow = self.cur.rowcount
-                # commit
-                self.commit()
-                # skip if not locked
                 if nRow == 0:
                     continue
-                # get workers
+                varMap = dict()
+                varMap[":lockedBy"] = locked_by
+                varMap[":timeNow"] = timeNow
+                ids_str = self._make_in_clause_bind_variables(workerIDs, varMap, "workerID")
+                self.execute(sqlLC.format(ids_str=ids_str), varMap)
+                resLC = self.cur.fetchall()
+                for (tmpWorkID,) in resLC:
+                    lockedIDs.add(tmpWorkID)
+            # make worker sets
+            checkedIDs = set()
+            workerSets = []
+            for workerID, configID, mapType in tmpWorkers:
+                # skip if not locked or already included in another set
+                if workerID not in lockedIDs or workerID in checkedIDs:
+                    continue
+                workerIDtoScan = workerIDtoScanMap[workerID]
+                checkedIDs.update(workerIDtoScan)
+                workerSets.append((workerID, configID, workerIDtoScan))
+            # lock associated workers
+            for workerIDs in core_utils.create_shards(checkedIDs - lockedIDs, maxInClauseSize):
+                varMap = dict()
+                varMap[":lockedBy"] = locked_by
+                varMap[":timeNow"] = timeNow
+                ids_str = self._make_in_clause_bind_variables(workerIDs, varMap, "workerID")
+                self.execute(sqlL.format(ids_str=ids_str), varMap)
+            # commit
+            self.commit()
+            # get workers and associated PandaIDs
+            workSpecMap = dict()
+            for workerIDs in core_utils.create_shards(checkedIDs, maxInClauseSize):
+                varMap = dict()
+                ids_str = self._make_in_clause_bind_variables(workerIDs, varMap, "workerID")
+                self.execute(sqlG.format(ids_str=ids_str), varMap)
+                resG = self.cur.fetchall()
+                for resWork in resG:
+                    workSpec = WorkSpec()
+                    workSpec.pack(resWork)
+                    workSpec.pandaid_list = []
+                    workSpec.lockedBy = locked_by
+                    workSpec.force_not_update("lockedBy")
+                    workSpecMap[workSpec.workerID] = workSpec
+                varMap = dict()
+                ids_str = self._make_in_clause_bind_variables(workerIDs, varMap, "workerID")
+                self.execute(sqlP.format(ids_str=ids_str), varMap)
+                resP = self.cur.fetchall()
+                for tmpWorkID, tmpPandaID in resP:
+                    if tmpWorkID in workSpecMap:
+                        workSpecMap[tmpWorkID].pandaid_list.append(tmpPandaID)
+            # commit
+            self.commit()
+            for workerID, configID, workerIDtoScan in workerSets:
                 queueName = None
                 workersList = []
                 for tmpWorkID in workerIDtoScan:
-                    checkedIDs.add(tmpWorkID)
-                    # get worker
-                    varMap = dict()
-                    varMap[":workerID"] = tmpWorkID
-                    self.execute(sqlG, varMap)
-                    resG = self.cur.fetchone()
-                    workSpec = WorkSpec()
-                    workSpec.pack(resG)
+                    if tmpWorkID not in workSpecMap:
+                        continue
+                    workSpec = workSpecMap[tmpWorkID]
+                    if len(workSpec.pandaid_list) > 0:
+                        workSpec.nJobs = len(workSpec.pandaid_list)
                     if queueName is None:
                         queueName = workSpec.computingSite
                     workersList.append(workSpec)
-                    # get associated PandaIDs
-                    varMap = dict()
-                    varMap[":workerID"] = tmpWorkID
-                    self.execute(sqlP, varMap)
-                    resP = self.cur.fetchall()
-                    workSpec.pandaid_list = []
-                    for (tmpPandaID,) in resP:
-                        workSpec.pandaid_list.append(tmpPandaID)
-                    if len(workSpec.pandaid_list) > 0:
-                        workSpec.nJobs = len(workSpec.pandaid_list)
-                    # lock worker
-                    if tmpWorkID != workerID:
-                        varMap = dict()
-                        varMap[":workerID"] = tmpWorkID
-                        varMap[":lockedBy"] = locked_by
-                        varMap[":timeNow"] = timeNow
-                        self.execute(sqlL, varMap)
-                    workSpec.lockedBy = locked_by
-                    workSpec.force_not_update("lockedBy")
-                # commit
-                self.commit()
                 # add
                 if queueName is not None:
                     retVal.setdefault(queueName, dict())
@@ -2315,9 +2759,12 @@ class DBProxy(object):
             # sql to get all LFNs
             sqlFL = f"SELECT lfn,fileID FROM {fileTableName} "
             sqlFL += "WHERE PandaID=:PandaID AND fileType<>:type "
-            # sql to check file with eventRangeID
-            sqlFE = f"SELECT 1 c FROM {fileTableName} "
-            sqlFE += "WHERE PandaID=:PandaID AND lfn=:lfn AND eventRangeID=:eventRangeID ".format(fileTableName)
+            # sql to get files with eventRangeID
+            sqlFE = f"SELECT lfn,eventRangeID FROM {fileTableName} "
+            sqlFE += "WHERE PandaID=:PandaID AND eventRangeID IS NOT NULL "
+            # sql to get IDs of inserted files
+            sqlFN = f"SELECT fileID,lfn,eventRangeID FROM {fileTableName} "
+            sqlFN += "WHERE PandaID=:PandaID AND fileType<>:type "
             # sql to insert file
             sqlFI = f"INSERT INTO {fileTableName} ({FileSpec.column_names()}) "
             sqlFI += FileSpec.bind_values_expression()
@@ -2344,7 +2791,7 @@ class DBProxy(object):
             # sql to update event
             sqlEU = f"UPDATE {eventTableName} "
             sqlEU += "SET eventStatus=:eventStatus,subStatus=:subStatus "
-            sqlEU += "WHERE PandaID=:PandaID AND eventRangeID=:eventRangeID "
+            sqlEU += "WHERE PandaID=:PandaID AND eventRangeID IN ({eventRangeIDs}) "
             # sql to check if relationship is already available
             sqlCR = f"SELECT 1 c FROM {jobWorkerTableName} WHERE PandaID=:PandaID AND workerID=:workerID "
             # sql to insert job and worker relationship
@@ -2388,6 +2835,7 @@ class DBProxy(object):
                             jobSpec.nWorkers = len(activeWorkers)
                         # get all LFNs
                         allLFNs = dict()
+                        allFileIDs = set()
                         varMap = dict()
                         varMap[":PandaID"] = jobSpec.PandaID
                         varMap[":type"] = "input"
@@ -2395,10 +2843,22 @@ class DBProxy(object):
                         resFL = self.cur.fetchall()
                         for tmpLFN, tmpFileID in resFL:
                             allLFNs[tmpLFN] = tmpFileID
-                        # insert files
+                            allFileIDs.add(tmpFileID)
+                        # get LFNs and eventRangeIDs of files associated to events
+                        eventFiles = set()
+                        if any(fileSpec.isZip == 1 and fileSpec.eventRangeID is not None and fileSpec.lfn in allLFNs for fileSpec in jobSpec.outFiles):
+                            varMap = dict()
+                            varMap[":PandaID"] = jobSpec.PandaID
+                            self.execute(sqlFE, varMap)
+                            resFE = self.cur.fetchall()
+                            for tmpLFN, tmpEventRangeID in resFE:
+                                eventFiles.add((tmpLFN, tmpEventRangeID))
+                        # make files to insert
                         nFiles = 0
                         fileIdMap = {}
                         zipFileRes = dict()
+                        newFileSpecs = []
+                        varMapsFU = []
                         for fileSpec in jobSpec.outFiles:
                             # insert file
                             if fileSpec.lfn not in allLFNs:
@@ -2410,29 +2870,11 @@ class DBProxy(object):
                                         fileSpec.status = "renewed"
                                 else:
                                     fileSpec.status = "pending"
-                                varMap = fileSpec.values_list()
-                                self.execute(sqlFI, varMap)
-                                fileSpec.fileID = self.cur.lastrowid
-                                nFiles += 1
-                                # mapping between event range ID and file ID
-                                if fileSpec.eventRangeID is not None:
-                                    fileIdMap[fileSpec.eventRangeID] = fileSpec.fileID
-                                # associate to itself
-                                if fileSpec.isZip == 1:
-                                    varMap = dict()
-                                    varMap[":status"] = fileSpec.status
-                                    varMap[":fileID"] = fileSpec.fileID
-                                    varMap[":zipFileID"] = fileSpec.fileID
-                                    self.execute(sqlFU, varMap)
+                                newFileSpecs.append((fileSpec, True))
                             elif fileSpec.isZip == 1 and fileSpec.eventRangeID is not None:
                                 # add a fake file with eventRangeID which has the same lfn/zipFileID as zip file
-                                varMap = dict()
-                                varMap[":PandaID"] = fileSpec.PandaID
-                                varMap[":lfn"] = fileSpec.lfn
-                                varMap[":eventRangeID"] = fileSpec.eventRangeID
-                                self.execute(sqlFE, varMap)
-                                resFE = self.cur.fetchone()
-                                if resFE is None:
+                                if (fileSpec.lfn, fileSpec.eventRangeID) not in eventFiles:
+                                    eventFiles.add((fileSpec.lfn, fileSpec.eventRangeID))
                                     if fileSpec.lfn not in zipFileRes:
                                         # get file
                                         varMap = dict()
@@ -2447,18 +2889,48 @@ class DBProxy(object):
                                     zipFileSpec.pack(resFC)
                                     fileSpec.status = "zipped"
                                     fileSpec.zipFileID = zipFileSpec.zipFileID
-                                    varMap = fileSpec.values_list()
-                                    self.execute(sqlFI, varMap)
-                                    nFiles += 1
-                                    # mapping between event range ID and file ID
-                                    fileIdMap[fileSpec.eventRangeID] = self.cur.lastrowid
+                                    newFileSpecs.append((fileSpec, False))
                             elif fileSpec.fileType == "checkpoint":
                                 # reset status of checkpoint to be uploaded again
                                 varMap = dict()
                                 varMap[":status"] = "renewed"
                                 varMap[":fileID"] = allLFNs[fileSpec.lfn]
                                 varMap[":zipFileID"] = None
-                                self.execute(sqlFU, varMap)
+                                varMapsFU.append(varMap)
+                        # insert files
+                        if len(newFileSpecs) > 0:
+                            self._executemany_in_batches(sqlFI, [fileSpec.values_list() for fileSpec, _ in newFileSpecs])
+                            nFiles = len(newFileSpecs)
+                            # get IDs of inserted files, which are allocated in ascending order
+                            newFileIDs = dict()
+                            resFN = []
+                            for tmpLFNs in core_utils.create_shards(set([fileSpec.lfn for fileSpec, _ in newFileSpecs]), maxInClauseSize):
+                                varMap = dict()
+                                varMap[":PandaID"] = jobSpec.PandaID
+                                varMap[":type"] = "input"
+                                sqlFNL = sqlFN + f"AND lfn IN ({self._make_in_clause_bind_variables(tmpLFNs, varMap, 'lfn')}) "
+                                self.execute(sqlFNL, varMap)
+                                resFN += self.cur.fetchall()
+                            for tmpFileID, tmpLFN, tmpEventRangeID in sorted(resFN, key=lambda x: x[0]):
+                                if tmpFileID not in allFileIDs:
+                                    newFileIDs.setdefault((tmpLFN, tmpEventRangeID), []).append(tmpFileID)
+                            for fileSpec, isNewLFN in newFileSpecs:
+                                tmpFileID = newFileIDs[(fileSpec.lfn, fileSpec.eventRangeID)].pop(0)
+                                # mapping between event range ID and file ID
+                                if fileSpec.eventRangeID is not None:
+                                    fileIdMap[fileSpec.eventRangeID] = tmpFileID
+                                if not isNewLFN:
+                                    continue
+                                fileSpec.fileID = tmpFileID
+                                # associate to itself
+                                if fileSpec.isZip == 1:
+                                    varMap = dict()
+                                    varMap[":status"] = fileSpec.status
+                                    varMap[":fileID"] = fileSpec.fileID
+                                    varMap[":zipFileID"] = fileSpec.fileID
+                                    varMapsFU.append(varMap)
+                        if len(varMapsFU) > 0:
+                            self._executemany_in_batches(sqlFU, varMapsFU)
                         if nFiles > 0:
                             tmpLog.debug(f"inserted {nFiles} files")
                         # check pending files
@@ -2561,7 +3033,7 @@ class DBProxy(object):
                                 eventFileStat[tmpEventRangeID] = tmpStat
                         # insert or update events
                         varMapsEI = []
-                        varMapsEU = []
+                        eventRangesToUpdate = dict()
                         for eventSpec in jobSpec.events:
                             # already done
                             if eventSpec.eventRangeID in doneEventRangesSet:
@@ -2586,18 +3058,23 @@ class DBProxy(object):
                                 varMap = eventSpec.values_list()
                                 varMapsEI.append(varMap)
                             else:
-                                varMap = dict()
-                                varMap[":PandaID"] = jobSpec.PandaID
-                                varMap[":eventRangeID"] = eventSpec.eventRangeID
-                                varMap[":eventStatus"] = eventSpec.eventStatus
-                                varMap[":subStatus"] = eventSpec.subStatus
-                                varMapsEU.append(varMap)
+                                eventRangesToUpdate.setdefault((eventSpec.eventStatus, eventSpec.subStatus), []).append(eventSpec.eventRangeID)
                         if len(varMapsEI) > 0:
-                            self.executemany(sqlEI, varMapsEI)
+                            self._executemany_in_batches(sqlEI, varMapsEI)
                             tmpLog.debug(f"inserted {len(varMapsEI)} event")
-                        if len(varMapsEU) > 0:
-                            self.executemany(sqlEU, varMapsEU)
-                            tmpLog.debug(f"updated {len(varMapsEU)} event")
+                        # update events with the same status together
+                        nEventsUpdated = 0
+                        for (tmpEventStatus, tmpSubStatus), tmpEventRangeIDs in eventRangesToUpdate.items():
+                            for eventRangeIDs in core_utils.create_shards(tmpEventRangeIDs, maxInClauseSize):
+                                varMap = dict()
+                                varMap[":PandaID"] = jobSpec.PandaID
+                                varMap[":eventStatus"] = tmpEventStatus
+                                varMap[":subStatus"] = tmpSubStatus
+                                sqlEUx = sqlEU.format(eventRangeIDs=self._make_in_clause_bind_variables(eventRangeIDs, varMap, "eventRangeID"))
+                                self.execute(sqlEUx, varMap)
+                                nEventsUpdated += len(eventRangeIDs)
+                        if nEventsUpdated > 0:
+                            tmpLog.debug(f"updated {nEventsUpdated} event")
                         # update job
                         varMap = jobSpec.values_map(only_changed=True)
                         if len(varMap) > 0:
@@ -2645,11 +3122,16 @@ class DBProxy(object):
                     varMap[":st2"] = WorkSpec.ST_finished
                     varMap[":st3"] = WorkSpec.ST_failed
                     varMap[":st4"] = WorkSpec.ST_missed
+                    oldCountMap = self._lock_changed_worker_counts([workSpec])
                     self.execute(sqlW, varMap)
                     nRow = self.cur.rowcount
                     tmpLog.debug(f"done with {nRow}")
                     if nRow == 0:
                         retVal = False
+                    elif workSpec.workerID in oldCountMap:
+                        # update worker counts
+                        oldValues = oldCountMap[workSpec.workerID]
+                        self._record_worker_count_changes([(oldValues, self._make_worker_count_values(workSpec, oldValues))])
                 # insert relationship if necessary
                 if panda_ids_list is not None and len(panda_ids_list) > idxW:
                     varMapsIR = []
@@ -2742,9 +3224,7 @@ class DBProxy(object):
                     varMap[":PandaID"] = pandaID
                     self.execute(sqlF, varMap)
                     resFileList = self.cur.fetchall()
-                    for resFile in resFileList:
-                        fileSpec = FileSpec()
-                        fileSpec.pack(resFile)
+                    for fileSpec in FileSpec.pack_rows(resFileList):
                         jobSpec.add_file(fileSpec)
                 # append
                 jobChunkList.append(jobSpec)
@@ -2969,9 +3449,7 @@ class DBProxy(object):
                         varMap[":status"] = "transferring"
                     self.execute(sqlF, varMap)
                     resFileList = self.cur.fetchall()
-                    for resFile in resFileList:
-                        fileSpec = FileSpec()
-                        fileSpec.pack(resFile)
+                    for fileSpec in FileSpec.pack_rows(resFileList):
                         fileSpec.attemptNr += 1
                         jobSpec.add_out_file(fileSpec)
                         # increment attempt number
@@ -3018,18 +3496,14 @@ class DBProxy(object):
                 _logger, f"PandaID={jobspec.PandaID} subStatus={jobspec.subStatus} thr={locked_by}", method_name="update_job_for_stage_out"
             )
             tmpLog.debug("start")
-            # sql to update event
+            # sql to update events
             sqlEU = f"UPDATE {eventTableName} "
             sqlEU += "SET eventStatus=:eventStatus,subStatus=:subStatus "
-            sqlEU += "WHERE eventRangeID=:eventRangeID "
+            sqlEU += "WHERE eventRangeID IN ({eventRangeIDs}) "
             sqlEU += "AND eventStatus<>:statusFailed AND subStatus<>:statusDone "
-            # sql to update associated events
-            sqlAE1 = f"SELECT eventRangeID FROM {fileTableName} "
-            sqlAE1 += "WHERE PandaID=:PandaID AND zipFileID=:zipFileID "
-            sqlAE = f"UPDATE {eventTableName} "
-            sqlAE += "SET eventStatus=:eventStatus,subStatus=:subStatus "
-            sqlAE += "WHERE eventRangeID=:eventRangeID "
-            sqlAE += "AND eventStatus<>:statusFailed AND subStatus<>:statusDone "
+            # sql to get events associated with zip files
+            sqlAE = f"SELECT zipFileID,eventRangeID FROM {fileTableName} "
+            sqlAE += "WHERE PandaID=:PandaID AND zipFileID IN ({zipFileIDs}) "
             # sql to lock job again
             sqlLJ = f"UPDATE {jobTableName} SET stagerTime=:timeNow "
             sqlLJ += "WHERE PandaID=:PandaID AND stagerLock=:lockedBy "
@@ -3056,69 +3530,86 @@ class DBProxy(object):
             if nRow == 0:
                 tmpLog.debug("skip since locked by another")
                 return None
-            # update files
+            # update files with the same changed attributes together
             tmpLog.debug(f"update {len(jobspec.outFiles)} files")
+            updated = False
+            varMapsF = dict()
             for fileSpec in jobspec.outFiles:
-                # sql to update file
-                sqlF = f"UPDATE {fileTableName} SET {fileSpec.bind_update_changes_expression()} "
-                sqlF += "WHERE PandaID=:PandaID AND fileID=:fileID "
                 varMap = fileSpec.values_map(only_changed=True)
-                updated = False
                 if len(varMap) > 0:
                     varMap[":PandaID"] = fileSpec.PandaID
                     varMap[":fileID"] = fileSpec.fileID
-                    self.execute(sqlF, varMap)
-                    updated = True
-                # update event status
-                if update_event_status:
+                    varMapsF.setdefault(fileSpec.bind_update_changes_expression(), []).append(varMap)
+            for updateExpression, tmpVarMaps in varMapsF.items():
+                # sql to update files
+                sqlF = f"UPDATE {fileTableName} SET {updateExpression} "
+                sqlF += "WHERE PandaID=:PandaID AND fileID=:fileID "
+                self._executemany_in_batches(sqlF, tmpVarMaps)
+                updated = True
+            # update event status
+            if update_event_status:
+                # get events associated with zip files
+                zipEventMap = dict()
+                zipFileIDs = [fileSpec.fileID for fileSpec in jobspec.outFiles if fileSpec.isZip == 1]
+                for tmpZipFileIDs in core_utils.create_shards(zipFileIDs, maxInClauseSize):
+                    varMap = dict()
+                    varMap[":PandaID"] = jobspec.PandaID
+                    sqlAEx = sqlAE.format(zipFileIDs=self._make_in_clause_bind_variables(tmpZipFileIDs, varMap, "zipFileID"))
+                    self.execute(sqlAEx, varMap)
+                    resAE = self.cur.fetchall()
+                    for tmpZipFileID, eventRangeID in resAE:
+                        zipEventMap.setdefault(tmpZipFileID, []).append(eventRangeID)
+                # final status of each event. Events are not updated once they are failed or done
+                eventStatusMap = dict()
+                for fileSpec in jobspec.outFiles:
+                    eventRangeIDs = []
                     if fileSpec.eventRangeID is not None:
+                        eventRangeIDs.append(fileSpec.eventRangeID)
+                    if fileSpec.isZip == 1:
+                        eventRangeIDs += zipEventMap.get(fileSpec.fileID, [])
+                        updated = True
+                    for eventRangeID in eventRangeIDs:
+                        if eventStatusMap.get(eventRangeID) not in ["failed", "done"]:
+                            eventStatusMap[eventRangeID] = fileSpec.status
+                        updated = True
+                # update events with the same status together
+                eventRangesToUpdate = dict()
+                for eventRangeID, eventStatus in eventStatusMap.items():
+                    eventRangesToUpdate.setdefault(eventStatus, []).append(eventRangeID)
+                nEvents = 0
+                for eventStatus, tmpEventRangeIDs in eventRangesToUpdate.items():
+                    for eventRangeIDs in core_utils.create_shards(tmpEventRangeIDs, maxInClauseSize):
                         varMap = dict()
-                        varMap[":eventRangeID"] = fileSpec.eventRangeID
-                        varMap[":eventStatus"] = fileSpec.status
-                        varMap[":subStatus"] = fileSpec.status
+                        varMap[":eventStatus"] = eventStatus
+                        varMap[":subStatus"] = eventStatus
                         varMap[":statusFailed"] = "failed"
                         varMap[":statusDone"] = "done"
-                        self.execute(sqlEU, varMap)
-                        updated = True
-                    if fileSpec.isZip == 1:
-                        # update files associated with zip file
-                        varMap = dict()
-                        varMap[":PandaID"] = fileSpec.PandaID
-                        varMap[":zipFileID"] = fileSpec.fileID
-                        self.execute(sqlAE1, varMap)
-                        resAE1 = self.cur.fetchall()
-                        for (eventRangeID,) in resAE1:
-                            varMap = dict()
-                            varMap[":eventRangeID"] = eventRangeID
-                            varMap[":eventStatus"] = fileSpec.status
-                            varMap[":subStatus"] = fileSpec.status
-                            varMap[":statusFailed"] = "failed"
-                            varMap[":statusDone"] = "done"
-                            self.execute(sqlAE, varMap)
-                        updated = True
-                        nRow = self.cur.rowcount
-                        tmpLog.debug(f"updated {nRow} events")
-                if updated:
-                    # lock job again
+                        sqlEUx = sqlEU.format(eventRangeIDs=self._make_in_clause_bind_variables(eventRangeIDs, varMap, "eventRangeID"))
+                        self.execute(sqlEUx, varMap)
+                        nEvents += self.cur.rowcount
+                if len(eventStatusMap) > 0:
+                    tmpLog.debug(f"updated {nEvents} events")
+            if updated:
+                # lock job again
+                varMap = dict()
+                varMap[":PandaID"] = jobspec.PandaID
+                varMap[":lockedBy"] = locked_by
+                varMap[":timeNow"] = core_utils.naive_utcnow()
+                self.execute(sqlLJ, varMap)
+                # commit
+                self.commit()
+                nRow = self.cur.rowcount
+                # check just in case since nRow can be 0 if two lock actions are too close in time
+                if nRow == 0:
                     varMap = dict()
                     varMap[":PandaID"] = jobspec.PandaID
-                    varMap[":lockedBy"] = locked_by
-                    varMap[":timeNow"] = core_utils.naive_utcnow()
-                    self.execute(sqlLJ, varMap)
-                    # commit
-                    self.commit()
-                    nRow = self.cur.rowcount
-                    # check just in case since nRow can be 0 if two lock actions are too close in time
-                    if nRow == 0:
-                        varMap = dict()
-                        varMap[":PandaID"] = jobspec.PandaID
-                        self.execute(sqlLC, varMap)
-                        resLC = self.cur.fetchone()
-                        if resLC is not None and resLC[0] == locked_by:
-                            nRow = 1
-                    if nRow == 0:
-                        tmpLog.debug("skip since locked by another")
-                        return None
+                    self.execute(sqlLC, varMap)
+                    resLC = self.cur.fetchone()
+                    if resLC is not None and resLC[0] == locked_by:
+                        nRow = 1
+                if nRow == 0:
+                    tmpLog.debug("skip since locked by another")
+                    return None
             # count files
             sqlC = f"SELECT COUNT(*) cnt,status FROM {fileTableName} "
             sqlC += "WHERE PandaID=:PandaID GROUP BY status "
@@ -3166,9 +3657,7 @@ class DBProxy(object):
                         varMap[":type2"] = "log"
                         self.execute(sqlFF, varMap)
                         resFileList = self.cur.fetchall()
-                        for resFile in resFileList:
-                            fileSpec = FileSpec()
-                            fileSpec.pack(resFile)
+                        for fileSpec in FileSpec.pack_rows(resFileList):
                             jobspec.add_out_file(fileSpec)
                         # make file report
                         jobspec.outputFilesToReport = core_utils.get_output_file_report(jobspec)
@@ -3280,24 +3769,78 @@ class DBProxy(object):
             # return
             return None
 
-    # refresh a cached info
-    def refresh_cache(self, main_key, sub_key, new_info):
+    # get metadata of a cached info to check its freshness without reading data. Return {attribute: value} or None if missing
+    def get_cache_meta(self, main_key, sub_key=None):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"mainKey={main_key} subKey={sub_key}", method_name="get_cache_meta")
+            # get
+            varMap = dict()
+            varMap[":mainKey"] = main_key
+            sqlC = f"SELECT {','.join(CacheSpec.metaAttrs)} FROM {cacheTableName} WHERE mainKey=:mainKey "
+            if sub_key is not None:
+                sqlC += "AND subKey=:subKey "
+                varMap[":subKey"] = sub_key
+            self.execute(sqlC, varMap)
+            resC = self.cur.fetchone()
+            # commit
+            self.commit()
+            if resC is None:
+                retVal = None
+            else:
+                retVal = dict(zip(CacheSpec.metaAttrs, resC))
+            tmpLog.debug(f"got {retVal}")
+            return retVal
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return None
+
+    # put a cached info into the local memory
+    def _put_local_cache(self, main_key, sub_key, data, content_hash, last_update):
+        cacheKey = f"cache|{main_key}|{sub_key}"
+        globalDict = core_utils.get_global_dict()
+        globalDict.acquire()
+        globalDict[cacheKey] = (data, content_hash, last_update, time.monotonic())
+        globalDict.release()
+
+    # refresh a cached info. The data is not rewritten if the content is unchanged
+    def refresh_cache(self, main_key, sub_key, new_info, etag=None, last_modified=None):
         try:
             # get logger
             tmpLog = core_utils.make_logger(_logger, f"mainKey={main_key} subKey={sub_key}", method_name="refresh_cache")
+            # serialize once to get the content hash
+            rawData = json.dumps(new_info, cls=PythonObjectEncoder)
+            contentHash = hashlib.md5(rawData.encode()).hexdigest()
             # make spec
             cacheSpec = CacheSpec()
             cacheSpec.lastUpdate = core_utils.naive_utcnow()
-            cacheSpec.data = new_info
+            # validators are always overwritten since they must correspond to the data
+            cacheSpec.etag = etag
+            cacheSpec.force_update("etag")
+            cacheSpec.lastModified = last_modified
+            cacheSpec.force_update("lastModified")
             # check if already there
             varMap = dict()
             varMap[":mainKey"] = main_key
-            sqlC = f"SELECT lastUpdate FROM {cacheTableName} WHERE mainKey=:mainKey "
+            sqlC = f"SELECT contentHash FROM {cacheTableName} WHERE mainKey=:mainKey "
             if sub_key is not None:
                 sqlC += "AND subKey=:subKey "
                 varMap[":subKey"] = sub_key
             self.execute(sqlC, varMap)
             retC = self.cur.fetchone()
+            if retC is not None and retC[0] == contentHash:
+                # only update time and validators if unchanged
+                tmpMsg = "unchanged"
+            else:
+                cacheSpec.contentHash = contentHash
+                cacheSpec.data = new_info
+                # serialized data is written as it is
+                cacheSpec.set_lazy_blob_attribute("data", rawData, decode_json_blob)
+                tmpMsg = "refreshed"
             if retC is None:
                 # insert if missing
                 cacheSpec.mainKey = main_key
@@ -3318,12 +3861,8 @@ class DBProxy(object):
             # commit
             self.commit()
             # put into global dict
-            cacheKey = f"cache|{main_key}|{sub_key}"
-            globalDict = core_utils.get_global_dict()
-            globalDict.acquire()
-            globalDict[cacheKey] = cacheSpec.data
-            globalDict.release()
-            tmpLog.debug("refreshed")
+            self._put_local_cache(main_key, sub_key, new_info, contentHash, cacheSpec.lastUpdate)
+            tmpLog.debug(tmpMsg)
             return True
         except Exception:
             # roll back
@@ -3333,9 +3872,44 @@ class DBProxy(object):
             # return
             return False
 
-    # get a cached info
+    # update last update time of a cached info which is confirmed to be unchanged, together with validators of the source
+    def touch_cache(self, main_key, sub_key, etag=None, last_modified=None):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"mainKey={main_key} subKey={sub_key}", method_name="touch_cache")
+            # update
+            varMap = dict()
+            varMap[":mainKey"] = main_key
+            varMap[":lastUpdate"] = core_utils.naive_utcnow()
+            sqlU = f"UPDATE {cacheTableName} SET lastUpdate=:lastUpdate"
+            if etag is not None:
+                sqlU += ",etag=:etag"
+                varMap[":etag"] = etag
+            if last_modified is not None:
+                sqlU += ",lastModified=:lastModified"
+                varMap[":lastModified"] = last_modified
+            sqlU += " WHERE mainKey=:mainKey "
+            if sub_key is not None:
+                sqlU += "AND subKey=:subKey "
+                varMap[":subKey"] = sub_key
+            self.execute(sqlU, varMap)
+            nRow = self.cur.rowcount
+            # commit
+            self.commit()
+            tmpLog.debug(f"updated {nRow} rows")
+            return nRow > 0
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return False
+
+    # get a cached info. The local copy is used within cacheLocalTTL, and then data is read from the database only if its content hash is changed
     def get_cache(self, main_key, sub_key=None, from_local_cache=True):
         useDB = False
+        dictLocked = False
         try:
             # get logger
             tmpLog = core_utils.make_logger(_logger, f"mainKey={main_key} subKey={sub_key}", method_name="get_cache")
@@ -3345,40 +3919,71 @@ class DBProxy(object):
             globalDict = core_utils.get_global_dict()
             # lock dict
             globalDict.acquire()
-            # found
-            if from_local_cache and cacheKey in globalDict:
+            dictLocked = True
+            localCache = None
+            if cacheKey in globalDict:
+                localCache = globalDict[cacheKey]
+            # found and fresh enough
+            if from_local_cache and localCache is not None and time.monotonic() - localCache[3] < cacheLocalTTL:
                 # release dict
                 globalDict.release()
+                dictLocked = False
                 # make spec
                 cacheSpec = CacheSpec()
-                cacheSpec.data = globalDict[cacheKey]
-            else:
-                # read from database
-                useDB = True
-                sql = f"SELECT {CacheSpec.column_names()} FROM {cacheTableName} "
-                sql += "WHERE mainKey=:mainKey "
-                varMap = dict()
-                varMap[":mainKey"] = main_key
-                if sub_key is not None:
-                    sql += "AND subKey=:subKey "
-                    varMap[":subKey"] = sub_key
-                self.execute(sql, varMap)
-                resJ = self.cur.fetchall()
-                # commit
-                self.commit()
-                if not resJ:
-                    # release dict
-                    globalDict.release()
-                    return None
-                else:
-                    res_one = resJ[0]
-                    # make spec
-                    cacheSpec = CacheSpec()
-                    cacheSpec.pack(res_one)
-                    # put into global dict
-                    globalDict[cacheKey] = cacheSpec.data
+                cacheSpec.data = localCache[0]
+                cacheSpec.contentHash = localCache[1]
+                cacheSpec.lastUpdate = localCache[2]
+                tmpLog.debug("done with local cache")
+                return cacheSpec
+            useDB = True
+            varMap = dict()
+            varMap[":mainKey"] = main_key
+            sqlW = "WHERE mainKey=:mainKey "
+            if sub_key is not None:
+                sqlW += "AND subKey=:subKey "
+                varMap[":subKey"] = sub_key
+            if localCache is not None:
+                # check freshness of the local copy
+                sqlC = f"SELECT contentHash,lastUpdate FROM {cacheTableName} " + sqlW
+                self.execute(sqlC, varMap)
+                resC = self.cur.fetchone()
+                if resC is not None:
+                    contentHash, lastUpdate = resC
+                    if (contentHash is not None and contentHash == localCache[1]) or (contentHash is None and lastUpdate == localCache[2]):
+                        # commit
+                        self.commit()
+                        # make spec
+                        cacheSpec = CacheSpec()
+                        cacheSpec.data = localCache[0]
+                        cacheSpec.contentHash = contentHash
+                        cacheSpec.lastUpdate = lastUpdate
+                        globalDict[cacheKey] = (localCache[0], contentHash, lastUpdate, time.monotonic())
+                        # release dict
+                        globalDict.release()
+                        dictLocked = False
+                        tmpLog.debug("done with unchanged local cache")
+                        return cacheSpec
+            # read from database
+            sql = f"SELECT {CacheSpec.column_names()} FROM {cacheTableName} " + sqlW
+            self.execute(sql, varMap)
+            resJ = self.cur.fetchall()
+            # commit
+            self.commit()
+            if not resJ:
                 # release dict
                 globalDict.release()
+                dictLocked = False
+                return None
+            else:
+                res_one = resJ[0]
+                # make spec
+                cacheSpec = CacheSpec()
+                cacheSpec.pack(res_one)
+                # put into global dict
+                globalDict[cacheKey] = (cacheSpec.data, cacheSpec.contentHash, cacheSpec.lastUpdate, time.monotonic())
+            # release dict
+            globalDict.release()
+            dictLocked = False
             tmpLog.debug("done")
             # return
             return cacheSpec
@@ -3386,6 +3991,9 @@ class DBProxy(object):
             if useDB:
                 # roll back
                 self.rollback()
+            if dictLocked:
+                # release dict
+                globalDict.release()
             # dump error
             core_utils.dump_error_message(_logger)
             # return
@@ -3614,13 +4222,28 @@ class DBProxy(object):
             )
 
             # get worker stats
-            varMap = dict()
-            varMap[":siteName"] = site_name
-            varMap[":st1"] = "running"
-            varMap[":st2"] = "submitted"
-            varMap[":st3"] = "finished"
-            self.execute(sqlW, varMap)
-            resW = self.cur.fetchall()
+            if self.use_worker_count_summary():
+                # join with queues
+                countMap = dict()
+                queueNames = list(set(tmpItem[0] for tmpItem in resQ))
+                if len(queueNames) > 0:
+                    resW = self._get_worker_counts(("status", "computingSite"), statuses=["running", "submitted", "finished"], computing_sites=queueNames)
+                else:
+                    resW = []
+                for workerStatus, computingSite, cnt, _, _ in resW:
+                    for queueName, jobType, resourceType, _ in resQ:
+                        if queueName == computingSite:
+                            tmpKey = (workerStatus, computingSite, jobType, resourceType)
+                            countMap[tmpKey] = countMap.get(tmpKey, 0) + cnt
+                resW = [tmpKey + (cnt,) for tmpKey, cnt in countMap.items()]
+            else:
+                varMap = dict()
+                varMap[":siteName"] = site_name
+                varMap[":st1"] = "running"
+                varMap[":st2"] = "submitted"
+                varMap[":st3"] = "finished"
+                self.execute(sqlW, varMap)
+                resW = self.cur.fetchall()
             for workerStatus, computingSite, jobType, resourceType, cnt in resW:
                 retMap.setdefault(jobType, {})
                 if resourceType not in retMap:
@@ -3665,12 +4288,20 @@ class DBProxy(object):
                 "GROUP BY wt.status,wt.computingSite, wt.jobType, wt.resourceType "
             )
 
-            varMap = dict()
-            varMap[":st1"] = "running"
-            varMap[":st2"] = "submitted"
-            varMap[":st3"] = "finished"
-            self.execute(sqlW, varMap)
-            resW = self.cur.fetchall()
+            if self.use_worker_count_summary():
+                resW = [
+                    tmpItem[:5]
+                    for tmpItem in self._get_worker_counts(
+                        ("status", "computingSite", "jobType", "resourceType"), statuses=["running", "submitted", "finished"]
+                    )
+                ]
+            else:
+                varMap = dict()
+                varMap[":st1"] = "running"
+                varMap[":st2"] = "submitted"
+                varMap[":st3"] = "finished"
+                self.execute(sqlW, varMap)
+                resW = self.cur.fetchall()
             for workerStatus, computingSite, jobType, resourceType, cnt in resW:
                 if resourceType and resourceType != "ANY":
                     retMap.setdefault(computingSite, {})
@@ -3738,8 +4369,13 @@ class DBProxy(object):
                 sqlW += f"WHERE wt.computingSite IN ({filter_queue_str}) "
             sqlW += "GROUP BY wt.status,wt.computingSite, wt.jobType, wt.resourceType "
             # get worker stats
-            self.execute(sqlW, varMap)
-            resW = self.cur.fetchall()
+            if self.use_worker_count_summary():
+                resW = [
+                    tmpItem[:5] for tmpItem in self._get_worker_counts(("status", "computingSite", "jobType", "resourceType"), computing_sites=filter_site_list)
+                ]
+            else:
+                self.execute(sqlW, varMap)
+                resW = self.cur.fetchall()
             for workerStatus, computingSite, jobType, resourceType, cnt in resW:
                 workerStatus = str(workerStatus)
                 computingSite = str(computingSite)
@@ -3771,6 +4407,89 @@ class DBProxy(object):
             # return
             return {}
 
+    # reconcile the summary table of worker counts with a full scan of workers, and then compact the table.
+    # Workers are not locked. Drift is corrected with compensating deltas, and the table is compacted site by site in short transactions
+    def reconcile_worker_counts(self):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, method_name="reconcile_worker_counts")
+            tmpLog.debug("start")
+            keyStr = ",".join(WorkerCountSpec.countKeys)
+            nKeys = len(WorkerCountSpec.countKeys)
+            # sql to count workers and subtract counts in the summary table. One statement to read both tables consistently
+            sqlW = f"SELECT {keyStr},COUNT(*),SUM(nCore),SUM(minRamCount) FROM {workTableName} GROUP BY {keyStr} "
+            sqlW += "UNION ALL "
+            sqlW += f"SELECT {keyStr},-SUM(nWorkers),-SUM(nCore),-SUM(minRamCount) FROM {workerCountTableName} GROUP BY {keyStr} "
+            # sql to insert counts
+            sqlI = f"INSERT INTO {workerCountTableName} ({WorkerCountSpec.column_names()}) "
+            sqlI += WorkerCountSpec.bind_values_expression()
+            # sql to get sites in the summary table
+            sqlS = f"SELECT DISTINCT computingSite FROM {workerCountTableName} "
+            # sql to lock and sum counts of a site
+            sqlC = f"SELECT {keyStr},SUM(nWorkers),SUM(nCore),SUM(minRamCount) FROM {workerCountTableName} "
+            sqlC += f"WHERE computingSite=:computingSite GROUP BY {keyStr} FOR UPDATE "
+            # sql to delete counts of a site
+            sqlD = f"DELETE FROM {workerCountTableName} WHERE computingSite=:computingSite "
+            # get drift
+            self.execute(sqlW)
+            resW = self.cur.fetchall()
+            driftMap = dict()
+            for tmpItem in resW:
+                drifts = driftMap.setdefault(tuple(tmpItem[:nKeys]), [0, 0, 0])
+                for idx in range(3):
+                    drifts[idx] += tmpItem[nKeys + idx] or 0
+            # add compensating deltas
+            varMaps = []
+            for tmpKey, drifts in driftMap.items():
+                if drifts == [0, 0, 0]:
+                    continue
+                workerCountSpec = WorkerCountSpec()
+                for attr, val in zip(WorkerCountSpec.countKeys, tmpKey):
+                    setattr(workerCountSpec, attr, val)
+                workerCountSpec.nWorkers, workerCountSpec.nCore, workerCountSpec.minRamCount = drifts
+                varMaps.append(workerCountSpec.values_list())
+            self._executemany_in_batches(sqlI, varMaps)
+            # commit
+            self.commit()
+            nDrifts = len(varMaps)
+            # compact site by site
+            self.execute(sqlS)
+            resS = self.cur.fetchall()
+            self.commit()
+            nRows = 0
+            for (computingSite,) in resS:
+                if computingSite is None:
+                    continue
+                varMap = dict()
+                varMap[":computingSite"] = computingSite
+                self.execute(sqlC, varMap)
+                resC = self.cur.fetchall()
+                varMaps = []
+                for tmpItem in resC:
+                    if not tmpItem[nKeys]:
+                        continue
+                    workerCountSpec = WorkerCountSpec()
+                    for attr, val in zip(WorkerCountSpec.countKeys, tmpItem[:nKeys]):
+                        setattr(workerCountSpec, attr, val)
+                    workerCountSpec.nWorkers = tmpItem[nKeys]
+                    workerCountSpec.nCore = tmpItem[nKeys + 1] or 0
+                    workerCountSpec.minRamCount = tmpItem[nKeys + 2] or 0
+                    varMaps.append(workerCountSpec.values_list())
+                self.execute(sqlD, varMap)
+                self._executemany_in_batches(sqlI, varMaps)
+                # commit
+                self.commit()
+                nRows += len(varMaps)
+            tmpLog.debug(f"done with {nRows} rows after compaction, {nDrifts} keys corrected")
+            return True
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return False
+
     # send kill command to workers associated to a job
     def mark_workers_to_kill_by_pandaid(self, panda_id, delay_seconds=None):
         try:
@@ -3970,9 +4689,7 @@ class DBProxy(object):
                         varMap[":PandaID"] = jobSpec.PandaID
                         self.execute(sqlF, varMap)
                         resFs = self.cur.fetchall()
-                        for resF in resFs:
-                            fileSpec = FileSpec()
-                            fileSpec.pack(resF)
+                        for fileSpec in FileSpec.pack_rows(resFs):
                             # skip if already checked
                             if fileSpec.lfn in checkedLFNs:
                                 continue
@@ -4035,7 +4752,10 @@ class DBProxy(object):
             # delete worker
             varMap = dict()
             varMap[":workerID"] = worker_id
+            oldCountMap = self._get_worker_count_values([worker_id])
             self.execute(sqlDW, varMap)
+            if self.cur.rowcount > 0 and worker_id in oldCountMap:
+                self._record_worker_count_changes([(oldCountMap[worker_id], None)])
             # commit
             self.commit()
             tmpLog.debug("done")
@@ -4547,9 +5267,7 @@ class DBProxy(object):
             varMap[":groupID"] = group_id
             retList = []
             self.execute(sqlF, varMap)
-            for resFile in self.cur.fetchall():
-                fileSpec = FileSpec()
-                fileSpec.pack(resFile)
+            for fileSpec in FileSpec.pack_rows(self.cur.fetchall()):
                 retList.append(fileSpec)
             # commit
             self.commit()
@@ -4875,8 +5593,11 @@ class DBProxy(object):
             varMap[":status3"] = WorkSpec.ST_idle
             varMap[":status4"] = WorkSpec.ST_pending
             varMap[":status5"] = WorkSpec.ST_ready
-            self.execute(sqlNW, varMap)
-            resNW = self.cur.fetchall()
+            if self.use_worker_count_summary():
+                resNW = self._get_worker_counts(("status",), {"computingSite": site_name}, statuses=[varMap[f":status{i}"] for i in range(1, 6)])
+            else:
+                self.execute(sqlNW, varMap)
+                resNW = self.cur.fetchall()
             # n resource types and worker stats
             nRT = 1
             for (cnt,) in resNT:
@@ -5528,13 +6249,19 @@ class DBProxy(object):
             varMap[":computingSite"] = queue_name
             self.execute(sqlW, varMap)
             resW = self.cur.fetchall()
+            oldCountMap = self._get_worker_count_values([workerID for (workerID,) in resW])
+            countChanges = []
             for (workerID,) in resW:
                 varMap = dict()
                 varMap[":workerID"] = workerID
                 # delete workers
                 self.execute(sqlDW, varMap)
+                if self.cur.rowcount > 0 and workerID in oldCountMap:
+                    countChanges.append((oldCountMap[workerID], None))
                 # delete relations
                 self.execute(sqlDRW, varMap)
+            # update worker counts
+            self._record_worker_count_changes(countChanges)
             # get queue configs
             varMap = dict()
             varMap[":queueName"] = queue_name
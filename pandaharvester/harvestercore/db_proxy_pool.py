@@ -1,41 +1,231 @@
+import collections
 import os
-import queue
 import threading
+import time
 
 from pandaharvester.harvesterconfig import harvester_config
 
-from . import core_utils
+from . import core_utils, db_call_stats
 from .db_proxy import DBProxy
 
 # logger
 _logger = core_utils.setup_logger("db_proxy_pool")
 
+# upper bounds in seconds of histogram buckets for wait time to get a connection
+waitTimeBuckets = (0.001, 0.01, 0.1, 1, 10, 60)
+
+
+# exception when no connection is available before timeout
+class DBProxyPoolTimeout(Exception):
+    pass
+
+
+# elastic pool of connections
+class ConnectionPool(object):
+    # constructor
+    def __init__(self, label, min_size, max_size, read_only=False):
+        self.label = label
+        self.minSize = max(min_size, 1)
+        self.maxSize = max(max_size, self.minSize)
+        self.readOnly = read_only
+        # max time in seconds to wait for a connection. 0 to wait forever
+        self.acquireTimeout = getattr(harvester_config.db, "acquireTimeout", 0)
+        # connections idle longer than this are validated before being used. 0 to skip validation
+        self.idleCheckInterval = getattr(harvester_config.db, "idleCheckInterval", 0)
+        # connections beyond the min size are closed when idle longer than this
+        self.idleTimeout = getattr(harvester_config.db, "idleTimeout", 300)
+        self.cond = threading.Condition()
+        # idle connections with the time when they were released. The most recently used one is taken first
+        self.idle = collections.deque()
+        self.nConnections = 0
+        self.nSerial = 0
+        self.stats = {"n_created": 0, "n_closed": 0, "n_validation_failures": 0, "n_timeouts": 0, "max_in_use": 0}
+        currentThr = threading.current_thread()
+        if currentThr is None:
+            thrID = None
+        else:
+            thrID = currentThr.ident
+        self.thrName = f"{os.getpid()}-{thrID}"
+        for i in range(self.minSize):
+            self.idle.append((self._make_connection(), time.monotonic()))
+            self.nConnections += 1
+
+    # make a connection
+    def _make_connection(self):
+        with self.cond:
+            thrName = f"{self.thrName}-{self.label}-{self.nSerial}"
+            self.nSerial += 1
+            self.stats["n_created"] += 1
+        return DBProxy(thr_name=thrName, read_only=self.readOnly)
+
+    # close a connection
+    def _close_connection(self, con):
+        con.close_connection()
+        with self.cond:
+            self.stats["n_closed"] += 1
+
+    # number of idle connections
+    def qsize(self):
+        return len(self.idle)
+
+    # get a connection
+    def get(self):
+        if self.acquireTimeout:
+            deadline = time.monotonic() + self.acquireTimeout
+        else:
+            deadline = None
+        con = None
+        releaseTime = None
+        with self.cond:
+            while True:
+                if self.idle:
+                    con, releaseTime = self.idle.pop()
+                    break
+                # grow the pool
+                if self.nConnections < self.maxSize:
+                    self.nConnections += 1
+                    break
+                if deadline is None:
+                    self.cond.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["n_timeouts"] += 1
+                        raise DBProxyPoolTimeout(f"no connection available in pool={self.label} within {self.acquireTimeout} sec")
+                    self.cond.wait(remaining)
+            self.stats["max_in_use"] = max(self.stats["max_in_use"], self.nConnections - len(self.idle))
+        try:
+            if con is None:
+                con = self._make_connection()
+            elif self.idleCheckInterval and time.monotonic() - releaseTime > self.idleCheckInterval and not con.check_connection():
+                # replace the broken connection
+                tmpLog = core_utils.make_logger(_logger, f"pool={self.label}", method_name="get")
+                tmpLog.warning(f"replacing dead connection thr={con.thrName}")
+                with self.cond:
+                    self.stats["n_validation_failures"] += 1
+                self._close_connection(con)
+                con = self._make_connection()
+        except Exception:
+            # give the slot back
+            with self.cond:
+                self.nConnections -= 1
+                self.cond.notify()
+            raise
+        return con
+
+    # release a connection
+    def put(self, con):
+        timeNow = time.monotonic()
+        staleCons = []
+        with self.cond:
+            self.idle.append((con, timeNow))
+            # shrink the pool by closing connections unused for a long time
+            while self.nConnections > self.minSize and len(self.idle) > 1 and timeNow - self.idle[0][1] > self.idleTimeout:
+                staleCons.append(self.idle.popleft()[0])
+                self.nConnections -= 1
+            self.cond.notify()
+        for staleCon in staleCons:
+            self._close_connection(staleCon)
+
+    # get statistics
+    def get_stats(self):
+        with self.cond:
+            retMap = dict(self.stats)
+            retMap["size"] = self.nConnections
+            retMap["idle"] = len(self.idle)
+            retMap["min_size"] = self.minSize
+            retMap["max_size"] = self.maxSize
+            return retMap
+
 
 # method wrapper
 class DBProxyMethod(object):
     # constructor
-    def __init__(self, method_name, pool):
+    def __init__(self, method_name, pool, wait_stats):
         self.methodName = method_name
         self.pool = pool
+        self.waitStats = wait_stats
 
     # method emulation
     def __call__(self, *args, **kwargs):
         tmpLog = core_utils.make_logger(_logger, f"method={self.methodName}", method_name="call")
         sw = core_utils.get_stopwatch()
+        # get connection
         try:
-            # get connection
             con = self.pool.get()
+        except DBProxyPoolTimeout:
+            self.waitStats.record_timeout(self.methodName)
+            tmpLog.error(f"timed out to get connection. qsize={self.pool.qsize()} {sw.get_elapsed_time()}")
+            raise
+        waitTime = sw.get_elapsed_time_in_sec()
+        self.waitStats.record(self.methodName, waitTime)
+        isError = True
+        nRowsStart = con.get_n_rows()
+        timeStart = time.monotonic()
+        try:
             tmpLog.debug(f"got lock. qsize={self.pool.qsize()} {sw.get_elapsed_time()}")
             sw.reset()
             # get function
             func = getattr(con, self.methodName)
             # exec
-            return func(*args, **kwargs)
+            retVal = func(*args, **kwargs)
+            isError = False
+            return retVal
         finally:
+            # record statistics of the method
+            db_call_stats.methodStats.record(
+                self.methodName, time.monotonic() - timeStart, n_rows=con.get_n_rows() - nRowsStart, wait_time=waitTime, is_error=isError
+            )
             tmpLog.debug("release lock" + sw.get_elapsed_time())
             self.pool.put(con)
 
 
+# histograms of wait time to get a connection for each method
+class WaitTimeStats(object):
+    # constructor
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    # get entry for a method
+    def _get_entry(self, method_name):
+        entry = self.stats.get(method_name)
+        if entry is None:
+            entry = {"n_calls": 0, "n_timeouts": 0, "wait_time": 0.0, "max_wait_time": 0.0, "histogram": [0] * (len(waitTimeBuckets) + 1)}
+            self.stats[method_name] = entry
+        return entry
+
+    # record wait time
+    def record(self, method_name, wait_time):
+        idx = 0
+        for upperBound in waitTimeBuckets:
+            if wait_time <= upperBound:
+                break
+            idx += 1
+        with self.lock:
+            entry = self._get_entry(method_name)
+            entry["n_calls"] += 1
+            entry["wait_time"] += wait_time
+            entry["max_wait_time"] = max(entry["max_wait_time"], wait_time)
+            entry["histogram"][idx] += 1
+
+    # record timeout
+    def record_timeout(self, method_name):
+        with self.lock:
+            self._get_entry(method_name)["n_timeouts"] += 1
+
+    # get statistics with histograms keyed by upper bounds of buckets
+    def get_stats(self):
+        labels = [f"le_{upperBound}" for upperBound in waitTimeBuckets] + ["inf"]
+        with self.lock:
+            retMap = {}
+            for method_name, entry in self.stats.items():
+                tmpEntry = dict(entry)
+                tmpEntry["histogram"] = dict(zip(labels, entry["histogram"]))
+                retMap[method_name] = tmpEntry
+            return retMap
+
+
 # connection class
 class DBProxyPool(object):
     instance = None
@@ -49,17 +239,20 @@ class DBProxyPool(object):
     def initialize(self, read_only=False):
         # install members
         object.__setattr__(self, "pool", None)
+        object.__setattr__(self, "readPool", None)
         # connection pool
-        self.pool = queue.Queue(harvester_config.db.nConnections)
-        currentThr = threading.current_thread()
-        if currentThr is None:
-            thrID = None
-        else:
-            thrID = currentThr.ident
-        thrName = f"{os.getpid()}-{thrID}"
-        for i in range(harvester_config.db.nConnections):
-            con = DBProxy(thr_name=f"{thrName}-{i}", read_only=read_only)
-            self.pool.put(con)
+        nConnections = harvester_config.db.nConnections
+        maxConnections = getattr(harvester_config.db, "maxConnections", nConnections)
+        self.pool = ConnectionPool("main", nConnections, maxConnections, read_only=read_only)
+        # read-only sub-pool for methods only reading the database, which may point at a replica
+        self.readPoolMethods = set()
+        tmpStr = getattr(harvester_config.db, "readPoolMethods", None)
+        if tmpStr and not read_only:
+            self.readPoolMethods = set([tmpItem.strip() for tmpItem in tmpStr.split(",") if tmpItem.strip()])
+            nReadConnections = getattr(harvester_config.db, "nReadConnections", 1)
+            maxReadConnections = getattr(harvester_config.db, "maxReadConnections", nReadConnections)
+            self.readPool = ConnectionPool("read", nReadConnections, maxReadConnections, read_only=True)
+        self.waitStats = WaitTimeStats()
 
     # override __new__ to have a singleton
     def __new__(cls, *args, **kwargs):
@@ -74,6 +267,13 @@ class DBProxyPool(object):
                     cls.instance.initialize(read_only=read_only)
         return cls.instance
 
+    # get statistics of pools and wait time for each method
+    def get_pool_stats(self):
+        retMap = {"pool": self.pool.get_stats(), "wait_time": self.waitStats.get_stats()}
+        if self.readPool is not None:
+            retMap["read_pool"] = self.readPool.get_stats()
+        return retMap
+
     # override __getattribute__
     def __getattribute__(self, name):
         try:
@@ -81,6 +281,10 @@ class DBProxyPool(object):
         except Exception:
             pass
         # method object
-        tmpO = DBProxyMethod(name, self.pool)
+        if name in self.readPoolMethods:
+            pool = self.readPool
+        else:
+            pool = self.pool
+        tmpO = DBProxyMethod(name, pool, self.waitStats)
         object.__setattr__(self, name, tmpO)
         return tmpO
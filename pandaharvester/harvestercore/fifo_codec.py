@@ -0,0 +1,190 @@
+"""
+codecs to serialize objects in fifo
+
+"""
+
+import io
+import pickle
+import zlib
+
+from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore.spec_base import SpecBase
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# logger
+_logger = core_utils.setup_logger("fifo_codec")
+
+# header of serialized data made by codecs other than plain pickle. pickle data with protocol 2 or later starts with 0x80
+_magic = b"HVC1"
+
+# codec IDs
+_codec_pickle = 0
+_codec_spec = 1
+
+# compression IDs
+_compression_none = 0
+_compression_zlib = 1
+_compression_zstd = 2
+_compression_lz4 = 3
+
+
+# compress data
+def _compress(compression_id, data):
+    if compression_id == _compression_zlib:
+        return zlib.compress(data, 1)
+    if compression_id == _compression_zstd:
+        return zstandard.ZstdCompressor(level=1).compress(data)
+    if compression_id == _compression_lz4:
+        return lz4.frame.compress(data)
+    return data
+
+
+# decompress data
+def _decompress(compression_id, data):
+    if compression_id == _compression_zlib:
+        return zlib.decompress(data)
+    if compression_id == _compression_zstd:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to decode the object")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression_id == _compression_lz4:
+        if lz4 is None:
+            raise RuntimeError("lz4 is required to decode the object")
+        return lz4.frame.decompress(data)
+    return data
+
+
+# make empty XyzSpec
+def _new_spec(cls):
+    obj = cls.__new__(cls)
+    obj.__init__()
+    return obj
+
+
+# set state of XyzSpec from positional values
+def _set_spec_state(obj, state):
+    attributes, values, blobs, extra = state
+    attrDict = obj.__dict__
+    if attributes == obj.attributes:
+        attrDict.update(zip(attributes, values))
+    else:
+        # attributes changed since the object was encoded
+        for attr, val in zip(attributes, values):
+            if attr in attrDict:
+                attrDict[attr] = val
+    for key, val in extra.items():
+        # raw values of blob attributes loaded from DB, which were not decoded before encoded
+        if key == "_lazyBlobs":
+            for attr, (decoder, rawVal) in val.items():
+                if attr in attrDict:
+                    obj.set_lazy_blob_attribute(attr, rawVal, decoder)
+            continue
+        attrDict[key] = val
+    # blob attributes are decoded on first access
+    for attr, rawVal in blobs.items():
+        if attr in attrDict:
+            obj.set_lazy_blob_attribute(attr, rawVal, pickle.loads)
+
+
+# positions of blob attributes per class
+_blobPositionsMap = {}
+
+
+# get positions of blob attributes
+def _get_blob_positions(cls):
+    blobPositions = _blobPositionsMap.get(cls)
+    if blobPositions is None:
+        blobPositions = tuple((idx, attr) for idx, attr in enumerate(cls.attributes) if attr in cls.serializedAttrs)
+        _blobPositionsMap[cls] = blobPositions
+    return blobPositions
+
+
+# pickler to encode XyzSpec with positional values in attribute order
+class _SpecPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if not isinstance(obj, SpecBase):
+            return NotImplemented
+        cls = obj.__class__
+        # blob attributes loaded from DB and not accessed are kept as raw values in the state
+        state = obj.__getstate__()
+        values = list(map(state.get, cls.attributes))
+        # encode blobs separately to decode them lazily
+        blobs = {}
+        for idx, attr in _get_blob_positions(cls):
+            val = values[idx]
+            if val is not None:
+                blobs[attr] = pickle.dumps(val, -1)
+                values[idx] = None
+        defaultValues = cls._defaultValues
+        extra = {key: val for key, val in state.items() if key not in defaultValues}
+        # state is set after the object is memoized to allow reference cycles
+        return _new_spec, (cls,), (cls.attributes, tuple(values), blobs, extra), None, None, _set_spec_state
+
+
+# codec to serialize objects in fifo
+class FifoCodec(object):
+    # constructor
+    def __init__(self, codec_id=_codec_pickle, compression_id=_compression_none):
+        self.codecID = codec_id
+        self.compressionID = compression_id
+        self.header = _magic + bytes([codec_id, compression_id])
+
+    # encode
+    def encode(self, item):
+        if self.codecID == _codec_pickle and self.compressionID == _compression_none:
+            # plain pickle for backward compatibility
+            return pickle.dumps(item, -1)
+        if self.codecID == _codec_spec:
+            buf = io.BytesIO()
+            _SpecPickler(buf, -1).dump(item)
+            data = buf.getvalue()
+        else:
+            data = pickle.dumps(item, -1)
+        return self.header + _compress(self.compressionID, data)
+
+    # decode
+    def decode(self, item_serialized):
+        item_serialized = bytes(item_serialized)
+        if not item_serialized.startswith(_magic):
+            # plain pickle
+            return pickle.loads(item_serialized)
+        compression_id = item_serialized[len(_magic) + 1]
+        data = _decompress(compression_id, item_serialized[len(_magic) + 2 :])
+        # objects made by the spec codec are also unpickled since _new_spec and _set_spec_state are referred to in the data
+        return pickle.loads(data)
+
+
+# get codec with a name like pickle, spec, spec+zstd, spec+lz4, pickle+zlib
+def get_codec(codec_name=None):
+    tmpLog = core_utils.make_logger(_logger, method_name="get_codec")
+    if not codec_name:
+        return FifoCodec()
+    codec_id_map = {"pickle": _codec_pickle, "spec": _codec_spec}
+    compression_id_map = {"none": _compression_none, "zlib": _compression_zlib, "zstd": _compression_zstd, "lz4": _compression_lz4}
+    items = codec_name.lower().split("+")
+    if items[0] not in codec_id_map:
+        tmpLog.error(f"unknown codec {codec_name}. Use pickle")
+        return FifoCodec()
+    codec_id = codec_id_map[items[0]]
+    compression_id = _compression_none
+    if len(items) > 1:
+        if items[1] not in compression_id_map:
+            tmpLog.error(f"unknown compression in {codec_name}. Use no compression")
+        elif items[1] == "zstd" and zstandard is None:
+            tmpLog.warning("zstandard is unavailable. Use zlib")
+            compression_id = _compression_zlib
+        elif items[1] == "lz4" and lz4 is None:
+            tmpLog.warning("lz4 is unavailable. Use zlib")
+            compression_id = _compression_zlib
+        else:
+            compression_id = compression_id_map[items[1]]
+    return FifoCodec(codec_id, compression_id)
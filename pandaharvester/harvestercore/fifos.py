@@ -2,7 +2,6 @@ import collections
 import datetime
 import json
 import os
-import pickle
 import socket
 import time
 from calendar import timegm
@@ -12,6 +11,7 @@ from pandaharvester.harvesterconfig import harvester_config
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.db_interface import DBInterface
 from pandaharvester.harvestercore.db_proxy_pool import DBProxyPool as DBProxy
+from pandaharvester.harvestercore.fifo_codec import get_codec
 from pandaharvester.harvestercore.plugin_factory import PluginFactory
 
 # attribute list
@@ -35,6 +35,7 @@ class FIFOBase(object):
         self.os_pid = os.getpid()
         self.dbProxy = DBProxy()
         self.dbInterface = DBInterface()
+        self.codec = get_codec()
 
     # get process identifier
     def get_pid(self):
@@ -62,6 +63,8 @@ class FIFOBase(object):
         else:
             self.enabled = False
             return
+        # codec to serialize objects
+        self.codec = get_codec(getattr(self.config, "fifoCodec", None))
         pluginConf = vars(self.config).copy()
         pluginConf.update({"titleName": self.titleName})
         if hasattr(self.config, "fifoModule") and hasattr(self.config, "fifoClass"):
@@ -85,12 +88,12 @@ class FIFOBase(object):
 
     # encode
     def encode(self, item):
-        item_serialized = pickle.dumps(item, -1)
+        item_serialized = self.codec.encode(item)
         return item_serialized
 
     # decode
     def decode(self, item_serialized):
-        item = pickle.loads(item_serialized)
+        item = self.codec.decode(item_serialized)
         return item
 
     # size of queue
@@ -126,6 +129,32 @@ class FIFOBase(object):
         mainLog.debug(f"id={id} score={score}")
         return retVal
 
+    # enqueue list of (item, score) in one batch, return the number of objects enqueued
+    def putmany(self, item_score_list, encode_item=True):
+        mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="putmany")
+        timeNow_timestamp = time.time()
+        item_serialized_score_list = []
+        for item, score in item_score_list:
+            if encode_item:
+                item_serialized = self.encode(item)
+            else:
+                item_serialized = item
+            if score is None:
+                score = timeNow_timestamp
+            item_serialized_score_list.append((item_serialized, score))
+        if not item_serialized_score_list:
+            return 0
+        if hasattr(self.fifo, "putmany"):
+            retVal = self.fifo.putmany(item_serialized_score_list)
+        else:
+            # plugin without batch operation
+            retVal = 0
+            for item_serialized, score in item_serialized_score_list:
+                self.fifo.put(item_serialized, score)
+                retVal += 1
+        mainLog.debug(f"put {retVal} objects")
+        return retVal
+
     # dequeue to get the first fifo object
     def get(self, timeout=None, protective=False, decode_item=True):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="get")
@@ -259,6 +288,17 @@ class FIFOBase(object):
         mainLog.debug(f"released {retVal} objects in {ids}")
         return retVal
 
+    # delete objects by list of ids in one batch, return the number of objects successfully deleted
+    def deletemany(self, ids):
+        mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="deletemany")
+        if hasattr(self.fifo, "deletemany"):
+            retVal = self.fifo.deletemany(ids)
+        else:
+            # plugin without batch operation
+            retVal = self.fifo.delete(ids)
+        mainLog.debug(f"deleted {retVal} objects out of {len(ids)}")
+        return retVal
+
     # restore objects by list of ids from temporary space to fifo; ids=None to restore all objects
     def restore(self, ids=None):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="restore")
@@ -291,6 +331,7 @@ class SpecialFIFOBase(FIFOBase):
     def __init__(self, **kwarg):
         FIFOBase.__init__(self, **kwarg)
         self.fifoName = f"{self.titleName}_fifo"
+        self.codec = get_codec(getattr(harvester_config.fifo, "fifoCodec", None))
         pluginConf = {}
         pluginConf.update({"titleName": self.titleName})
         pluginConf.update(
@@ -343,9 +384,14 @@ class MonitorFIFO(FIFOBase):
             fifoMaxWorkersPerChunk = self.config.fifoMaxWorkersPerChunk
         except AttributeError:
             fifoMaxWorkersPerChunk = 500
+        try:
+            fifoMaxChunksPerPut = self.config.fifoMaxChunksPerPut
+        except AttributeError:
+            fifoMaxChunksPerPut = 100
         workspec_iterator = self.dbProxy.get_active_workers(fifoMaxWorkersToPopulate, seconds_ago)
         last_queueName = None
         workspec_chunk = []
+        item_score_list = []
         timeNow_timestamp = time.time()
         score = timeNow_timestamp
         for workspec in workspec_iterator:
@@ -360,7 +406,10 @@ class MonitorFIFO(FIFOBase):
             elif workspec.computingSite == last_queueName and len(workspec_chunk) < fifoMaxWorkersPerChunk:
                 workspec_chunk.append([workspec])
             else:
-                self.put((last_queueName, workspec_chunk), score)
+                item_score_list.append(((last_queueName, workspec_chunk), score))
+                if len(item_score_list) >= fifoMaxChunksPerPut:
+                    self.putmany(item_score_list)
+                    item_score_list = []
                 try:
                     score = timegm(workspec.modificationTime.utctimetuple())
                 except Exception:
@@ -368,7 +417,9 @@ class MonitorFIFO(FIFOBase):
                 workspec_chunk = [[workspec]]
                 last_queueName = workspec.computingSite
         if len(workspec_chunk) > 0:
-            self.put((last_queueName, workspec_chunk), score)
+            item_score_list.append(((last_queueName, workspec_chunk), score))
+        if item_score_list:
+            self.putmany(item_score_list)
 
     def to_check_workers(self, check_interval=harvester_config.monitor.checkInterval):
         """
@@ -2,6 +2,9 @@ from pandaharvester.harvestercore import core_utils
 
 
 class PluginBase(object):
+    # set False in plugins which cannot be shared by threads, to get one cached instance per thread
+    thread_safe = True
+
     def __init__(self, **kwarg):
         for tmpKey, tmpVal in kwarg.items():
             setattr(self, tmpKey, tmpVal)
@@ -0,0 +1,269 @@
+"""
+latency histograms and batch sizes of plugin method calls for each queue, and stack samples of slow calls
+
+"""
+
+import collections
+import functools
+import sys
+import threading
+import time
+import traceback
+import types
+
+from pandaharvester.harvesterconfig import harvester_config
+
+# upper bounds in seconds of histogram buckets for latency
+latencyBuckets = (0.01, 0.1, 1, 10, 60, 300)
+
+# plugin methods to instrument
+defaultMethods = (
+    "submit_workers",
+    "check_workers",
+    "kill_workers",
+    "kill_worker",
+    "sweep_worker",
+    "trigger_stage_out",
+    "check_stage_out_status",
+    "zip_output",
+    "async_zip_output",
+    "post_zip_output",
+    "trigger_preparation",
+    "check_stage_in_status",
+    "resolve_input_paths",
+    "feed_jobs",
+    "setup_access_points",
+    "get_work_attributes",
+    "get_files_to_stage_out",
+    "post_processing",
+    "clean_up",
+)
+
+# max number of keys. Calls with new keys beyond this are aggregated into one entry
+maxKeys = 2000
+overflowKey = ("OTHERS", "OTHERS", "OTHERS")
+
+# max number of stack samples kept
+maxSlowCallSamples = 100
+
+# max number of samples for each slow call
+maxSamplesPerCall = 3
+
+# max number of innermost frames in a stack sample
+stackDepth = 15
+
+
+# get bucket index for latency
+def _get_bucket_index(latency):
+    idx = 0
+    for upperBound in latencyBuckets:
+        if latency <= upperBound:
+            break
+        idx += 1
+    return idx
+
+
+# make an empty entry of statistics
+def _new_entry():
+    return {
+        "n_calls": 0,
+        "n_errors": 0,
+        "n_slow": 0,
+        "n_items": 0,
+        "max_items": 0,
+        "total_time": 0.0,
+        "max_time": 0.0,
+        "histogram": [0] * (len(latencyBuckets) + 1),
+    }
+
+
+# aggregated statistics of plugin calls, and sampler of stacks of calls taking longer than a threshold
+class PluginCallStats(object):
+    # constructor
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        # calls in flight; token: [thread ID, key, start time, number of samples]
+        self.inFlight = {}
+        self.nTokens = 0
+        self.slowCallSamples = collections.deque(maxlen=maxSlowCallSamples)
+        self.samplerThread = None
+
+    # threshold in seconds to sample stacks of slow calls. 0 to disable sampling
+    def slow_call_threshold(self):
+        return getattr(harvester_config.master, "plugin_slow_call_threshold", 60)
+
+    # get entry for a key
+    def _get_entry(self, key):
+        entry = self.stats.get(key)
+        if entry is None:
+            if len(self.stats) >= maxKeys:
+                key = overflowKey
+                entry = self.stats.get(key)
+            if entry is None:
+                entry = _new_entry()
+                self.stats[key] = entry
+        return entry
+
+    # register a call in flight and return a token
+    def start(self, key):
+        threshold = self.slow_call_threshold()
+        with self.lock:
+            self.nTokens += 1
+            token = self.nTokens
+            self.inFlight[token] = [threading.get_ident(), key, time.monotonic(), 0]
+            if threshold > 0 and self.samplerThread is None:
+                self.samplerThread = threading.Thread(target=self._sample_loop, name="PluginCallSampler", daemon=True)
+                self.samplerThread.start()
+        return token
+
+    # record a call
+    def end(self, token, n_items, is_error):
+        threshold = self.slow_call_threshold()
+        with self.lock:
+            _, key, startTime, _ = self.inFlight.pop(token)
+            latency = time.monotonic() - startTime
+            entry = self._get_entry(key)
+            entry["n_calls"] += 1
+            if is_error:
+                entry["n_errors"] += 1
+            if threshold > 0 and latency > threshold:
+                entry["n_slow"] += 1
+            entry["n_items"] += n_items
+            if n_items > entry["max_items"]:
+                entry["max_items"] = n_items
+            entry["total_time"] += latency
+            if latency > entry["max_time"]:
+                entry["max_time"] = latency
+            entry["histogram"][_get_bucket_index(latency)] += 1
+
+    # take stack samples of calls in flight longer than the threshold
+    def sample_slow_calls(self):
+        threshold = self.slow_call_threshold()
+        if threshold <= 0:
+            return
+        timeNow = time.monotonic()
+        with self.lock:
+            targets = []
+            for token, (threadID, key, startTime, nSamples) in self.inFlight.items():
+                if timeNow - startTime > threshold and nSamples < maxSamplesPerCall:
+                    self.inFlight[token][3] += 1
+                    targets.append((threadID, key, startTime))
+        if not targets:
+            return
+        frames = sys._current_frames()
+        for threadID, key, startTime in targets:
+            frame = frames.get(threadID)
+            if frame is None:
+                continue
+            queueName, pluginName, methodName = key
+            self.slowCallSamples.append(
+                {
+                    "queue": queueName,
+                    "plugin": pluginName,
+                    "method": methodName,
+                    "thread": threadID,
+                    "sampled_at": time.time(),
+                    "elapsed": timeNow - startTime,
+                    "stack": [line.rstrip() for line in traceback.format_stack(frame, limit=stackDepth)],
+                }
+            )
+
+    # loop to take stack samples
+    def _sample_loop(self):
+        while True:
+            threshold = self.slow_call_threshold()
+            time.sleep(max(threshold / 2, 1))
+            try:
+                self.sample_slow_calls()
+            except Exception:
+                pass
+
+    # get statistics with histograms keyed by upper bounds of buckets, sorted by sort_key in descending order
+    def get_stats(self, top_n=None, sort_key="total_time"):
+        labels = [f"le_{upperBound}" for upperBound in latencyBuckets] + ["inf"]
+        timeNow = time.monotonic()
+        with self.lock:
+            items = [(key, dict(entry)) for key, entry in self.stats.items()]
+            inFlightTimes = {}
+            inFlightKeys = set()
+            for _, key, startTime, _ in self.inFlight.values():
+                inFlightTimes[key] = max(inFlightTimes.get(key, 0.0), timeNow - startTime)
+                # calls stuck before completing the first one
+                if key not in self.stats and key not in inFlightKeys:
+                    inFlightKeys.add(key)
+                    items.append((key, _new_entry()))
+        retList = []
+        for (queueName, pluginName, methodName), entry in items:
+            entry["queue"] = queueName
+            entry["plugin"] = pluginName
+            entry["method"] = methodName
+            entry["avg_time"] = entry["total_time"] / entry["n_calls"] if entry["n_calls"] else 0.0
+            entry["avg_items"] = entry["n_items"] / entry["n_calls"] if entry["n_calls"] else 0.0
+            entry["histogram"] = dict(zip(labels, entry["histogram"]))
+            # time of the longest call in flight
+            entry["in_flight_time"] = inFlightTimes.get((queueName, pluginName, methodName), 0.0)
+            retList.append(entry)
+        retList.sort(key=lambda x: x.get(sort_key, 0), reverse=True)
+        if top_n is not None:
+            retList = retList[:top_n]
+        return retList
+
+    # get recent stack samples of slow calls
+    def get_slow_call_samples(self):
+        with self.lock:
+            return list(self.slowCallSamples)
+
+    # clear statistics
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.slowCallSamples.clear()
+
+
+# statistics of plugin calls in the process
+callStats = PluginCallStats()
+
+
+# number of items passed to a plugin method, i.e. the length of the first argument if it is a list
+def _get_n_items(args):
+    if args and isinstance(args[0], (list, tuple, set, dict)):
+        return len(args[0])
+    return 1
+
+
+# wrap a bound method to record calls
+def _wrap_method(method, key):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        token = callStats.start(key)
+        isError = True
+        try:
+            retVal = method(*args, **kwargs)
+            isError = retVal is False or (isinstance(retVal, tuple) and len(retVal) > 0 and retVal[0] is False)
+            return retVal
+        finally:
+            callStats.end(token, _get_n_items(args), isError)
+
+    return wrapper
+
+
+# instrument methods of a plugin instance
+def instrument_plugin(impl, queue_name):
+    if not getattr(harvester_config.master, "plugin_call_stats", True):
+        return impl
+    tmpStr = getattr(harvester_config.master, "plugin_call_stats_methods", None)
+    if tmpStr:
+        methodNames = [tmpItem.strip() for tmpItem in tmpStr.split(",") if tmpItem.strip()]
+    else:
+        methodNames = defaultMethods
+    pluginName = f"{impl.__class__.__module__.split('.')[-1]}.{impl.__class__.__name__}"
+    if queue_name is None:
+        queue_name = "ANY"
+    for methodName in methodNames:
+        # only bound methods, since middleware makes remote methods on the fly
+        method = getattr(impl, methodName, None)
+        if not isinstance(method, types.MethodType):
+            continue
+        setattr(impl, methodName, _wrap_method(method, (queue_name, pluginName, methodName)))
+    return impl
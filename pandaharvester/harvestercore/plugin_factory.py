@@ -1,10 +1,83 @@
-from . import core_utils
+import collections
+import hashlib
+import json
+import threading
+
+from pandaharvester.harvesterconfig import harvester_config
+
+from . import core_utils, plugin_call_stats
 from .db_interface import DBInterface
 
 # logger
 _logger = core_utils.setup_logger("plugin_factory")
 
 
+# cache of plugin instances shared by all factories in the process
+class PluginInstanceCache(object):
+    # constructor
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.instances = collections.OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self.construction_stats = {}
+
+    # max number of instances to keep. 0 to disable the cache
+    def max_size(self):
+        try:
+            return int(harvester_config.master.plugin_instance_cache_size)
+        except Exception:
+            return 0
+
+    # get an instance
+    def get(self, cache_key):
+        with self.lock:
+            if cache_key in self.instances:
+                self.instances.move_to_end(cache_key)
+                self.stats["hits"] += 1
+                return self.instances[cache_key][1]
+            self.stats["misses"] += 1
+            return None
+
+    # add an instance and evict the least recently used ones
+    def put(self, cache_key, queue_name, impl, max_size):
+        with self.lock:
+            # keep the instance made by another thread in the meantime
+            if cache_key in self.instances:
+                return self.instances[cache_key][1]
+            self.instances[cache_key] = (queue_name, impl)
+            while len(self.instances) > max_size:
+                self.instances.popitem(last=False)
+                self.stats["evictions"] += 1
+            return impl
+
+    # remove instances for a queue, or all instances if queue_name is None
+    def invalidate(self, queue_name=None):
+        with self.lock:
+            for cache_key, (tmp_queue_name, _) in list(self.instances.items()):
+                if queue_name is None or tmp_queue_name == queue_name:
+                    del self.instances[cache_key]
+                    self.stats["invalidations"] += 1
+
+    # record time to construct an instance
+    def record_construction(self, plugin_key, elapsed_time):
+        with self.lock:
+            self.construction_stats.setdefault(plugin_key, {"n_constructions": 0, "construction_time": 0.0})
+            self.construction_stats[plugin_key]["n_constructions"] += 1
+            self.construction_stats[plugin_key]["construction_time"] += elapsed_time
+
+    # get statistics
+    def get_stats(self):
+        with self.lock:
+            ret_map = dict(self.stats)
+            ret_map["size"] = len(self.instances)
+            ret_map["constructions"] = {k: dict(v) for k, v in self.construction_stats.items()}
+            return ret_map
+
+
+# instance cache
+_instance_cache = PluginInstanceCache()
+
+
 # plugin factory
 class PluginFactory(object):
     # constructor
@@ -20,8 +93,18 @@ class PluginFactory(object):
         pluginKey = f"{moduleName}.{className}"
         return pluginKey
 
-    # get plugin instance
-    def get_plugin(self, plugin_conf):
+    # get key of instance cache with a stable hash of plugin config
+    def get_instance_cache_key(self, plugin_conf, cls, instrument=True):
+        conf_str = json.dumps(plugin_conf, sort_keys=True, default=str)
+        # instrumented and bare instances are cached separately
+        cache_key = f"{hashlib.sha1(conf_str.encode()).hexdigest()}:{self.noDB}:{instrument}"
+        # one instance per thread if the plugin is not thread-safe
+        if not getattr(cls, "thread_safe", True):
+            cache_key += f":{threading.get_ident()}"
+        return cache_key
+
+    # get plugin instance. Hot methods are instrumented unless instrument=False
+    def get_plugin(self, plugin_conf, instrument=True):
         # use module + class as key
         moduleName = plugin_conf["module"]
         className = plugin_conf["name"]
@@ -41,6 +124,14 @@ class PluginFactory(object):
             cls = getattr(mod, className)
             # add
             self.classMap[pluginKey] = cls
+        cls = self.classMap[pluginKey]
+        # look up instance cache
+        max_cache_size = _instance_cache.max_size()
+        if max_cache_size > 0:
+            cache_key = self.get_instance_cache_key(plugin_conf, cls, instrument)
+            impl = _instance_cache.get(cache_key)
+            if impl is not None:
+                return impl
         # make args
         args = {}
         for tmpKey, tmpVal in plugin_conf.items():
@@ -51,10 +142,27 @@ class PluginFactory(object):
         if not self.noDB:
             args["dbInterface"] = DBInterface()
         # instantiate
-        cls = self.classMap[pluginKey]
+        sw = core_utils.get_stopwatch()
         impl = cls(**args)
-        # bare instance when middleware is used
+        _instance_cache.record_construction(pluginKey, sw.get_elapsed_time_in_sec())
+        # bare instance when middleware is used. Not instrumented since calls are recorded through the middleware
         if "original_config" in plugin_conf and "bareFunctions" in plugin_conf:
-            bare_impl = self.get_plugin(plugin_conf["original_config"])
+            bare_impl = self.get_plugin(plugin_conf["original_config"], instrument=False)
             impl.bare_impl = bare_impl
+        # record latencies of plugin calls
+        if instrument:
+            impl = plugin_call_stats.instrument_plugin(impl, plugin_conf.get("queueName"))
+        # add to instance cache
+        if max_cache_size > 0:
+            impl = _instance_cache.put(cache_key, plugin_conf.get("queueName"), impl, max_cache_size)
         return impl
+
+    # invalidate cached instances of a queue, or all cached instances if queue_name is None
+    @staticmethod
+    def invalidate_instance_cache(queue_name=None):
+        _instance_cache.invalidate(queue_name)
+
+    # get statistics of instance cache and plugin construction
+    @staticmethod
+    def get_instance_cache_stats():
+        return _instance_cache.get_stats()
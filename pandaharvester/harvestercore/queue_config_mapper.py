@@ -701,6 +701,10 @@ class QueueConfigMapper(metaclass=SingletonWithID):
                     continue
                 # added to active queues
                 activeQueues[queueName] = queueConfig
+            # drop cached plugin instances of queues which were changed or removed
+            for tmpQueueName, oldQueueConfig in getattr(self, "queueConfig", {}).items():
+                if tmpQueueName not in newQueueConfig or vars(newQueueConfig[tmpQueueName]) != vars(oldQueueConfig):
+                    PluginFactory.invalidate_instance_cache(tmpQueueName)
             self.queueConfig = newQueueConfig.copy()
             self.activeQueues = activeQueues.copy()
             newQueueConfigWithID = dict()
@@ -27,6 +27,14 @@ def as_python_object(dct):
     return dct
 
 
+# decode blob value loaded from DB. The raw value is kept if it is not JSON
+def decode_json_blob(raw_val):
+    try:
+        return json.loads(raw_val, object_hook=as_python_object)
+    except JSONDecodeError:
+        return raw_val
+
+
 # base class for XyzSpec
 class SpecBase(object):
     # to be set
@@ -34,23 +42,43 @@ class SpecBase(object):
     zeroAttrs = ()
     skipAttrsToSlim = ()
 
-    # constructor
-    def __init__(self):
-        # remove types
-        object.__setattr__(self, "attributes", [])
-        object.__setattr__(self, "serializedAttrs", set())
-        for attr in self.attributesWithTypes:
+    # attribute metadata compiled once per class from attributesWithTypes
+    attributes = ()
+    serializedAttrs = frozenset()
+    _zeroAttrSet = frozenset()
+    _skipAttrSetToSlim = frozenset()
+    _defaultValues = {}
+    _columnNames = ""
+    _columnNamesSlim = ""
+    _bindValuesExpression = "VALUES()"
+
+    # compile attribute metadata when a subclass is defined
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        attributes = []
+        serializedAttrs = set()
+        for attr in cls.attributesWithTypes:
             attr, attrType = attr.split(":")
             attrType = attrType.split()[0]
-            self.attributes.append(attr)
+            attributes.append(attr)
             if attrType in ["blob"]:
-                self.serializedAttrs.add(attr)
+                serializedAttrs.add(attr)
+        cls.attributes = tuple(attributes)
+        cls.serializedAttrs = frozenset(serializedAttrs)
+        cls._zeroAttrSet = frozenset(cls.zeroAttrs)
+        skipAttrsToSlim = cls.skipAttrsToSlim
+        if isinstance(skipAttrsToSlim, str):
+            skipAttrsToSlim = (skipAttrsToSlim,)
+        cls._skipAttrSetToSlim = frozenset(skipAttrsToSlim)
+        cls._defaultValues = {attr: 0 if attr in cls._zeroAttrSet else None for attr in attributes}
+        cls._columnNames = ",".join(attributes)
+        cls._columnNamesSlim = ",".join([attr for attr in attributes if attr not in cls._skipAttrSetToSlim])
+        cls._bindValuesExpression = "VALUES(" + ",".join([f":{attr}" for attr in attributes]) + ")"
+
+    # constructor
+    def __init__(self):
         # install attributes
-        for attr in self.attributes:
-            if attr in self.zeroAttrs:
-                object.__setattr__(self, attr, 0)
-            else:
-                object.__setattr__(self, attr, None)
+        self.__dict__.update(self._defaultValues)
         # map of changed attributes
         object.__setattr__(self, "changedAttrs", {})
 
@@ -58,21 +86,60 @@ class SpecBase(object):
     def __setattr__(self, name, value):
         oldVal = getattr(self, name)
         object.__setattr__(self, name, value)
-        newVal = getattr(self, name)
         # collect changed attributes
-        if oldVal != newVal:
+        if oldVal != value:
             self.changedAttrs[name] = value
 
-    # keep state for pickle
+    # decode blob attribute lazily on first access
+    def __getattr__(self, name):
+        lazyBlobs = self.__dict__.get("_lazyBlobs")
+        if lazyBlobs is not None and name in lazyBlobs:
+            decoder, rawVal = lazyBlobs.pop(name)
+            val = decoder(rawVal)
+            object.__setattr__(self, name, val)
+            return val
+        raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
+    # set raw value of blob attribute to be decoded on first access
+    def set_lazy_blob_attribute(self, key, raw_val, decoder):
+        attrDict = self.__dict__
+        attrDict.pop(key, None)
+        attrDict.setdefault("_lazyBlobs", {})[key] = (decoder, raw_val)
+
+    # decode all blob attributes which are not decoded yet
+    def decode_lazy_blobs(self):
+        lazyBlobs = self.__dict__.pop("_lazyBlobs", None)
+        if lazyBlobs:
+            for key, (decoder, rawVal) in lazyBlobs.items():
+                if key not in self.__dict__:
+                    object.__setattr__(self, key, decoder(rawVal))
+
+    # keep state for pickle. Raw values of blob attributes loaded from DB are kept to be decoded lazily after unpickled
     def __getstate__(self):
+        rawBlobs = self._get_raw_blobs()
         odict = self.__dict__.copy()
         del odict["changedAttrs"]
+        # attribute metadata is kept in the class
+        odict.pop("attributes", None)
+        odict.pop("serializedAttrs", None)
+        # new dict not to share lazy blobs with copies
+        odict.pop("_lazyBlobs", None)
+        if rawBlobs:
+            odict["_lazyBlobs"] = {key: (decode_json_blob, rawVal) for key, rawVal in rawBlobs.items()}
         return odict
 
     # restore state from the unpickled state values
     def __setstate__(self, state):
         self.__init__()
         for k, v in state.items():
+            # ignore attribute metadata pickled by old versions
+            if k in ("attributes", "serializedAttrs"):
+                continue
+            # blob attributes to be decoded on first access
+            if k == "_lazyBlobs":
+                for key, (decoder, rawVal) in v.items():
+                    self.set_lazy_blob_attribute(key, rawVal, decoder)
+                continue
             object.__setattr__(self, k, v)
 
     # reset changed attribute list
@@ -81,7 +148,7 @@ class SpecBase(object):
 
     # force update
     def force_update(self, name):
-        if name in self.attributes:
+        if name in self._defaultValues:
             self.changedAttrs[name] = getattr(self, name)
 
     # force not update
@@ -97,17 +164,75 @@ class SpecBase(object):
     def pack(self, values, slim=False):
         if hasattr(values, "_asdict"):
             values = values._asdict()
+        attrDict = self.__dict__
+        attrDict.pop("_lazyBlobs", None)
+        serializedAttrs = self.serializedAttrs
+        skipAttrs = self._skipAttrSetToSlim if slim else ()
         for attr in self.attributes:
-            if slim and attr in self.skipAttrsToSlim:
+            if attr in skipAttrs:
                 val = None
             else:
                 val = values[attr]
-                if attr in self.serializedAttrs and val is not None:
-                    try:
-                        val = json.loads(val, object_hook=as_python_object)
-                    except JSONDecodeError:
-                        pass
-            object.__setattr__(self, attr, val)
+                # blob attributes are decoded on first access
+                if val is not None and attr in serializedAttrs:
+                    self.set_lazy_blob_attribute(attr, val, decode_json_blob)
+                    continue
+            attrDict[attr] = val
+
+    # make objects from DB rows, resolving column positions once for all rows
+    def pack_rows(cls, rows, slim=False):
+        retList = []
+        if not rows:
+            return retList
+        # get column names from the first row
+        firstRow = rows[0]
+        if hasattr(firstRow, "keys"):
+            # sqlite3.Row
+            columnNames = list(firstRow.keys())
+        elif hasattr(firstRow, "attributes"):
+            # DictTupleHybrid
+            columnNames = list(firstRow.attributes)
+        elif hasattr(firstRow, "_fields"):
+            # namedtuple
+            columnNames = list(firstRow._fields)
+        else:
+            columnNames = None
+        skipAttrs = cls._skipAttrSetToSlim if slim else ()
+        if columnNames is None or any(attr not in columnNames for attr in cls.attributes if attr not in skipAttrs):
+            # fall back to pack one by one
+            for row in rows:
+                spec = cls()
+                spec.pack(row, slim=slim)
+                retList.append(spec)
+            return retList
+        # positions of attributes
+        positions = []
+        for attr in cls.attributes:
+            if attr in skipAttrs:
+                positions.append((attr, None, False))
+            else:
+                positions.append((attr, columnNames.index(attr), attr in cls.serializedAttrs))
+        for row in rows:
+            spec = cls()
+            attrDict = spec.__dict__
+            lazyBlobs = {}
+            for attr, idx, isSerialized in positions:
+                if idx is None:
+                    val = None
+                else:
+                    val = row[idx]
+                    # blob attributes are decoded on first access
+                    if isSerialized and val is not None:
+                        del attrDict[attr]
+                        lazyBlobs[attr] = (decode_json_blob, val)
+                        continue
+                attrDict[attr] = val
+            if lazyBlobs:
+                attrDict["_lazyBlobs"] = lazyBlobs
+            retList.append(spec)
+        return retList
+
+    pack_rows = classmethod(pack_rows)
 
     # set blob attribute
     def set_blob_attribute(self, key, val):
@@ -119,15 +244,15 @@ class SpecBase(object):
 
     # return column names for INSERT
     def column_names(cls, prefix=None, slim=False):
+        if prefix is None:
+            if slim:
+                return cls._columnNamesSlim
+            return cls._columnNames
         ret = ""
-        for attr in cls.attributesWithTypes:
-            attr = attr.split(":")[0]
-            if slim and attr in cls.skipAttrsToSlim:
+        for attr in cls.attributes:
+            if slim and attr in cls._skipAttrSetToSlim:
                 continue
-            if prefix is None:
-                ret += f"{attr},"
-            else:
-                ret += f"{prefix}.{attr},"
+            ret += f"{prefix}.{attr},"
         ret = ret[:-1]
         return ret
 
@@ -135,13 +260,7 @@ class SpecBase(object):
 
     # return expression of bind variables for INSERT
     def bind_values_expression(cls):
-        ret = "VALUES("
-        for attr in cls.attributesWithTypes:
-            attr = attr.split(":")[0]
-            ret += f":{attr},"
-        ret = ret[:-1]
-        ret += ")"
-        return ret
+        return cls._bindValuesExpression
 
     bind_values_expression = classmethod(bind_values_expression)
 
@@ -155,21 +274,39 @@ class SpecBase(object):
         ret += " "
         return ret
 
+    # get raw values of blob attributes which were loaded from DB and are not decoded yet, and decode other blob attributes
+    def _get_raw_blobs(self):
+        lazyBlobs = self.__dict__.get("_lazyBlobs")
+        if not lazyBlobs:
+            return {}
+        rawBlobs = {}
+        for key, (decoder, rawVal) in list(lazyBlobs.items()):
+            if decoder is decode_json_blob:
+                rawBlobs[key] = rawVal
+            else:
+                getattr(self, key)
+        return rawBlobs
+
     # return map of values
     def values_map(self, only_changed=False):
         ret = {}
+        rawBlobs = self._get_raw_blobs()
+        attrDict = self.__dict__
+        changedAttrs = self.changedAttrs
+        zeroAttrs = self._zeroAttrSet
+        serializedAttrs = self.serializedAttrs
         for attr in self.attributes:
             # only changed attributes
-            if only_changed:
-                if attr not in self.changedAttrs:
-                    continue
-            val = getattr(self, attr)
-            if val is None:
-                if attr in self.zeroAttrs:
-                    val = 0
-                else:
-                    val = None
-            if attr in self.serializedAttrs:
+            if only_changed and attr not in changedAttrs:
+                continue
+            # raw value of blob which is not accessed since being loaded
+            if attr in rawBlobs:
+                ret[f":{attr}"] = rawBlobs[attr]
+                continue
+            val = attrDict[attr]
+            if val is None and attr in zeroAttrs:
+                val = 0
+            if attr in serializedAttrs:
                 val = json.dumps(val, cls=PythonObjectEncoder)
             ret[f":{attr}"] = val
         return ret
@@ -177,18 +314,23 @@ class SpecBase(object):
     # return list of values
     def values_list(self, only_changed=False):
         ret = []
+        rawBlobs = self._get_raw_blobs()
+        attrDict = self.__dict__
+        changedAttrs = self.changedAttrs
+        zeroAttrs = self._zeroAttrSet
+        serializedAttrs = self.serializedAttrs
         for attr in self.attributes:
             # only changed attributes
-            if only_changed:
-                if attr not in self.changedAttrs:
-                    continue
-            val = getattr(self, attr)
-            if val is None:
-                if attr in self.zeroAttrs:
-                    val = 0
-                else:
-                    val = None
-            if attr in self.serializedAttrs:
+            if only_changed and attr not in changedAttrs:
+                continue
+            # raw value of blob which is not accessed since being loaded
+            if attr in rawBlobs:
+                ret.append(rawBlobs[attr])
+                continue
+            val = attrDict[attr]
+            if val is None and attr in zeroAttrs:
+                val = 0
+            if attr in serializedAttrs:
                 val = json.dumps(val, cls=PythonObjectEncoder)
             ret.append(val)
         return ret
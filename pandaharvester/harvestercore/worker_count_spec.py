@@ -0,0 +1,28 @@
+"""
+Worker count spec class for the summary table of worker counts.
+Each row is a change in the number of workers, and the number is given by the sum of rows with the same keys
+
+"""
+
+from .spec_base import SpecBase
+
+
+class WorkerCountSpec(SpecBase):
+    # attributes
+    attributesWithTypes = (
+        "computingSite:text / index",
+        "jobType:text",
+        "resourceType:text",
+        "pilotType:text",
+        "status:text",
+        "nWorkers:integer",
+        "nCore:integer",
+        "minRamCount:integer",
+    )
+
+    # keys to count workers
+    countKeys = ("computingSite", "jobType", "resourceType", "pilotType", "status")
+
+    # constructor
+    def __init__(self):
+        SpecBase.__init__(self)
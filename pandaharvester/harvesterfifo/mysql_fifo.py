@@ -325,6 +325,18 @@ class MysqlFifo(PluginBase):
             self.rollback()
             raise _e
 
+    # enqueue list of (item, score) in one transaction
+    def putmany(self, item_score_list):
+        sql_push = f"INSERT INTO {self.tableName} (item, score) VALUES (%s, %s) "
+        params_list = [(item, score) for item, score in item_score_list]
+        try:
+            self.executemany(sql_push, params_list)
+            self.commit()
+        except Exception as _e:
+            self.rollback()
+            raise _e
+        return len(params_list)
+
     # enqueue by id
     def putbyid(self, id, item, score):
         try:
@@ -370,8 +382,9 @@ class MysqlFifo(PluginBase):
         try:
             self.execute(sql_get_many)
             res = self.cur.fetchall()
+            # take objects in one transaction
+            got_list = []
             for _rec in res:
-                got_object = False
                 id, item, score = _rec
                 params = (id,)
                 if protective:
@@ -379,11 +392,10 @@ class MysqlFifo(PluginBase):
                 else:
                     self.execute(sql_pop_del, params)
                 n_row = self.cur.rowcount
-                self.commit()
                 if n_row >= 1:
-                    got_object = True
-                if got_object:
-                    ret_list.append(_rec)
+                    got_list.append(_rec)
+            self.commit()
+            ret_list = got_list
         except Exception as _e:
             self.rollback()
             _exc = _e
@@ -468,6 +480,27 @@ class MysqlFifo(PluginBase):
         else:
             raise TypeError("ids should be list or tuple")
 
+    # delete objects by list of id in one transaction
+    def deletemany(self, ids):
+        sql_delete_template = "DELETE FROM {table_name} WHERE id in ({placeholders} ) "
+        max_ids_per_statement = 500
+        if isinstance(ids, (list, tuple)):
+            n_row = 0
+            try:
+                for i_id in range(0, len(ids), max_ids_per_statement):
+                    sub_ids = ids[i_id : i_id + max_ids_per_statement]
+                    placeholders_str = ",".join([" %s"] * len(sub_ids))
+                    sql_delete = sql_delete_template.format(table_name=self.tableName, placeholders=placeholders_str)
+                    self.execute(sql_delete, sub_ids)
+                    n_row += self.cur.rowcount
+                self.commit()
+            except Exception as _e:
+                self.rollback()
+                raise _e
+            return n_row
+        else:
+            raise TypeError("ids should be list or tuple")
+
     # Move objects in temporary space to the queue
     def restore(self, ids):
         if ids is None:
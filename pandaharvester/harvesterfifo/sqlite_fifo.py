@@ -39,6 +39,8 @@ class SqliteFifo(PluginBase):
     _peek_sql = "SELECT id, item, score FROM queue_table " "WHERE temporary = 0 " "ORDER BY score LIMIT 1"
     _restore_sql = "UPDATE queue_table SET temporary = 0 WHERE temporary != 0"
     _restore_sql_template = "UPDATE queue_table SET temporary = 0 " "WHERE temporary != 0 AND id in ({0})"
+    # max number of ids in a statement
+    _max_ids_per_statement = 500
 
     # constructor
     def __init__(self, **kwarg):
@@ -145,6 +147,15 @@ class SqliteFifo(PluginBase):
                 retVal = True
         return retVal
 
+    # enqueue list of (item, score) in one transaction
+    def putmany(self, item_score_list):
+        params_list = [(memoryviewOrBuffer(item), score) for item, score in item_score_list]
+        with self._get_conn() as conn:
+            conn.execute(self._write_lock_sql)
+            cursor = conn.executemany(self._push_sql, params_list)
+            n_row = cursor.rowcount
+        return n_row
+
     # enqueue by id
     def putbyid(self, id, item, score):
         retVal = False
@@ -232,6 +243,21 @@ class SqliteFifo(PluginBase):
         else:
             raise TypeError("ids should be list or tuple")
 
+    # delete objects by list of id in one transaction
+    def deletemany(self, ids):
+        if isinstance(ids, (list, tuple)):
+            n_row = 0
+            with self._get_conn() as conn:
+                conn.execute(self._write_lock_sql)
+                for i_id in range(0, len(ids), self._max_ids_per_statement):
+                    sub_ids = ids[i_id : i_id + self._max_ids_per_statement]
+                    placeholders_str = ",".join("?" * len(sub_ids))
+                    cursor = conn.execute(self._del_sql_template.format(placeholders_str), sub_ids)
+                    n_row += cursor.rowcount
+            return n_row
+        else:
+            raise TypeError("ids should be list or tuple")
+
     # Move objects in temporary space to the queue
     def restore(self, ids):
         with self._get_conn() as conn:
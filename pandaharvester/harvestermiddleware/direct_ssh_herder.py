@@ -40,6 +40,9 @@ def update_object(old_obj, new_obj):
                 else:
                     old_obj[k] = new_obj[k]
     elif hasattr(old_obj, "__dict__"):
+        # blob attributes not decoded yet are missing in __dict__
+        if hasattr(old_obj, "decode_lazy_blobs"):
+            old_obj.decode_lazy_blobs()
         for k in old_obj.__dict__:
             try:
                 new_obj.__dict__[k]
@@ -0,0 +1,304 @@
+# === Imports ===================================================
+
+import random
+import re
+import shlex
+import subprocess
+import threading
+import time
+from threading import get_ident
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore.core_utils import SingletonWithID
+from pandaharvester.harvestercore.fifos import SpecialFIFOBase
+
+# ===============================================================
+
+# === Definitions ===============================================
+
+# logger
+baseLogger = core_utils.setup_logger("batch_status_utils")
+
+# ===============================================================
+
+# === Functions =================================================
+
+
+def _runShell(cmd):
+    """
+    Run shell function
+    """
+    p = subprocess.Popen(shlex.split(cmd), shell=False, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdOut, stdErr = p.communicate()
+    retCode = p.returncode
+    return (retCode, stdOut, stdErr)
+
+
+def _parse_sacct(stdOut):
+    """
+    Parse output of sacct -X -n -P -o JobIDRaw,State
+    e.g. 12345|RUNNING , 12346|CANCELLED by 1000
+    """
+    status_map = {}
+    for line in stdOut.splitlines():
+        items = line.split("|")
+        if len(items) < 2 or not items[1].strip():
+            continue
+        status_map[items[0].strip()] = (items[1].split()[0], line)
+    return status_map
+
+
+def _parse_qstat_pbs(stdOut):
+    """
+    Parse output of qstat of PBS/Torque
+    Job ID                    Name             User            Time Use S Queue
+    ------------------------- ---------------- --------------- -------- - -----
+    1234.server               job              user            00:00:01 R batch
+    """
+    status_map = {}
+    for line in stdOut.splitlines():
+        items = line.split()
+        if len(items) < 6 or line.startswith("Job") or line.startswith("-"):
+            continue
+        status_map[items[0]] = (items[-2], line)
+        # batchID may be kept without server name
+        status_map.setdefault(items[0].split(".")[0], (items[-2], line))
+    return status_map
+
+
+def _parse_bjobs(stdOut):
+    """
+    Parse output of bjobs -a -noheader -o 'jobid:10 stat:10'
+    """
+    status_map = {}
+    for line in stdOut.splitlines():
+        items = line.split()
+        if len(items) < 2:
+            continue
+        status_map[items[0]] = (items[1], line)
+    return status_map
+
+
+def _parse_qstat_cobalt(stdOut):
+    """
+    Parse output of qstat of Cobalt
+    JobID  User     WallTime  Nodes  State   Location
+    ===================================================
+    77734  fcurtis  06:00:00  64     queued  None
+    """
+    status_map = {}
+    for line in stdOut.splitlines():
+        items = line.split()
+        if len(items) < 5 or not items[0].isdigit():
+            continue
+        status_map[items[0]] = (items[4], line)
+    return status_map
+
+
+def _make_sacct_command(cluster, lookback_hours):
+    comStr = f"sacct -X -n -P -o JobIDRaw,State -S now-{int(lookback_hours)}hours"
+    if cluster:
+        comStr += f" -M {cluster}"
+    return comStr
+
+
+def _make_qstat_pbs_command(cluster, lookback_hours):
+    comStr = "qstat"
+    if cluster:
+        comStr += f" @{cluster}"
+    return comStr
+
+
+def _make_bjobs_command(cluster, lookback_hours):
+    comStr = f"bjobs -a -noheader -o {shlex.quote('jobid:10 stat:10')}"
+    if cluster:
+        comStr += f" -m {cluster}"
+    return comStr
+
+
+def _make_qstat_cobalt_command(cluster, lookback_hours):
+    return "qstat"
+
+
+# functions to make the bulk query command and to parse its output for each batch system
+BATCH_QUERY_MAP = {
+    "slurm": (_make_sacct_command, _parse_sacct),
+    "pbs": (_make_qstat_pbs_command, _parse_qstat_pbs),
+    "lsf": (_make_bjobs_command, _parse_bjobs),
+    "cobalt": (_make_qstat_cobalt_command, _parse_qstat_cobalt),
+}
+
+
+def get_batch_status_snapshot(batch_system, cluster=None, refresh_interval=60, lookback_hours=24, use_fifo=None):
+    """
+    Get the snapshot shared by all threads in the process for a batch system and a cluster.
+    The snapshot is shared across processes through fifo only if the fifo section is configured, unless use_fifo is given
+    """
+    if use_fifo is None:
+        use_fifo = hasattr(harvester_config, "fifo")
+    return BatchStatusSnapshot(
+        batch_system=batch_system,
+        cluster=cluster,
+        refresh_interval=refresh_interval,
+        lookback_hours=lookback_hours,
+        use_fifo=use_fifo,
+        id=f"{batch_system},{cluster}",
+    )
+
+
+# ===============================================================
+
+# === Classes ===================================================
+
+
+# Fifo to share status snapshots across processes
+class BatchStatusCacheFifo(SpecialFIFOBase, metaclass=SingletonWithID):
+    global_lock_id = -1
+    snapshot_id = 0
+
+    def __init__(self, target, *args, **kwargs):
+        name_suffix = re.sub(r"\W", "_", target)
+        self.titleName = f"BatchStatusCache_{name_suffix}"
+        SpecialFIFOBase.__init__(self)
+
+    def lock(self):
+        lock_key = format(int(random.random() * 2**32), "x")
+        retVal = self.putbyid(self.global_lock_id, lock_key, time.time())
+        if retVal:
+            return lock_key
+        return None
+
+    def unlock(self, key=None, force=False):
+        peeked_tuple = self.peekbyid(id=self.global_lock_id)
+        if peeked_tuple is None or peeked_tuple.score is None or peeked_tuple.item is None:
+            return True
+        elif force or self.decode(peeked_tuple.item) == key:
+            self.delete([self.global_lock_id])
+            return True
+        else:
+            return False
+
+    # get time when the lock was taken, or None if unlocked
+    def get_lock_time(self):
+        peeked_tuple = self.peekbyid(id=self.global_lock_id, skip_item=True)
+        if peeked_tuple is None:
+            return None
+        return peeked_tuple.score
+
+
+# Snapshot of statuses of all batch jobs in a cluster, indexed by batchID
+class BatchStatusSnapshot(object, metaclass=SingletonWithID):
+    # max time in seconds to wait for the snapshot refreshed by another process
+    lockTimeout = 120
+
+    def __init__(self, batch_system, cluster=None, refresh_interval=60, lookback_hours=24, use_fifo=False, *args, **kwargs):
+        self.batchSystem = batch_system
+        self.cluster = cluster
+        self.refreshInterval = refresh_interval
+        self.lookbackHours = lookback_hours
+        self.useFifo = use_fifo
+        self.target = f"{batch_system}_{cluster}" if cluster else batch_system
+        self.lock = threading.Lock()
+        # local snapshot and time of the bulk query
+        self.snapshot = (None, 0)
+
+    # run the bulk query and parse the output
+    def _query(self, tmpLog):
+        make_command, parse_output = BATCH_QUERY_MAP[self.batchSystem]
+        comStr = make_command(self.cluster, self.lookbackHours)
+        tmpLog.debug(f"query with {comStr}")
+        timeNow = time.time()
+        try:
+            retCode, stdOut, stdErr = _runShell(comStr)
+        except Exception as e:
+            tmpLog.error(f"failed to run {comStr} with {e.__class__.__name__}: {e}")
+            return None
+        if retCode != 0:
+            tmpLog.error(f"{comStr} failed with retCode={retCode} {stdOut} {stdErr}")
+            return None
+        status_map = parse_output(stdOut)
+        tmpLog.debug(f"got {len(status_map)} jobs in {time.time() - timeNow:.3f} sec")
+        return status_map
+
+    # get snapshot refreshed by another process if it is new enough
+    def _load_from_fifo(self, cache_fifo, last_update):
+        peeked_tuple = cache_fifo.peekbyid(id=cache_fifo.snapshot_id, skip_item=True)
+        if peeked_tuple is None or peeked_tuple.score is None:
+            return None
+        if peeked_tuple.score <= last_update or time.time() > peeked_tuple.score + self.refreshInterval:
+            return None
+        peeked_tuple = cache_fifo.peekbyid(id=cache_fifo.snapshot_id)
+        if peeked_tuple is None or peeked_tuple.item is None:
+            return None
+        return cache_fifo.decode(peeked_tuple.item), peeked_tuple.score
+
+    # refresh snapshot through the fifo so that only one process runs the bulk query in each refresh interval
+    def _refresh_with_fifo(self, tmpLog, last_update):
+        cache_fifo = BatchStatusCacheFifo(target=self.target, id=f"{self.target},{get_ident()}")
+        attempt_timestamp = time.time()
+        while True:
+            # refreshed by another process
+            retVal = self._load_from_fifo(cache_fifo, last_update)
+            if retVal is not None:
+                tmpLog.debug("got snapshot from fifo")
+                return retVal
+            lock_key = cache_fifo.lock()
+            if lock_key is not None:
+                try:
+                    # check again since another process could have refreshed it just before the lock
+                    retVal = self._load_from_fifo(cache_fifo, last_update)
+                    if retVal is not None:
+                        return retVal
+                    status_map = self._query(tmpLog)
+                    if status_map is None:
+                        return None
+                    timeNow = time.time()
+                    cache_fifo.delete([cache_fifo.snapshot_id])
+                    cache_fifo.putbyid(cache_fifo.snapshot_id, status_map, timeNow)
+                    return status_map, timeNow
+                finally:
+                    if not cache_fifo.unlock(key=lock_key):
+                        tmpLog.warning("cannot unlock... Maybe something wrong")
+            # locked by another process
+            lock_time = cache_fifo.get_lock_time()
+            if lock_time is not None and time.time() > lock_time + self.lockTimeout:
+                tmpLog.debug("got lock expired. Clean up and retry...")
+                cache_fifo.unlock(force=True)
+                continue
+            if time.time() > attempt_timestamp + self.lockTimeout:
+                tmpLog.debug(f"timeout ({self.lockTimeout} seconds) to wait for snapshot. Query directly")
+                break
+            time.sleep(random.uniform(1, 3))
+        status_map = self._query(tmpLog)
+        if status_map is None:
+            return None
+        return status_map, time.time()
+
+    def get_status_map(self):
+        """
+        Get a dict of batchID: (batch status, line in query output), or None if unavailable
+        """
+        status_map, last_update = self.snapshot
+        if status_map is not None and time.time() <= last_update + self.refreshInterval:
+            return status_map
+        with self.lock:
+            # refreshed by another thread while waiting for the lock
+            status_map, last_update = self.snapshot
+            if status_map is not None and time.time() <= last_update + self.refreshInterval:
+                return status_map
+            tmpLog = core_utils.make_logger(baseLogger, f"target={self.target}", method_name="BatchStatusSnapshot.get_status_map")
+            if self.useFifo:
+                retVal = self._refresh_with_fifo(tmpLog, last_update)
+            else:
+                status_map = self._query(tmpLog)
+                retVal = None if status_map is None else (status_map, time.time())
+            if retVal is None:
+                # the old snapshot is not used since jobs could have changed the status
+                tmpLog.warning("failed to refresh snapshot")
+                return None
+            self.snapshot = retVal
+            return retVal[0]
+
+
+# ===============================================================
@@ -206,11 +206,14 @@ def condor_submit_process(mp_queue, host, jdl_map_list, tmp_log):
 # Condor queue cache fifo
 class CondorQCacheFifo(SpecialFIFOBase, metaclass=SingletonWithID):
     global_lock_id = -1
+    # id of metadata of the cache. Shards of job ads indexed by ClusterId are stored with ids from 1
+    meta_id = 0
 
     def __init__(self, target, *args, **kwargs):
         name_suffix = target.split(".")[0]
         name_suffix = re.sub("-", "_", name_suffix)
-        self.titleName = f"CondorQCache_{name_suffix}"
+        # different name from the old cache made of one list of all job ads
+        self.titleName = f"CondorQCacheIdx_{name_suffix}"
         SpecialFIFOBase.__init__(self)
 
     def lock(self, score=None):
@@ -224,7 +227,7 @@ class CondorQCacheFifo(SpecialFIFOBase, metaclass=SingletonWithID):
 
     def unlock(self, key=None, force=False):
         peeked_tuple = self.peekbyid(id=self.global_lock_id)
-        if peeked_tuple.score is None or peeked_tuple.item is None:
+        if peeked_tuple is None or peeked_tuple.score is None or peeked_tuple.item is None:
             return True
         elif force or self.decode(peeked_tuple.item) == key:
             self.delete([self.global_lock_id])
@@ -232,6 +235,28 @@ class CondorQCacheFifo(SpecialFIFOBase, metaclass=SingletonWithID):
         else:
             return False
 
+    def get_lock_score(self):
+        peeked_tuple = self.peekbyid(id=self.global_lock_id, skip_item=True)
+        if peeked_tuple is None:
+            return None
+        return peeked_tuple.score
+
+    def get_meta(self):
+        peeked_tuple = self.peekbyid(id=self.meta_id)
+        if peeked_tuple is None or peeked_tuple.item is None:
+            return None, None
+        return self.decode(peeked_tuple.item), peeked_tuple.score
+
+    def get_shard(self, shard_index):
+        peeked_tuple = self.peekbyid(id=shard_index + 1)
+        if peeked_tuple is None or peeked_tuple.item is None:
+            return None, None
+        return self.decode(peeked_tuple.item), peeked_tuple.score
+
+    def replace(self, obj_id, item, score):
+        self.delete([obj_id])
+        return self.putbyid(obj_id, item, score)
+
 
 # Condor client
 class CondorClient(object):
@@ -376,7 +401,20 @@ class CondorJobQuery(CondorClient, metaclass=SingletonWithID):
 <classads>
 """
 
-    def __init__(self, cacheEnable=False, cacheRefreshInterval=None, useCondorHistory=True, useCondorHistoryMaxAge=7200, *args, **kwargs):
+    # margin in seconds of EnteredCurrentStatus to pick up job ads changed around the last refresh
+    cacheDeltaMargin = 60
+
+    def __init__(
+        self,
+        cacheEnable=False,
+        cacheRefreshInterval=None,
+        useCondorHistory=True,
+        useCondorHistoryMaxAge=7200,
+        cacheFullSyncInterval=None,
+        cacheShards=64,
+        *args,
+        **kwargs,
+    ):
         self.submissionHost = str(kwargs.get("id"))
         # Make logger
         tmpLog = core_utils.make_logger(
@@ -389,8 +427,13 @@ class CondorJobQuery(CondorClient, metaclass=SingletonWithID):
             # For condor_q cache
             self.cacheEnable = cacheEnable
             if self.cacheEnable:
-                self.cache = ([], 0)
+                # local copy of metadata and shards of the cache
+                self.cache = {"meta": None, "shards": {}}
+                self.cacheLock = threading.Lock()
                 self.cacheRefreshInterval = cacheRefreshInterval
+                # interval to query all job ads instead of ones changed since the last refresh
+                self.cacheFullSyncInterval = cacheFullSyncInterval if cacheFullSyncInterval else cacheRefreshInterval * 10
+                self.cacheShards = cacheShards
             self.useCondorHistory = useCondorHistory
             self.useCondorHistoryMaxAge = useCondorHistoryMaxAge
             tmpLog.debug("Initialize done")
@@ -479,6 +522,112 @@ class CondorJobQuery(CondorClient, metaclass=SingletonWithID):
         # Return
         return job_ads_all_dict
 
+    def _get_shard_index(self, clusterid):
+        """
+        Get index of the cache shard for a ClusterId
+        """
+        return int(clusterid) % self.cacheShards
+
+    def _load_cache_shards(self, cache_fifo, meta, shard_indexes):
+        """
+        Update local copy of shards from cache fifo if outdated. Return False if any shard is unavailable
+        """
+        all_loaded = True
+        for shard_index in shard_indexes:
+            shard_score = meta["shard_scores"].get(shard_index)
+            if shard_score is None:
+                # never written
+                self.cache["shards"][shard_index] = (0, {})
+                continue
+            local_shard = self.cache["shards"].get(shard_index)
+            if local_shard is not None and local_shard[0] >= shard_score:
+                continue
+            shard, score = cache_fifo.get_shard(shard_index)
+            if shard is None or score < shard_score:
+                # being rewritten
+                all_loaded = False
+                continue
+            self.cache["shards"][shard_index] = (score, shard)
+        return all_loaded
+
+    def _refresh_cache(self, cache_fifo, meta, tmpLog, lockInterval=90):
+        """
+        Refresh cache in fifo with lock. Query only job ads changed since the last refresh unless full sync is due
+        Return new metadata, or None if locked by another
+        """
+        # acquire lock with score timestamp
+        score = time.time() - self.cacheRefreshInterval + lockInterval
+        lock_key = cache_fifo.lock(score=score)
+        if lock_key is None:
+            tmpLog.debug("cache fifo locked by other thread. Skipped")
+            return None
+        try:
+            timeNow = time.time()
+            constraint = f'harvesterID =?= "{harvesterID}"'
+            to_full_sync = meta is None or meta.get("n_shards") != self.cacheShards or timeNow > meta["last_full_sync"] + self.cacheFullSyncInterval
+            if not to_full_sync:
+                with self.cacheLock:
+                    if self._load_cache_shards(cache_fifo, meta, range(self.cacheShards)):
+                        # copy shards since other threads may be reading them
+                        shards = {shard_index: dict(self.cache["shards"][shard_index][1]) for shard_index in range(self.cacheShards)}
+                    else:
+                        to_full_sync = True
+            if to_full_sync:
+                tmpLog.debug("got lock, full sync of cache")
+                shards = {shard_index: {} for shard_index in range(self.cacheShards)}
+                dirty_shard_indexes = set(shards)
+                max_entered = 0
+                new_meta = {"n_shards": self.cacheShards, "shard_scores": {}, "last_full_sync": timeNow, "max_entered": 0}
+            else:
+                constraint += f" && EnteredCurrentStatus >= {int(meta['max_entered']) - self.cacheDeltaMargin}"
+                tmpLog.debug(f"got lock, incremental refresh of cache with {constraint}")
+                dirty_shard_indexes = set()
+                max_entered = meta["max_entered"]
+                new_meta = dict(meta)
+                new_meta["shard_scores"] = dict(meta["shard_scores"])
+            # query job ads
+            n_ads = 0
+            for job in self.schedd.query(constraint=constraint, projection=CONDOR_JOB_ADS_LIST):
+                try:
+                    job_ads_dict = dict(job)
+                except Exception as e:
+                    tmpLog.error(f"In updating cache schedd query; got exception {e.__class__.__name__}: {e} ; {repr(job)}")
+                    continue
+                shard_index = self._get_shard_index(job_ads_dict["ClusterId"])
+                shards[shard_index][get_batchid_from_job(job_ads_dict)] = job_ads_dict
+                dirty_shard_indexes.add(shard_index)
+                max_entered = max(max_entered, job_ads_dict.get("EnteredCurrentStatus", 0))
+                n_ads += 1
+            if not to_full_sync:
+                # remove jobs which left the queue, checking only ids
+                batchid_set = set()
+                for job in self.schedd.query(constraint=f'harvesterID =?= "{harvesterID}"', projection=["ClusterId", "ProcId"]):
+                    batchid_set.add(get_batchid_from_job(job))
+                for shard_index, shard in shards.items():
+                    gone_batchid_list = [batchid for batchid in shard if batchid not in batchid_set]
+                    for batchid in gone_batchid_list:
+                        del shard[batchid]
+                    if gone_batchid_list:
+                        dirty_shard_indexes.add(shard_index)
+            new_meta["max_entered"] = max_entered
+            # write shards and then metadata
+            timeNow = time.time()
+            for shard_index in dirty_shard_indexes:
+                cache_fifo.replace(shard_index + 1, shards[shard_index], timeNow)
+                new_meta["shard_scores"][shard_index] = timeNow
+            cache_fifo.replace(cache_fifo.meta_id, new_meta, timeNow)
+            with self.cacheLock:
+                self.cache = {
+                    "meta": new_meta,
+                    "shards": {shard_index: (new_meta["shard_scores"].get(shard_index, 0), shard) for shard_index, shard in shards.items()},
+                }
+            tmpLog.debug(f"updated cache with {n_ads} job ads in {len(dirty_shard_indexes)} shards")
+            return new_meta
+        finally:
+            # release lock
+            if not cache_fifo.unlock(key=lock_key):
+                tmpLog.warning("cannot unlock... Maybe something wrong")
+
     @CondorClient.renew_session_and_retry
     def query_with_python(self, batchIDs_dict=None, allJobs=False, to_update_cache=False):
         # Make logger
@@ -493,67 +642,10 @@ class CondorJobQuery(CondorClient, metaclass=SingletonWithID):
         batchIDs_set = set(batchIDs_dict.keys())
         clusterids_set = set([get_job_id_tuple_from_batchid(batchid)[0] for batchid in batchIDs_dict])
         # query from cache
-
         def cache_query(constraint=None, projection=CONDOR_JOB_ADS_LIST, timeout=60):
-            # query from condor query and update cache to fifo
-            def update_cache(lockInterval=90):
-                tmpLog.debug("update_cache")
-                # acquire lock with score timestamp
-                score = time.time() - self.cacheRefreshInterval + lockInterval
-                lock_key = cache_fifo.lock(score=score)
-                if lock_key is not None:
-                    # acquired lock, update from condor schedd
-                    tmpLog.debug("got lock, updating cache")
-                    jobs_iter_orig = self.schedd.query(constraint=constraint, projection=projection)
-                    jobs_iter = []
-                    for job in jobs_iter_orig:
-                        try:
-                            jobs_iter.append(dict(job))
-                        except Exception as e:
-                            tmpLog.error(f"In updating cache schedd query; got exception {e.__class__.__name__}: {e} ; {repr(job)}")
-                    timeNow = time.time()
-                    cache_fifo.put(jobs_iter, timeNow)
-                    self.cache = (jobs_iter, timeNow)
-                    # release lock
-                    retVal = cache_fifo.unlock(key=lock_key)
-                    if retVal:
-                        tmpLog.debug("done update cache and unlock")
-                    else:
-                        tmpLog.warning("cannot unlock... Maybe something wrong")
-                    return jobs_iter
-                else:
-                    tmpLog.debug("cache fifo locked by other thread. Skipped")
-                    return None
-
-            # remove invalid or outdated caches from fifo
-            def cleanup_cache(timeout=60):
-                tmpLog.debug("cleanup_cache")
-                id_list = list()
-                attempt_timestamp = time.time()
-                n_cleanup = 0
-                while True:
-                    if time.time() > attempt_timestamp + timeout:
-                        tmpLog.debug("time is up when cleanup cache. Skipped")
-                        break
-                    peeked_tuple = cache_fifo.peek(skip_item=True)
-                    if peeked_tuple is None:
-                        tmpLog.debug("empty cache fifo")
-                        break
-                    elif peeked_tuple.score is not None and time.time() <= peeked_tuple.score + self.cacheRefreshInterval:
-                        tmpLog.debug("nothing expired")
-                        break
-                    elif peeked_tuple.id is not None:
-                        retVal = cache_fifo.delete([peeked_tuple.id])
-                        if isinstance(retVal, int):
-                            n_cleanup += retVal
-                    else:
-                        # problematic
-                        tmpLog.warning("got nothing when cleanup cache, maybe problematic. Skipped")
-                        break
-                tmpLog.debug(f"cleaned up {n_cleanup} objects in cache fifo")
-
-            # start
-            jobs_iter = tuple()
+            # only shards of the clusterids are read unless all jobs are required
+            jobs_iter = []
+            to_refresh = to_update_cache
             try:
                 attempt_timestamp = time.time()
                 while True:
@@ -561,65 +653,40 @@ class CondorJobQuery(CondorClient, metaclass=SingletonWithID):
                         # skip cache_query if too long
                         tmpLog.debug(f"cache_query got timeout ({timeout} seconds). Skipped ")
                         break
-                    # get latest cache
-                    peeked_tuple = cache_fifo.peeklast(skip_item=True)
-                    if peeked_tuple is not None and peeked_tuple.score is not None:
-                        # got something
-                        if peeked_tuple.id == cache_fifo.global_lock_id:
-                            if time.time() <= peeked_tuple.score + self.cacheRefreshInterval:
-                                # lock
-                                tmpLog.debug("got fifo locked. Wait and retry...")
-                                time.sleep(random.uniform(1, 5))
-                                continue
-                            else:
-                                # expired lock
-                                tmpLog.debug("got lock expired. Clean up and retry...")
-                                cleanup_cache()
-                                continue
-                        elif not to_update_cache and time.time() <= peeked_tuple.score + self.cacheRefreshInterval:
-                            # got valid cache
-                            _obj, _last_update = self.cache
-                            if _last_update >= peeked_tuple.score:
-                                # valid local cache
-                                tmpLog.debug("valid local cache")
-                                jobs_iter = _obj
-                            else:
-                                # valid fifo cache
-                                tmpLog.debug("update local cache from fifo")
-                                peeked_tuple_with_item = cache_fifo.peeklast()
-                                if (
-                                    peeked_tuple_with_item is not None
-                                    and peeked_tuple.id != cache_fifo.global_lock_id
-                                    and peeked_tuple_with_item.item is not None
-                                ):
-                                    jobs_iter = cache_fifo.decode(peeked_tuple_with_item.item)
-                                    self.cache = (jobs_iter, peeked_tuple_with_item.score)
-                                else:
-                                    tmpLog.debug("peeked invalid cache fifo object. Wait and retry...")
-                                    time.sleep(random.uniform(1, 5))
-                                    continue
+                    meta, meta_score = cache_fifo.get_meta()
+                    if to_refresh or meta is None or meta.get("n_shards") != self.cacheShards or time.time() > meta_score + self.cacheRefreshInterval:
+                        # cache expired, missing, or force to_update_cache
+                        lock_score = cache_fifo.get_lock_score()
+                        if lock_score is not None and time.time() > lock_score + self.cacheRefreshInterval:
+                            tmpLog.debug("got lock expired. Clean up and retry...")
+                            cache_fifo.unlock(force=True)
+                        new_meta = self._refresh_cache(cache_fifo, meta, tmpLog)
+                        if new_meta is None:
+                            tmpLog.debug("got fifo locked. Wait and retry...")
+                            time.sleep(random.uniform(1, 5))
+                            continue
+                        meta = new_meta
+                        to_refresh = False
+                    with self.cacheLock:
+                        if allJobs:
+                            shard_indexes = range(self.cacheShards)
                         else:
-                            # cache expired or force to_update_cache
-                            tmpLog.debug("update cache in fifo")
-                            retVal = update_cache()
-                            if retVal is not None:
-                                jobs_iter = retVal
-                            cleanup_cache()
-                        break
-                    else:
-                        # no cache in fifo, check with size again
-                        if cache_fifo.size() == 0:
-                            if time.time() > attempt_timestamp + random.uniform(10, 30):
-                                # have waited for long enough, update cache
-                                tmpLog.debug("waited enough, update cache in fifo")
-                                retVal = update_cache()
-                                if retVal is not None:
-                                    jobs_iter = retVal
-                                break
-                            else:
-                                # still nothing, wait
-                                time.sleep(2)
-                        continue
+                            shard_indexes = set([self._get_shard_index(clusterid) for clusterid in clusterids_set])
+                        if not self._load_cache_shards(cache_fifo, meta, shard_indexes):
+                            tmpLog.debug("peeked invalid cache fifo object. Wait and retry...")
+                            time.sleep(random.uniform(1, 5))
+                            continue
+                        shards = self.cache["shards"]
+                        if allJobs:
+                            for shard_index in shard_indexes:
+                                jobs_iter.extend(shards[shard_index][1].values())
+                        else:
+                            for batchid in batchIDs_set:
+                                job_ads_dict = shards[self._get_shard_index(get_job_id_tuple_from_batchid(batchid)[0])][1].get(batchid)
+                                if job_ads_dict is not None:
+                                    jobs_iter.append(job_ads_dict)
+                    tmpLog.debug(f"got {len(jobs_iter)} job ads from cache in {len(shard_indexes)} shards")
+                    break
             except Exception as _e:
                 tb_str = traceback.format_exc()
                 tmpLog.error(f"Error querying from cache fifo; {_e} ; {tb_str}")
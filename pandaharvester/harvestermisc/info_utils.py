@@ -1,4 +1,3 @@
-import re
 import threading
 import time
 
@@ -11,6 +10,74 @@ harvesterID = harvester_config.master.harvester_id
 resolver_config = getattr(harvester_config.qconf, "resolverConfig", {})
 
 
+class PandaQueuesSnapshot(object):
+    """
+    Immutable snapshot of PanDA queue info with precomputed indexes
+    Built at each refresh and swapped in at once, so that readers need no lock
+    """
+
+    def __init__(self, panda_queues_dict=None, per_core_attrs=(), content_hash=None):
+        # PanDA Resource name : queue info with per-core attributes scaled
+        queue_dict = dict()
+        # PanDA Resource name <-> PanDA Queue name
+        resource_to_queue = dict()
+        queue_to_resource = dict()
+        # PanDA Resource names of queues of this harvester instance, UPS queues, and queues with some catchall values
+        my_queue_names = set()
+        ups_queue_names = set()
+        per_core_attr_queue_names = set()
+        grandly_unified_queue_names = set()
+        for k, v in (panda_queues_dict or dict()).items():
+            try:
+                panda_resource = v["panda_resource"]
+                assert k == v["nickname"]
+            except Exception:
+                continue
+            # copy not to modify the cached data
+            v = dict(v)
+            # handle per-core attributes: scale with corecount if per-core
+            if PandaQueuesDict.has_value_in_catchall(v, "per_core_attr"):
+                per_core_attr_queue_names.add(panda_resource)
+                core_count = v.get("corecount", 1)
+                for attr in per_core_attrs:
+                    if attr in v and core_count > 0:
+                        v[attr] = v[attr] * core_count
+            queue_dict[panda_resource] = v
+            resource_to_queue[panda_resource] = k
+            queue_to_resource[k] = panda_resource
+            if v.get("pilot_manager") in ["Harvester"] and v.get("harvester") == harvesterID:
+                my_queue_names.add(panda_resource)
+            if v.get("capability") == "ucore" and v.get("workflow") == "pull_ups":
+                ups_queue_names.add(panda_resource)
+            if "grandly_unified" in (v.get("catchall") or "") or v.get("type") == "unified":
+                grandly_unified_queue_names.add(panda_resource)
+        self.queue_dict = queue_dict
+        self.resource_to_queue = resource_to_queue
+        self.queue_to_resource = queue_to_resource
+        self.my_queue_names = frozenset(my_queue_names)
+        self.ups_queue_names = frozenset(ups_queue_names)
+        self.per_core_attr_queue_names = frozenset(per_core_attr_queue_names)
+        self.grandly_unified_queue_names = frozenset(grandly_unified_queue_names)
+        self.content_hash = content_hash
+
+    def resolve(self, name):
+        """
+        Return PanDA Resource name with either PanDA Queue name or PanDA Resource name, or None if not found
+        """
+        if name in self.queue_dict:
+            return name
+        return self.queue_to_resource.get(name)
+
+    def get(self, name, default=None):
+        """
+        Return queue info with either PanDA Queue name or PanDA Resource name
+        """
+        panda_resource = self.resolve(name)
+        if panda_resource is None:
+            return default
+        return self.queue_dict[panda_resource]
+
+
 class PandaQueuesDict(dict, PluginBase, metaclass=SingletonWithID):
     """
     Dictionary of PanDA queue info from DB by cacher
@@ -32,6 +99,7 @@ class PandaQueuesDict(dict, PluginBase, metaclass=SingletonWithID):
         self.cacher_key = kwargs.get("cacher_key", "panda_queues.json")
         self.refresh_period = resolver_config.get("refreshPeriod", 300)
         self.last_refresh_ts = 0
+        self.snapshot = PandaQueuesSnapshot()
         self._refresh()
 
     def _is_fresh(self):
@@ -49,39 +117,26 @@ class PandaQueuesDict(dict, PluginBase, metaclass=SingletonWithID):
         if catchall_str is None:
             return False
         for tmp_key in catchall_str.split(","):
-            tmp_match = re.search(f"^{key}(=|)*", tmp_key)
-            if tmp_match is not None:
+            if tmp_key.startswith(key):
                 return True
         return False
 
-    @staticmethod
-    def use_per_core_attr(panda_queues_dict):
-        """
-        Check if treating all attributes as per-core
-        """
-        return PandaQueuesDict.has_value_in_catchall(panda_queues_dict, "per_core_attr")
-
     def _refresh(self):
+        # readers skip the lock while fresh
+        if self._is_fresh():
+            return
         with self.lock:
             if self._is_fresh():
                 return
             panda_queues_cache = self.dbInterface.get_cache(self.cacher_key)
             if panda_queues_cache and isinstance(panda_queues_cache.data, dict):
-                panda_queues_dict = panda_queues_cache.data
-                for k, v in panda_queues_dict.items():
-                    try:
-                        panda_resource = v["panda_resource"]
-                        assert k == v["nickname"]
-                    except Exception:
-                        pass
-                    else:
-                        self[panda_resource] = v
-                    # handle per-core attributes: scale with corecount if per-core
-                    if PandaQueuesDict.use_per_core_attr(v):
-                        core_count = v.get("corecount", 1)
-                        for attr in self.candidate_per_core_attrs:
-                            if attr in v and core_count > 0:
-                                v[attr] = v[attr] * core_count
+                content_hash = panda_queues_cache.contentHash
+                if content_hash is None or content_hash != self.snapshot.content_hash:
+                    snapshot = PandaQueuesSnapshot(panda_queues_cache.data, self.candidate_per_core_attrs, content_hash)
+                    # swap in the new snapshot, and keep dict items for those using them directly
+                    self.snapshot = snapshot
+                    dict.clear(self)
+                    dict.update(self, snapshot.queue_dict)
                 # successfully refreshed from cache
                 self.last_refresh_ts = time.time()
             else:
@@ -101,67 +156,86 @@ class PandaQueuesDict(dict, PluginBase, metaclass=SingletonWithID):
 
     @to_refresh
     def __getitem__(self, panda_resource):
-        if panda_resource in self:
-            return dict.__getitem__(self, panda_resource)
-        else:
-            panda_queue = self.get_panda_queue_name(panda_resource)
-            return dict.__getitem__(self, panda_queue)
+        panda_queue_dict = self.snapshot.get(panda_resource)
+        if panda_queue_dict is None:
+            raise KeyError(panda_resource)
+        return panda_queue_dict
 
     @to_refresh
     def get(self, panda_resource, default=None):
-        if panda_resource in self:
-            return dict.get(self, panda_resource, default)
-        else:
-            panda_queue = self.get_panda_queue_name(panda_resource)
-            return dict.get(self, panda_queue, default)
+        return self.snapshot.get(panda_resource, default)
 
+    @to_refresh
+    def __contains__(self, panda_resource):
+        return panda_resource in self.snapshot.queue_dict
+
+    @to_refresh
+    def __iter__(self):
+        return iter(self.snapshot.queue_dict)
+
+    @to_refresh
+    def __len__(self):
+        return len(self.snapshot.queue_dict)
+
+    @to_refresh
+    def keys(self):
+        return self.snapshot.queue_dict.keys()
+
+    @to_refresh
+    def values(self):
+        return self.snapshot.queue_dict.values()
+
+    @to_refresh
+    def items(self):
+        return self.snapshot.queue_dict.items()
+
+    @to_refresh
     def get_panda_queue_name(self, panda_resource):
         """
         Return PanDA Queue name with specified PanDA Resource name
         """
-        try:
-            panda_queue = self.get(panda_resource).get("nickname")
-            return panda_queue
-        except Exception:
-            return None
+        snapshot = self.snapshot
+        return snapshot.resource_to_queue.get(snapshot.resolve(panda_resource))
+
+    @to_refresh
+    def use_per_core_attr(self, panda_resource):
+        """
+        Check if treating all attributes as per-core, with either queue name or queue info
+        """
+        if isinstance(panda_resource, dict):
+            return PandaQueuesDict.has_value_in_catchall(panda_resource, "per_core_attr")
+        snapshot = self.snapshot
+        return snapshot.resolve(panda_resource) in snapshot.per_core_attr_queue_names
 
     # get queue status for auto blacklisting
+    @to_refresh
     def get_queue_status(self, panda_resource):
-        panda_queue_dict = self.get(panda_resource)
-        if panda_queue_dict is None:
+        snapshot = self.snapshot
+        panda_resource = snapshot.resolve(panda_resource)
+        if panda_resource is None:
             return None
         # offline if not with harvester or not of this harvester instance
-        if panda_queue_dict.get("pilot_manager") not in ["Harvester"] or panda_queue_dict.get("harvester") != harvesterID:
+        if panda_resource not in snapshot.my_queue_names:
             return "offline"
-        return panda_queue_dict["status"]
+        return snapshot.queue_dict[panda_resource]["status"]
 
     # get all queue names of this harvester instance
     @to_refresh
     def get_all_queue_names(self):
-        names = set()
-        for queue_name, queue_dict in self.items():
-            if queue_dict.get("pilot_manager") in ["Harvester"] and queue_dict.get("harvester") == harvesterID:
-                names.add(queue_name)
-        return names
+        return set(self.snapshot.my_queue_names)
 
     # is UPS queue
+    @to_refresh
     def is_ups_queue(self, panda_resource):
-        panda_queue_dict = self.get(panda_resource)
-        if panda_queue_dict is None:
-            return False
-        if panda_queue_dict.get("capability") == "ucore" and panda_queue_dict.get("workflow") == "pull_ups":
-            return True
-        return False
+        snapshot = self.snapshot
+        return snapshot.resolve(panda_resource) in snapshot.ups_queue_names
 
     # is grandly unified queue, i.e. runs analysis and production
+    @to_refresh
     def is_grandly_unified_queue(self, panda_resource):
-        panda_queue_dict = self.get(panda_resource)
-        if panda_queue_dict is None:
-            return False
+        snapshot = self.snapshot
         # initial, temporary nomenclature
-        if "grandly_unified" in panda_queue_dict.get("catchall") or panda_queue_dict.get("type") == "unified":
-            return True
-        return False
+        return snapshot.resolve(panda_resource) in snapshot.grandly_unified_queue_names
 
     # get harvester params
     def get_harvester_params(self, panda_resource):
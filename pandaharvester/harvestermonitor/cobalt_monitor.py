@@ -7,6 +7,7 @@ from pprint import pprint
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
 from pandaharvester.harvestercore.work_spec import WorkSpec
+from pandaharvester.harvestermisc.batch_status_utils import get_batch_status_snapshot
 
 # logger
 baseLogger = core_utils.setup_logger("cobalt_monitor")
@@ -23,121 +24,147 @@ class CobaltMonitor(PluginBase):
     # constructor
     def __init__(self, **kwarg):
         PluginBase.__init__(self, **kwarg)
+        # look up workers in a snapshot of all jobs made by one qstat per refresh interval, instead of one qstat per worker
+        self.useStatusSnapshot = bool(getattr(self, "useStatusSnapshot", True))
+        self.statusSnapshotRefreshInterval = getattr(self, "statusSnapshotRefreshInterval", 60)
+
+    # convert job state to worker status
+    def get_worker_status(self, state, stdOut="", stdErr=""):
+        if "running" in state:
+            return WorkSpec.ST_running
+        elif "queued" in state:
+            return WorkSpec.ST_submitted
+        elif "user_hold" in state:
+            return WorkSpec.ST_submitted
+        elif "starting" in state:
+            return WorkSpec.ST_running
+        elif "killing" in state:
+            return WorkSpec.ST_failed
+        elif "exiting" in state:
+            return WorkSpec.ST_running
+        elif "maxrun_hold" in state:
+            return WorkSpec.ST_submitted
+        else:
+            raise Exception(f'failed to parse job state "{state}" qstat stdout: {stdOut}\n stderr: {stdErr}')
 
     # check workers
     def check_workers(self, workspec_list):
         retList = []
+        statusMap = None
+        if self.useStatusSnapshot:
+            try:
+                statusMap = get_batch_status_snapshot("cobalt", refresh_interval=self.statusSnapshotRefreshInterval).get_status_map()
+            except Exception:
+                # fall back to check workers one by one
+                tmpLog = self.make_logger(baseLogger, method_name="check_workers")
+                tmpLog.error("failed to get status snapshot; checking workers one by one")
+                core_utils.dump_error_message(tmpLog)
         for workSpec in workspec_list:
-            # print "pprint(dir(workSpec))"
-            # pprint(dir(workSpec))
-            # print "pprint(vars(workSpec))"
-            # pprint(vars(workSpec))
             # make logger
             tmpLog = self.make_logger(baseLogger, f"workerID={workSpec.workerID}", method_name="check_workers")
-            # first command
-            comStr = f"qstat {workSpec.batchID}"
-            # first check
-            tmpLog.debug(f"check with {comStr}")
-            p = subprocess.Popen(comStr.split(), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            oldStatus = workSpec.status
-            newStatus = None
-            # first check return code
-            stdOut, stdErr = p.communicate()
-            retCode = p.returncode
-            tmpLog.debug(f"retCode= {retCode}")
-            tmpLog.debug(f"stdOut = {stdOut}")
-            tmpLog.debug(f"stdErr = {stdErr}")
-            errStr = ""
-            if retCode == 0:
-                # batch job is still running and has a state, output looks like this:
-                # JobID   User    WallTime  Nodes  State   Location
-                # ===================================================
-                # 124559  hdshin  06:00:00  64     queued  None
+            # look up snapshot. Jobs not in the snapshot, e.g. already exited, are checked individually
+            if statusMap is not None and str(workSpec.batchID) in statusMap:
+                state, tmpLine = statusMap[str(workSpec.batchID)]
+                newStatus = self.get_worker_status(state, tmpLine)
+                tmpLog.debug(f"batchStatus {workSpec.status} -> workerStatus {newStatus} in snapshot")
+                retList.append((newStatus, ""))
+                continue
+            retVal = self.check_worker(workSpec, tmpLog)
+            if retVal is not None:
+                retList.append(retVal)
+        return True, retList
 
-                lines = stdOut.split("\n")
-                parts = lines[2].split()
-                batchid = parts[0]
-                user = parts[1]
-                walltime = parts[2]
-                nodes = parts[3]
-                state = parts[4]
+    # check a worker with qstat and cobalt log
+    def check_worker(self, workSpec, tmpLog):
+        retVal = None
+        # first command
+        comStr = f"qstat {workSpec.batchID}"
+        # first check
+        tmpLog.debug(f"check with {comStr}")
+        p = subprocess.Popen(comStr.split(), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        oldStatus = workSpec.status
+        newStatus = None
+        # first check return code
+        stdOut, stdErr = p.communicate()
+        retCode = p.returncode
+        tmpLog.debug(f"retCode= {retCode}")
+        tmpLog.debug(f"stdOut = {stdOut}")
+        tmpLog.debug(f"stdErr = {stdErr}")
+        errStr = ""
+        if retCode == 0:
+            # batch job is still running and has a state, output looks like this:
+            # JobID   User    WallTime  Nodes  State   Location
+            # ===================================================
+            # 124559  hdshin  06:00:00  64     queued  None
 
-                if int(batchid) != int(workSpec.batchID):
-                    errStr += f"qstat returned status for wrong batch id {batchid} != {workSpec.batchID}"
-                    newStatus = WorkSpec.ST_failed
-                else:
-                    if "running" in state:
-                        newStatus = WorkSpec.ST_running
-                    elif "queued" in state:
-                        newStatus = WorkSpec.ST_submitted
-                    elif "user_hold" in state:
-                        newStatus = WorkSpec.ST_submitted
-                    elif "starting" in state:
-                        newStatus = WorkSpec.ST_running
-                    elif "killing" in state:
-                        newStatus = WorkSpec.ST_failed
-                    elif "exiting" in state:
-                        newStatus = WorkSpec.ST_running
-                    elif "maxrun_hold" in state:
-                        newStatus = WorkSpec.ST_submitted
-                    else:
-                        raise Exception(f'failed to parse job state "{state}" qstat stdout: {stdOut}\n stderr: {stdErr}')
+            lines = stdOut.split("\n")
+            parts = lines[2].split()
+            batchid = parts[0]
+            user = parts[1]
+            walltime = parts[2]
+            nodes = parts[3]
+            state = parts[4]
 
-                retList.append((newStatus, errStr))
-            elif retCode == 1 and len(stdOut.strip()) == 0 and len(stdErr.strip()) == 0:
-                tmpLog.debug("job has already exited, checking cobalt log for exit status")
-                # exit code 1 and stdOut/stdErr has no content means job exited
-                # need to look at cobalt log to determine exit status
+            if int(batchid) != int(workSpec.batchID):
+                errStr += f"qstat returned status for wrong batch id {batchid} != {workSpec.batchID}"
+                newStatus = WorkSpec.ST_failed
+            else:
+                newStatus = self.get_worker_status(state, stdOut, stdErr)
 
-                cobalt_logfile = os.path.join(workSpec.get_access_point(), "cobalt.log")
-                if os.path.exists(cobalt_logfile):
-                    return_code = None
-                    job_cancelled = False
-                    for line in open(cobalt_logfile):
-                        # looking for line like this:
-                        # Thu Aug 24 19:01:20 2017 +0000 (UTC) Info: task completed normally with an exit code of 0; initiating job cleanup and removal
-                        if "task completed normally" in line:
-                            start_index = line.find("exit code of ") + len("exit code of ")
-                            end_index = line.find(";", start_index)
-                            str_return_code = line[start_index:end_index]
-                            if "None" in str_return_code:
-                                return_code = -1
-                            else:
-                                return_code = int(str_return_code)
-                            break
-                        elif "maximum execution time exceeded" in line:
-                            errStr += " batch job exceeded wall clock time "
-                        elif "user delete requested" in line:
-                            errStr += " job was cancelled "
-                            job_cancelled = True
+            retVal = (newStatus, errStr)
+        elif retCode == 1 and len(stdOut.strip()) == 0 and len(stdErr.strip()) == 0:
+            tmpLog.debug("job has already exited, checking cobalt log for exit status")
+            # exit code 1 and stdOut/stdErr has no content means job exited
+            # need to look at cobalt log to determine exit status
 
-                    if return_code == 0:
-                        tmpLog.debug("job finished normally")
-                        newStatus = WorkSpec.ST_finished
-                        retList.append((newStatus, errStr))
-                    elif return_code is None:
-                        if job_cancelled:
-                            tmpLog.debug("job was cancelled")
-                            errStr += " job cancelled "
-                            newStatus = WorkSpec.ST_cancelled
-                            retList.append((newStatus, errStr))
+            cobalt_logfile = os.path.join(workSpec.get_access_point(), "cobalt.log")
+            if os.path.exists(cobalt_logfile):
+                return_code = None
+                job_cancelled = False
+                for line in open(cobalt_logfile):
+                    # looking for line like this:
+                    # Thu Aug 24 19:01:20 2017 +0000 (UTC) Info: task completed normally with an exit code of 0; initiating job cleanup and removal
+                    if "task completed normally" in line:
+                        start_index = line.find("exit code of ") + len("exit code of ")
+                        end_index = line.find(";", start_index)
+                        str_return_code = line[start_index:end_index]
+                        if "None" in str_return_code:
+                            return_code = -1
                         else:
-                            tmpLog.debug("job has no exit code, failing job")
-                            errStr += f" exit code not found in cobalt log file {cobalt_logfile} "
-                            newStatus = WorkSpec.ST_failed
-                            retList.append((newStatus, errStr))
+                            return_code = int(str_return_code)
+                        break
+                    elif "maximum execution time exceeded" in line:
+                        errStr += " batch job exceeded wall clock time "
+                    elif "user delete requested" in line:
+                        errStr += " job was cancelled "
+                        job_cancelled = True
+
+                if return_code == 0:
+                    tmpLog.debug("job finished normally")
+                    newStatus = WorkSpec.ST_finished
+                    retVal = (newStatus, errStr)
+                elif return_code is None:
+                    if job_cancelled:
+                        tmpLog.debug("job was cancelled")
+                        errStr += " job cancelled "
+                        newStatus = WorkSpec.ST_cancelled
+                        retVal = (newStatus, errStr)
                     else:
-                        tmpLog.debug(f" non zero exit code {return_code} from batch job id {workSpec.batchID}")
-                        errStr += f" non-zero exit code {return_code} from batch job id {workSpec.batchID} "
+                        tmpLog.debug("job has no exit code, failing job")
+                        errStr += f" exit code not found in cobalt log file {cobalt_logfile} "
                         newStatus = WorkSpec.ST_failed
-                        retList.append((newStatus, errStr))
+                        retVal = (newStatus, errStr)
                 else:
-                    tmpLog.debug(" cobalt log file does not exist")
-                    errStr += f" cobalt log file {cobalt_logfile} does not exist "
+                    tmpLog.debug(f" non zero exit code {return_code} from batch job id {workSpec.batchID}")
+                    errStr += f" non-zero exit code {return_code} from batch job id {workSpec.batchID} "
                     newStatus = WorkSpec.ST_failed
-                    retList.append((newStatus, errStr))
+                    retVal = (newStatus, errStr)
+            else:
+                tmpLog.debug(" cobalt log file does not exist")
+                errStr += f" cobalt log file {cobalt_logfile} does not exist "
+                newStatus = WorkSpec.ST_failed
+                retVal = (newStatus, errStr)
 
-            tmpLog.debug(f"batchStatus {oldStatus} -> workerStatus {newStatus}")
-            tmpLog.debug(f"errStr: {errStr}")
-
-        return True, retList
+        tmpLog.debug(f"batchStatus {oldStatus} -> workerStatus {newStatus}")
+        tmpLog.debug(f"errStr: {errStr}")
+        return retVal
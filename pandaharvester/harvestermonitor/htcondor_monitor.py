@@ -240,6 +240,8 @@ class HTCondorMonitor(PluginBase):
             self.cacheRefreshInterval = harvester_config.monitor.pluginCacheRefreshInterval
         except AttributeError:
             self.cacheRefreshInterval = harvester_config.monitor.checkInterval
+        # interval in seconds to query all jobs for the cache instead of jobs changed since the last refresh
+        self.cacheFullSyncInterval = getattr(harvester_config.monitor, "pluginCacheFullSyncInterval", None)
         # whether to use condor history
         self.useCondorHistory = getattr(self, "useCondorHistory", True)
         if extra_plugin_configs.get("use_condor_history") is False:
@@ -266,6 +268,7 @@ class HTCondorMonitor(PluginBase):
                 job_query = CondorJobQuery(
                     cacheEnable=self.cacheEnable,
                     cacheRefreshInterval=self.cacheRefreshInterval,
+                    cacheFullSyncInterval=self.cacheFullSyncInterval,
                     useCondorHistory=self.useCondorHistory,
                     id=submissionHost,
                     useCondorHistoryMaxAge=self.useCondorHistoryMaxAge,
@@ -316,7 +319,11 @@ class HTCondorMonitor(PluginBase):
         for submissionHost in submission_host_set:
             try:
                 job_query = CondorJobQuery(
-                    cacheEnable=self.cacheEnable, cacheRefreshInterval=self.cacheRefreshInterval, useCondorHistory=self.useCondorHistory, id=submissionHost
+                    cacheEnable=self.cacheEnable,
+                    cacheRefreshInterval=self.cacheRefreshInterval,
+                    cacheFullSyncInterval=self.cacheFullSyncInterval,
+                    useCondorHistory=self.useCondorHistory,
+                    id=submissionHost,
                 )
                 job_ads_all_dict.update(job_query.get_all(batchIDs_dict=None, allJobs=True, to_update_cache=True))
                 tmpLog.debug(f"got information of condor jobs on {submissionHost}")
@@ -5,6 +5,7 @@ from shlex import quote, split
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
 from pandaharvester.harvestercore.work_spec import WorkSpec
+from pandaharvester.harvestermisc.batch_status_utils import get_batch_status_snapshot
 
 # logger
 baseLogger = core_utils.setup_logger("lsf_monitor")
@@ -15,65 +16,93 @@ class LSFMonitor(PluginBase):
     # constructor
     def __init__(self, **kwarg):
         PluginBase.__init__(self, **kwarg)
+        # look up workers in a snapshot of all jobs made by one bjobs per refresh interval, instead of one bjobs per worker
+        self.useStatusSnapshot = bool(getattr(self, "useStatusSnapshot", True))
+        self.statusSnapshotRefreshInterval = getattr(self, "statusSnapshotRefreshInterval", 60)
+        # cluster name for bjobs -m
+        self.batchCluster = getattr(self, "batchCluster", None)
+
+    # convert batch status to worker status
+    def get_worker_status(self, batch_status):
+        if batch_status in ["RUN"]:
+            return WorkSpec.ST_running
+        elif batch_status in ["DONE"]:
+            return WorkSpec.ST_finished
+        elif batch_status in ["PEND", "PROV", "WAIT"]:
+            return WorkSpec.ST_submitted
+        else:
+            return WorkSpec.ST_failed
 
     # check workers
     def check_workers(self, workspec_list):
         retList = []
+        statusMap = None
+        if self.useStatusSnapshot:
+            try:
+                statusMap = get_batch_status_snapshot("lsf", self.batchCluster, self.statusSnapshotRefreshInterval).get_status_map()
+            except Exception:
+                # fall back to check workers one by one
+                tmpLog = self.make_logger(baseLogger, method_name="check_workers")
+                tmpLog.error("failed to get status snapshot; checking workers one by one")
+                core_utils.dump_error_message(tmpLog)
         for workSpec in workspec_list:
             # make logger
             tmpLog = self.make_logger(baseLogger, f"workerID={workSpec.workerID}", method_name="check_workers")
-            # command
-            comStr = f"bjobs -a -noheader -o {quote('jobid:10 stat:10')} {workSpec.batchID} "
-            comStr_split = split(comStr)
-            # check
-            p = subprocess.Popen(comStr_split, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            newStatus = workSpec.status
-            # check return code
-            stdOut, stdErr = p.communicate()
-            retCode = p.returncode
-            tmpLog.debug(f"len(stdOut) = {len(str(stdOut))} stdOut={stdOut}")
-            tmpLog.debug(f"len(stdErr) = {len(str(stdErr))}  stdErr={stdErr}")
-            tmpLog.debug(f"retCode={retCode}")
-            errStr = ""
-            if retCode == 0:
-                # check if any came back on stdOut otherwise check stdErr
-                tempresponse = ""
-                if len(str(stdOut)) >= len(str(stdErr)):
-                    tempresponse = str(stdOut)
-                else:
-                    tempresponse = str(stdErr)
-                # tmpLog.debug('tempresponse = {0}'.format(tempresponse))
-                # parse
-                for tmpLine in tempresponse.split("\n"):
-                    tmpMatch = re.search(f"{workSpec.batchID}", tmpLine)
-                    tmpLog.debug(f"tmpLine = {tmpLine} tmpMatch = {tmpMatch}")
-                    if tmpMatch is not None:
-                        errStr = tmpLine
-                        # search for phrase  is not found
-                        tmpMatch = re.search("is not found", tmpLine)
-                        if tmpMatch is not None:
-                            batchStatus = f"Job {workSpec.batchID} is not found"
-                            newStatus = WorkSpec.ST_failed
-                            tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {retCode}")
-                        else:
-                            batchStatus = tmpLine.split()[-2]
-                            if batchStatus in ["RUN"]:
-                                newStatus = WorkSpec.ST_running
-                            elif batchStatus in ["DONE"]:
-                                newStatus = WorkSpec.ST_finished
-                            elif batchStatus in ["PEND", "PROV", "WAIT"]:
-                                newStatus = WorkSpec.ST_submitted
-                            else:
-                                newStatus = WorkSpec.ST_failed
-                            tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus}")
-                        break
-                retList.append((newStatus, errStr))
-            else:
-                # failed
-                errStr = stdOut + " " + stdErr
-                tmpLog.error(errStr)
-                if "Unknown Job Id Error" in errStr:
-                    tmpLog.info("Mark job as finished.")
-                    newStatus = WorkSpec.ST_finished
+            # look up snapshot. Jobs not in the snapshot are checked individually
+            if statusMap is not None and str(workSpec.batchID) in statusMap:
+                batchStatus, errStr = statusMap[str(workSpec.batchID)]
+                newStatus = self.get_worker_status(batchStatus)
+                tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus} in snapshot")
                 retList.append((newStatus, errStr))
+                continue
+            retList.append(self.check_worker(workSpec, tmpLog))
         return True, retList
+
+    # check a worker with bjobs
+    def check_worker(self, workSpec, tmpLog):
+        # command
+        comStr = f"bjobs -a -noheader -o {quote('jobid:10 stat:10')} {workSpec.batchID} "
+        comStr_split = split(comStr)
+        # check
+        p = subprocess.Popen(comStr_split, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        newStatus = workSpec.status
+        # check return code
+        stdOut, stdErr = p.communicate()
+        retCode = p.returncode
+        tmpLog.debug(f"len(stdOut) = {len(str(stdOut))} stdOut={stdOut}")
+        tmpLog.debug(f"len(stdErr) = {len(str(stdErr))}  stdErr={stdErr}")
+        tmpLog.debug(f"retCode={retCode}")
+        errStr = ""
+        if retCode == 0:
+            # check if any came back on stdOut otherwise check stdErr
+            tempresponse = ""
+            if len(str(stdOut)) >= len(str(stdErr)):
+                tempresponse = str(stdOut)
+            else:
+                tempresponse = str(stdErr)
+            # tmpLog.debug('tempresponse = {0}'.format(tempresponse))
+            # parse
+            for tmpLine in tempresponse.split("\n"):
+                tmpMatch = re.search(f"{workSpec.batchID}", tmpLine)
+                tmpLog.debug(f"tmpLine = {tmpLine} tmpMatch = {tmpMatch}")
+                if tmpMatch is not None:
+                    errStr = tmpLine
+                    # search for phrase  is not found
+                    tmpMatch = re.search("is not found", tmpLine)
+                    if tmpMatch is not None:
+                        batchStatus = f"Job {workSpec.batchID} is not found"
+                        newStatus = WorkSpec.ST_failed
+                        tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {retCode}")
+                    else:
+                        batchStatus = tmpLine.split()[-2]
+                        newStatus = self.get_worker_status(batchStatus)
+                        tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus}")
+                    break
+        else:
+            # failed
+            errStr = stdOut + " " + stdErr
+            tmpLog.error(errStr)
+            if "Unknown Job Id Error" in errStr:
+                tmpLog.info("Mark job as finished.")
+                newStatus = WorkSpec.ST_finished
+        return newStatus, errStr
@@ -4,6 +4,7 @@ import subprocess
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
 from pandaharvester.harvestercore.work_spec import WorkSpec
+from pandaharvester.harvestermisc.batch_status_utils import get_batch_status_snapshot
 
 # logger
 baseLogger = core_utils.setup_logger("pbs_monitor")
@@ -14,50 +15,78 @@ class PBSMonitor(PluginBase):
     # constructor
     def __init__(self, **kwarg):
         PluginBase.__init__(self, **kwarg)
+        # look up workers in a snapshot of all jobs made by one qstat per refresh interval, instead of one qstat per worker
+        self.useStatusSnapshot = bool(getattr(self, "useStatusSnapshot", True))
+        self.statusSnapshotRefreshInterval = getattr(self, "statusSnapshotRefreshInterval", 60)
+        # server name for qstat @server
+        self.batchCluster = getattr(self, "batchCluster", None)
+
+    # convert batch status to worker status
+    def get_worker_status(self, batch_status):
+        if batch_status in ["R", "E"]:
+            return WorkSpec.ST_running
+        elif batch_status in ["C", "H"]:
+            return WorkSpec.ST_finished
+        elif batch_status in ["CANCELLED"]:
+            return WorkSpec.ST_cancelled
+        elif batch_status in ["Q", "W", "S"]:
+            return WorkSpec.ST_submitted
+        else:
+            return WorkSpec.ST_failed
 
     # check workers
     def check_workers(self, workspec_list):
         retList = []
+        statusMap = None
+        if self.useStatusSnapshot:
+            try:
+                statusMap = get_batch_status_snapshot("pbs", self.batchCluster, self.statusSnapshotRefreshInterval).get_status_map()
+            except Exception:
+                # fall back to check workers one by one
+                tmpLog = self.make_logger(baseLogger, method_name="check_workers")
+                tmpLog.error("failed to get status snapshot; checking workers one by one")
+                core_utils.dump_error_message(tmpLog)
         for workSpec in workspec_list:
             # make logger
             tmpLog = self.make_logger(baseLogger, f"workerID={workSpec.workerID}", method_name="check_workers")
-            # command
-            comStr = f"qstat {workSpec.batchID}"
-            # check
-            tmpLog.debug(f"check with {comStr}")
-            p = subprocess.Popen(comStr.split(), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            newStatus = workSpec.status
-            # check return code
-            stdOut, stdErr = p.communicate()
-            retCode = p.returncode
-            tmpLog.debug(f"retCode={retCode}")
-            errStr = ""
-            if retCode == 0:
-                # parse
-                for tmpLine in stdOut.split("\n"):
-                    tmpMatch = re.search(f"{workSpec.batchID} ", tmpLine)
-                    if tmpMatch is not None:
-                        errStr = tmpLine
-                        batchStatus = tmpLine.split()[-2]
-                        if batchStatus in ["R", "E"]:
-                            newStatus = WorkSpec.ST_running
-                        elif batchStatus in ["C", "H"]:
-                            newStatus = WorkSpec.ST_finished
-                        elif batchStatus in ["CANCELLED"]:
-                            newStatus = WorkSpec.ST_cancelled
-                        elif batchStatus in ["Q", "W", "S"]:
-                            newStatus = WorkSpec.ST_submitted
-                        else:
-                            newStatus = WorkSpec.ST_failed
-                        tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus}")
-                        break
-                retList.append((newStatus, errStr))
-            else:
-                # failed
-                errStr = stdOut + " " + stdErr
-                tmpLog.error(errStr)
-                if "Unknown Job Id Error" in errStr:
-                    tmpLog.info("Mark job as finished.")
-                    newStatus = WorkSpec.ST_finished
+            # look up snapshot. Jobs not in the snapshot, e.g. completed or submitted after the snapshot, are checked individually
+            if statusMap is not None and str(workSpec.batchID) in statusMap:
+                batchStatus, errStr = statusMap[str(workSpec.batchID)]
+                newStatus = self.get_worker_status(batchStatus)
+                tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus} in snapshot")
                 retList.append((newStatus, errStr))
+                continue
+            retList.append(self.check_worker(workSpec, tmpLog))
         return True, retList
+
+    # check a worker with qstat
+    def check_worker(self, workSpec, tmpLog):
+        # command
+        comStr = f"qstat {workSpec.batchID}"
+        # check
+        tmpLog.debug(f"check with {comStr}")
+        p = subprocess.Popen(comStr.split(), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        newStatus = workSpec.status
+        # check return code
+        stdOut, stdErr = p.communicate()
+        retCode = p.returncode
+        tmpLog.debug(f"retCode={retCode}")
+        errStr = ""
+        if retCode == 0:
+            # parse
+            for tmpLine in stdOut.split("\n"):
+                tmpMatch = re.search(f"{workSpec.batchID} ", tmpLine)
+                if tmpMatch is not None:
+                    errStr = tmpLine
+                    batchStatus = tmpLine.split()[-2]
+                    newStatus = self.get_worker_status(batchStatus)
+                    tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus}")
+                    break
+        else:
+            # failed
+            errStr = stdOut + " " + stdErr
+            tmpLog.error(errStr)
+            if "Unknown Job Id Error" in errStr:
+                tmpLog.info("Mark job as finished.")
+                newStatus = WorkSpec.ST_finished
+        return newStatus, errStr
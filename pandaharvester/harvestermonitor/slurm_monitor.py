@@ -4,6 +4,7 @@ import subprocess
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
 from pandaharvester.harvestercore.work_spec import WorkSpec
+from pandaharvester.harvestermisc.batch_status_utils import get_batch_status_snapshot
 
 # logger
 baseLogger = core_utils.setup_logger("slurm_monitor")
@@ -14,50 +15,82 @@ class SlurmMonitor(PluginBase):
     # constructor
     def __init__(self, **kwarg):
         PluginBase.__init__(self, **kwarg)
+        # look up workers in a snapshot of all jobs made by one sacct per refresh interval, instead of one sacct per worker
+        self.useStatusSnapshot = bool(getattr(self, "useStatusSnapshot", True))
+        self.statusSnapshotRefreshInterval = getattr(self, "statusSnapshotRefreshInterval", 60)
+        # period in hours for sacct to look back finished jobs
+        self.statusSnapshotLookbackHours = getattr(self, "statusSnapshotLookbackHours", 24)
+        # cluster name for sacct -M
+        self.batchCluster = getattr(self, "batchCluster", None)
+
+    # convert batch status to worker status
+    def get_worker_status(self, batch_status):
+        if batch_status in ["RUNNING", "COMPLETING", "STOPPED", "SUSPENDED"]:
+            return WorkSpec.ST_running
+        elif batch_status in ["COMPLETED", "PREEMPTED", "TIMEOUT"]:
+            return WorkSpec.ST_finished
+        elif batch_status in ["CANCELLED"]:
+            return WorkSpec.ST_cancelled
+        elif batch_status in ["CONFIGURING", "PENDING"]:
+            return WorkSpec.ST_submitted
+        else:
+            return WorkSpec.ST_failed
 
     # check workers
     def check_workers(self, workspec_list):
         retList = []
+        statusMap = None
+        if self.useStatusSnapshot:
+            try:
+                statusMap = get_batch_status_snapshot(
+                    "slurm", self.batchCluster, self.statusSnapshotRefreshInterval, self.statusSnapshotLookbackHours
+                ).get_status_map()
+            except Exception:
+                # fall back to check workers one by one
+                tmpLog = self.make_logger(baseLogger, method_name="check_workers")
+                tmpLog.error("failed to get status snapshot; checking workers one by one")
+                core_utils.dump_error_message(tmpLog)
         for workSpec in workspec_list:
             # make logger
             tmpLog = self.make_logger(baseLogger, f"workerID={workSpec.workerID}", method_name="check_workers")
-            # command
-            comStr = f"sacct --jobs={workSpec.batchID}"
-            # check
-            tmpLog.debug(f"check with {comStr}")
-            p = subprocess.Popen(comStr.split(), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            newStatus = workSpec.status
-            # check return code
-            stdOut, stdErr = p.communicate()
-            retCode = p.returncode
-            tmpLog.debug(f"retCode={retCode}")
-            errStr = ""
-            stdOut_str = stdOut if (isinstance(stdOut, str) or stdOut is None) else stdOut.decode()
-            stdErr_str = stdErr if (isinstance(stdErr, str) or stdErr is None) else stdErr.decode()
-            if retCode == 0:
-                for tmpLine in stdOut_str.split("\n"):
-                    tmpMatch = re.search(f"{workSpec.batchID} ", tmpLine)
-                    if tmpMatch is not None:
-                        errStr = tmpLine
-                        batchStatus = tmpLine.split()[5]
-                        if batchStatus in ["RUNNING", "COMPLETING", "STOPPED", "SUSPENDED"]:
-                            newStatus = WorkSpec.ST_running
-                        elif batchStatus in ["COMPLETED", "PREEMPTED", "TIMEOUT"]:
-                            newStatus = WorkSpec.ST_finished
-                        elif batchStatus in ["CANCELLED"]:
-                            newStatus = WorkSpec.ST_cancelled
-                        elif batchStatus in ["CONFIGURING", "PENDING"]:
-                            newStatus = WorkSpec.ST_submitted
-                        else:
-                            newStatus = WorkSpec.ST_failed
-                        tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus}")
-                        break
-                retList.append((newStatus, errStr))
-            else:
-                # failed
-                errStr = f"{stdOut_str} {stdErr_str}"
-                tmpLog.error(errStr)
-                if "slurm_load_jobs error: Invalid job id specified" in errStr:
-                    newStatus = WorkSpec.ST_failed
+            # look up snapshot
+            if statusMap is not None and str(workSpec.batchID) in statusMap:
+                batchStatus, errStr = statusMap[str(workSpec.batchID)]
+                newStatus = self.get_worker_status(batchStatus)
+                tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus} in snapshot")
                 retList.append((newStatus, errStr))
+                continue
+            retList.append(self.check_worker(workSpec, tmpLog))
         return True, retList
+
+    # check a worker with sacct
+    def check_worker(self, workSpec, tmpLog):
+        # command
+        comStr = f"sacct --jobs={workSpec.batchID}"
+        # check
+        tmpLog.debug(f"check with {comStr}")
+        p = subprocess.Popen(comStr.split(), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        newStatus = workSpec.status
+        # check return code
+        stdOut, stdErr = p.communicate()
+        retCode = p.returncode
+        tmpLog.debug(f"retCode={retCode}")
+        errStr = ""
+        stdOut_str = stdOut if (isinstance(stdOut, str) or stdOut is None) else stdOut.decode()
+        stdErr_str = stdErr if (isinstance(stdErr, str) or stdErr is None) else stdErr.decode()
+        if retCode == 0:
+            for tmpLine in stdOut_str.split("\n"):
+                tmpMatch = re.search(f"{workSpec.batchID} ", tmpLine)
+                if tmpMatch is not None:
+                    errStr = tmpLine
+                    batchStatus = tmpLine.split()[5]
+                    newStatus = self.get_worker_status(batchStatus)
+                    tmpLog.debug(f"batchStatus {batchStatus} -> workerStatus {newStatus}")
+                    break
+        else:
+            # failed
+            errStr = f"{stdOut_str} {stdErr_str}"
+            tmpLog.error(errStr)
+            if "slurm_load_jobs error: Invalid job id specified" in errStr:
+                newStatus = WorkSpec.ST_failed
+        return newStatus, errStr
@@ -1,7 +1,9 @@
 import argparse
+import datetime
 import json
 import logging
 import random
+import socket
 import sys
 import threading
 import time
@@ -123,12 +125,18 @@ def get(arguments):
 def fifo_benchmark(arguments):
     n_objects = arguments.n_objects
     n_threads = arguments.n_threads
+    batch_size = max(arguments.batch_size, 1)
+    n_batches = (n_objects + batch_size - 1) // batch_size
     sum_dict = {
         "put_n": 0,
         "put_time": 0.0,
         "get_time": 0.0,
         "get_protective_time": 0.0,
         "clear_time": 0.0,
+        "putmany_n": 0,
+        "putmany_time": 0.0,
+        "getmany_time": 0.0,
+        "getmany_protective_time": 0.0,
     }
     thread_lock = threading.Lock()
     thread_fifo_map = {}
@@ -138,15 +146,39 @@ def fifo_benchmark(arguments):
         with thread_lock:
             thread_fifo_map[thread_id] = harvesterFifos.BenchmarkFIFO()
 
-    def _put_object(i_index):
-        mq = thread_fifo_map.get(threading.get_ident())
-        if mq is None:
-            return
+    def _make_object(i_index):
         workspec = WorkSpec()
         workspec.workerID = i_index
         data = {"random": [(i_index**2) % 2**16, random.random()]}
         workspec.workAttributes = data
-        mq.put(workspec)
+        return workspec
+
+    def _put_object(i_index):
+        mq = thread_fifo_map.get(threading.get_ident())
+        if mq is None:
+            return
+        mq.put(_make_object(i_index))
+
+    def _put_objects(i_batch):
+        mq = thread_fifo_map.get(threading.get_ident())
+        if mq is None:
+            return
+        i_range = range(i_batch * batch_size, min((i_batch + 1) * batch_size, n_objects))
+        mq.putmany([(_make_object(i_index), None) for i_index in i_range])
+
+    def _get_objects(i_batch):
+        mq = thread_fifo_map.get(threading.get_ident())
+        if mq is None:
+            return
+        return mq.getmany(count=batch_size, protective=False)
+
+    def _get_objects_protective(i_batch):
+        mq = thread_fifo_map.get(threading.get_ident())
+        if mq is None:
+            return
+        obj_list = mq.getmany(count=batch_size, protective=True)
+        mq.deletemany([obj.id for obj in obj_list])
+        return obj_list
 
     def _get_object(i_index):
         mq = thread_fifo_map.get(threading.get_ident())
@@ -191,6 +223,37 @@ def fifo_benchmark(arguments):
         print(f"Now fifo size is {benchmark_mq.size()}")
         del benchmark_mq
 
+    def putmany_test():
+        sw = core_utils.get_stopwatch()
+        sw.reset()
+        multithread_executer(_put_objects, n_batches, n_threads, _thread_initializer)
+        sum_dict["putmany_time"] += sw.get_elapsed_time_in_sec()
+        sum_dict["putmany_n"] += 1
+        print(f"Put {n_objects} objects in batches of {batch_size} by {n_threads} threads" + sw.get_elapsed_time())
+        benchmark_mq = harvesterFifos.BenchmarkFIFO()
+        print(f"Now fifo size is {benchmark_mq.size()}")
+        del benchmark_mq
+
+    def getmany_test():
+        sw = core_utils.get_stopwatch()
+        sw.reset()
+        multithread_executer(_get_objects, n_batches, n_threads, _thread_initializer)
+        sum_dict["getmany_time"] = sw.get_elapsed_time_in_sec()
+        print(f"Get {n_objects} objects in batches of {batch_size} by {n_threads} threads" + sw.get_elapsed_time())
+        benchmark_mq = harvesterFifos.BenchmarkFIFO()
+        print(f"Now fifo size is {benchmark_mq.size()}")
+        del benchmark_mq
+
+    def getmany_protective_test():
+        sw = core_utils.get_stopwatch()
+        sw.reset()
+        multithread_executer(_get_objects_protective, n_batches, n_threads, _thread_initializer)
+        sum_dict["getmany_protective_time"] = sw.get_elapsed_time_in_sec()
+        print(f"Get {n_objects} objects protective dequeue and delete in batches of {batch_size} by {n_threads} threads" + sw.get_elapsed_time())
+        benchmark_mq = harvesterFifos.BenchmarkFIFO()
+        print(f"Now fifo size is {benchmark_mq.size()}")
+        del benchmark_mq
+
     def clear_test():
         benchmark_mq = harvesterFifos.BenchmarkFIFO()
         sw = core_utils.get_stopwatch()
@@ -212,6 +275,12 @@ def fifo_benchmark(arguments):
     get_protective_test()
     put_test()
     clear_test()
+    if batch_size > 1:
+        putmany_test()
+        getmany_test()
+        putmany_test()
+        getmany_protective_test()
+        benchmark_mq.fifo.clear()
     print("Finished fifo benchmark")
     # summary
     print("Summary:")
@@ -221,6 +290,11 @@ def fifo_benchmark(arguments):
     print(f"Get            : {1000.0 * sum_dict['get_time'] / n_objects:.3f} ms / obj")
     print(f"Get protective : {1000.0 * sum_dict['get_protective_time'] / n_objects:.3f} ms / obj")
     print(f"Clear          : {1000.0 * sum_dict['clear_time'] / n_objects:.3f} ms / obj")
+    if batch_size > 1:
+        print(f"Batched with {batch_size} objects per batch")
+        print(f"Putmany                   : {1000.0 * sum_dict['putmany_time'] / (sum_dict['putmany_n'] * n_objects):.3f} ms / obj")
+        print(f"Getmany                   : {1000.0 * sum_dict['getmany_time'] / n_objects:.3f} ms / obj")
+        print(f"Getmany protective+delete : {1000.0 * sum_dict['getmany_protective_time'] / n_objects:.3f} ms / obj")
 
 
 def fifo_repopulate(arguments):
@@ -346,6 +420,77 @@ def query_jobs(arguments):
         raise
 
 
+def get_latest_service_metrics(hours):
+    dbProxy = DBProxy()
+    # take the latest service metrics of this host
+    last_update = core_utils.naive_utcnow() - datetime.timedelta(hours=hours)
+    res_list = dbProxy.get_service_metrics(last_update)
+    host_name = socket.getfqdn()
+    metrics = None
+    for creation_time, tmp_host_name, tmp_metrics in sorted(res_list or []):
+        if tmp_host_name != host_name:
+            continue
+        if isinstance(tmp_metrics, str):
+            tmp_metrics = json.loads(tmp_metrics)
+        metrics = tmp_metrics
+    return host_name, metrics
+
+
+def query_db_stats(arguments):
+    host_name, metrics = get_latest_service_metrics(arguments.hours)
+    if metrics is None or f"db_{arguments.target}_stats" not in metrics:
+        mainLogger.error(f"No DB call statistics of {host_name} in service metrics in the last {arguments.hours} hours")
+        return 1
+    stats_list = sorted(metrics[f"db_{arguments.target}_stats"], key=lambda x: x.get(arguments.sort_key, 0), reverse=True)[: arguments.n_top]
+    if arguments.json:
+        json_print(stats_list)
+        return
+    print(f"{'n_calls':>9} {'total_s':>9} {'avg_ms':>8} {'p50_ms':>8} {'p90_ms':>8} {'p99_ms':>8} {'max_ms':>8} {'wait_ms':>8} {'n_rows':>9}  name")
+    for stats in stats_list:
+        n_calls = max(stats["n_calls"], 1)
+        print(
+            f"{stats['n_calls']:>9} {stats['total_time']:>9.2f} {stats['avg_time'] * 1e3:>8.2f} {stats['p50_time'] * 1e3:>8.2f} "
+            f"{stats['p90_time'] * 1e3:>8.2f} {stats['p99_time'] * 1e3:>8.2f} {stats['max_time'] * 1e3:>8.2f} "
+            f"{stats['wait_time'] * 1e3 / n_calls:>8.2f} {stats['n_rows']:>9}  {stats['key']}"
+        )
+
+
+def query_plugin_stats(arguments):
+    host_name, metrics = get_latest_service_metrics(arguments.hours)
+    if metrics is None or "plugin_call_stats" not in metrics:
+        mainLogger.error(f"No plugin call statistics of {host_name} in service metrics in the last {arguments.hours} hours")
+        return 1
+    # stack samples of slow calls
+    if arguments.slow:
+        sample_list = [sample for sample in metrics.get("plugin_slow_calls", []) if not arguments.queue_list or sample["queue"] in arguments.queue_list]
+        if arguments.json:
+            json_print(sample_list)
+            return
+        for sample in sample_list:
+            sampled_at = datetime.datetime.utcfromtimestamp(sample["sampled_at"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"=== {sampled_at} queue={sample['queue']} {sample['plugin']}.{sample['method']} running for {sample['elapsed']:.1f} sec")
+            for line in sample["stack"]:
+                print(line)
+        return
+    stats_list = [stats for stats in metrics["plugin_call_stats"] if not arguments.queue_list or stats["queue"] in arguments.queue_list]
+    stats_list = sorted(stats_list, key=lambda x: x.get(arguments.sort_key, 0), reverse=True)[: arguments.n_top]
+    if arguments.json:
+        json_print(stats_list)
+        return
+    histogram_labels = list(stats_list[0]["histogram"]) if stats_list else []
+    histogram_header = " ".join([f"{label.replace('le_', '<='):>7}" for label in histogram_labels])
+    print(
+        f"{'n_calls':>8} {'n_err':>6} {'n_slow':>6} {'total_s':>9} {'avg_s':>8} {'max_s':>8} {'avg_n':>7} {'max_n':>7} {histogram_header}  queue plugin.method"
+    )
+    for stats in stats_list:
+        histogram_str = " ".join([f"{stats['histogram'].get(label, 0):>7}" for label in histogram_labels])
+        print(
+            f"{stats['n_calls']:>8} {stats['n_errors']:>6} {stats['n_slow']:>6} {stats['total_time']:>9.2f} {stats['avg_time']:>8.3f} "
+            f"{stats['max_time']:>8.3f} {stats['avg_items']:>7.1f} {stats['max_items']:>7} {histogram_str}  "
+            f"{stats['queue']} {stats['plugin']}.{stats['method']}"
+        )
+
+
 # === Command map =======================================================
 
 
@@ -369,6 +514,8 @@ commandMap = {
     # query commands
     "query_workers": query_workers,
     "query_jobs": query_jobs,
+    "query_db_stats": query_db_stats,
+    "query_plugin_stats": query_plugin_stats,
 }
 
 # === Main ======================================================
@@ -397,6 +544,9 @@ def main():
     fifo_benchmark_parser.set_defaults(which="fifo_benchmark")
     fifo_benchmark_parser.add_argument("-n", type=int, dest="n_objects", action="store", default=500, metavar="<N>", help="Benchmark with N objects")
     fifo_benchmark_parser.add_argument("-t", type=int, dest="n_threads", action="store", default=1, metavar="<N>", help="Benchmark with N threads")
+    fifo_benchmark_parser.add_argument(
+        "-b", type=int, dest="batch_size", action="store", default=1, metavar="<N>", help="Also benchmark batched operations with N objects per batch"
+    )
     # fifo repopuate command
     fifo_repopulate_parser = fifo_subparsers.add_parser("repopulate", help="Repopulate agent fifo")
     fifo_repopulate_parser.set_defaults(which="fifo_repopulate")
@@ -481,6 +631,51 @@ def main():
     query_jobs_parser.add_argument("-a", "--all", dest="all", action="store_true", help="Show results of all queues")
     query_jobs_parser.add_argument("queue_list", nargs="+", type=str, action="store", metavar="<queue_name>", help="Name of active queue")
 
+    # query db_stats command
+    query_db_stats_parser = query_subparsers.add_parser("db_stats", help="Show the slowest DB methods or SQL statements from the latest service metrics")
+    query_db_stats_parser.set_defaults(which="query_db_stats")
+    query_db_stats_parser.add_argument("-n", type=int, dest="n_top", action="store", default=10, metavar="<N>", help="Show top N entries")
+    query_db_stats_parser.add_argument(
+        "-s",
+        "--sort",
+        dest="sort_key",
+        action="store",
+        default="total_time",
+        choices=["total_time", "avg_time", "p90_time", "p99_time", "max_time", "wait_time", "n_calls", "n_rows"],
+        help="Sort key",
+    )
+    query_db_stats_parser.add_argument(
+        "--sql", dest="target", action="store_const", const="sql", default="methods", help="Show SQL statements instead of methods"
+    )
+    query_db_stats_parser.add_argument(
+        "--hours", type=float, dest="hours", action="store", default=1, metavar="<hours>", help="Look back service metrics for this period"
+    )
+    query_db_stats_parser.add_argument("-J", "--json", dest="json", action="store_true", help="Print in JSON format")
+
+    # query plugin_stats command
+    query_plugin_stats_parser = query_subparsers.add_parser(
+        "plugin_stats", help="Show latency histograms of plugin calls per queue, or stack samples of slow calls, from the latest service metrics"
+    )
+    query_plugin_stats_parser.set_defaults(which="query_plugin_stats")
+    query_plugin_stats_parser.add_argument("-n", type=int, dest="n_top", action="store", default=20, metavar="<N>", help="Show top N entries")
+    query_plugin_stats_parser.add_argument(
+        "-s",
+        "--sort",
+        dest="sort_key",
+        action="store",
+        default="total_time",
+        choices=["total_time", "avg_time", "max_time", "in_flight_time", "n_calls", "n_errors", "n_slow", "avg_items"],
+        help="Sort key",
+    )
+    query_plugin_stats_parser.add_argument("--slow", dest="slow", action="store_true", help="Show stack samples of slow calls instead of statistics")
+    query_plugin_stats_parser.add_argument(
+        "--hours", type=float, dest="hours", action="store", default=1, metavar="<hours>", help="Look back service metrics for this period"
+    )
+    query_plugin_stats_parser.add_argument("-J", "--json", dest="json", action="store_true", help="Print in JSON format")
+    query_plugin_stats_parser.add_argument(
+        "queue_list", nargs="*", type=str, action="store", metavar="<queue_name>", help="Name of queues. All queues if omitted"
+    )
+
     # start parsing
     if len(sys.argv) == 1:
         oparser.print_help()
@@ -1,8 +1,101 @@
 import abc
+import re
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from pandaharvester.harvestercore.plugin_base import PluginBase
 
 
+# run a command
+def _run_command(com_str):
+    p = subprocess.Popen(shlex.split(com_str), shell=False, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdOut, stdErr = p.communicate()
+    return p.returncode, stdOut, stdErr
+
+
+# find batchIDs in a line of command output. id_map maps IDs with and without server name to batchIDs
+def find_batch_ids(line, id_map):
+    batch_ids = set()
+    for token in re.findall(r"[\w.\[\]-]+", line):
+        # try without server name too
+        for tmp_id in (token, token.split(".")[0]):
+            if tmp_id in id_map:
+                batch_ids.add(id_map[tmp_id])
+                break
+    return batch_ids
+
+
+# classify output of kill commands which report only failures with one line per ID, like scancel and qdel
+# e.g. scancel: error: Kill job error on job id 12345: Job/step already completing or completed
+#      qdel: Unknown Job Id 1234.server
+def classify_kill_errors(ret_code, std_out, std_err, id_map):
+    ret_map = {}
+    for line in std_err.splitlines():
+        for batch_id in find_batch_ids(line, id_map):
+            ret_map[batch_id] = (False, line.strip())
+    return ret_map
+
+
+# kill a chunk of batch jobs with one command and return a dict of batchID: (return code, error dialog)
+def _kill_chunk(make_command, classify_output, batch_ids, tmp_log):
+    comStr = make_command(batch_ids)
+    comName = comStr.split()[0]
+    try:
+        retCode, stdOut, stdErr = _run_command(comStr)
+    except Exception as e:
+        errStr = f"failed to run {comName} with {e.__class__.__name__}: {e}"
+        tmp_log.error(errStr)
+        return {batch_id: (False, errStr) for batch_id in batch_ids}
+    id_map = {}
+    for batch_id in batch_ids:
+        # PBS prints IDs with or without server name
+        id_map.setdefault(batch_id.split(".")[0], batch_id)
+        id_map[batch_id] = batch_id
+    ret_map = classify_output(retCode, stdOut, stdErr, id_map)
+    if retCode != 0 and all(tmpRet for tmpRet, _ in ret_map.values()):
+        # failed without per-ID errors
+        errStr = f'command "{comName}" for {len(batch_ids)} jobs failed, retCode={retCode}, error: {stdOut} {stdErr}'
+        tmp_log.error(errStr)
+        return {batch_id: (False, errStr) for batch_id in batch_ids}
+    tmp_log.debug(f"{comName} for {len(batch_ids)} jobs got retCode={retCode} with {len(ret_map)} reported jobs")
+    for batch_id in batch_ids:
+        ret_map.setdefault(batch_id, (True, ""))
+    return ret_map
+
+
+# kill workers with commands taking chunks of batchIDs, executed in parallel
+def kill_workers_in_bulk(workspec_list, make_command, classify_output, tmp_log, chunk_size=500, n_threads=4):
+    """
+    Kill workers in bulk. make_command takes a list of batchIDs and returns the command string.
+    classify_output takes return code, stdout, stderr, and a dict mapping IDs in the output to batchIDs,
+    and returns a dict of batchID: (return code, error dialog) for batchIDs reported in the output. Others are regarded as killed
+
+    :return: A list of tuples of return code (True for success, False otherwise) and error dialog for each worker
+    :rtype: [(bool, string)]
+    """
+    batch_ids = list(dict.fromkeys([str(workspec.batchID) for workspec in workspec_list if workspec.batchID]))
+    chunks = [batch_ids[i : i + chunk_size] for i in range(0, len(batch_ids), chunk_size)]
+    tmp_log.debug(f"killing {len(batch_ids)} jobs in {len(chunks)} chunks")
+    ret_map = {}
+    if len(chunks) <= 1 or n_threads <= 1:
+        for chunk in chunks:
+            ret_map.update(_kill_chunk(make_command, classify_output, chunk, tmp_log))
+    else:
+        with ThreadPoolExecutor(max_workers=min(n_threads, len(chunks))) as pool:
+            for tmp_map in pool.map(lambda chunk: _kill_chunk(make_command, classify_output, chunk, tmp_log), chunks):
+                ret_map.update(tmp_map)
+    retList = []
+    for workspec in workspec_list:
+        if not workspec.batchID:
+            retList.append((True, "worker without batchID; skipped"))
+        else:
+            retList.append(ret_map[str(workspec.batchID)])
+    nKilled = len([tmpRet for tmpRet, _ in retList if tmpRet])
+    tmp_log.info(f"Succeeded to kill {nKilled}/{len(workspec_list)} workers")
+    return retList
+
+
 # dummy plugin for sweeper
 class BaseSweeper(PluginBase, metaclass=abc.ABCMeta):
     # constructor
@@ -6,6 +6,10 @@ import subprocess
 
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
+from pandaharvester.harvestersweeper.base_sweeper import (
+    classify_kill_errors,
+    kill_workers_in_bulk,
+)
 
 # ==============================================================
 
@@ -38,6 +42,10 @@ class CobaltSweeper(PluginBase):
     # constructor
     def __init__(self, **kwarg):
         PluginBase.__init__(self, **kwarg)
+        # number of batchIDs passed to one qdel command
+        self.killChunkSize = getattr(self, "killChunkSize", 500)
+        # number of qdel commands executed in parallel
+        self.nKillThreads = getattr(self, "nKillThreads", 4)
 
     # kill a worker
     def kill_worker(self, workspec):
@@ -66,6 +74,13 @@ class CobaltSweeper(PluginBase):
         # Return
         return True, ""
 
+    # kill workers in bulk with qdel
+    def kill_workers(self, workspec_list):
+        tmpLog = self.make_logger(baseLogger, method_name="kill_workers")
+        return kill_workers_in_bulk(
+            workspec_list, lambda batch_ids: f"qdel {' '.join(batch_ids)}", classify_kill_errors, tmpLog, self.killChunkSize, self.nKillThreads
+        )
+
     # cleanup for a worker
     def sweep_worker(self, workspec):
         """Perform cleanup procedures for a worker, such as deletion of work directory.
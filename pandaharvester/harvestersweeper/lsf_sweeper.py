@@ -4,16 +4,37 @@ import subprocess
 
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
+from pandaharvester.harvestersweeper.base_sweeper import (
+    find_batch_ids,
+    kill_workers_in_bulk,
+)
 
 # logger
 baseLogger = core_utils.setup_logger("lsf_sweeper")
 
 
+# classify output of bkill which reports every ID
+# e.g. Job <1234> is being terminated , Job <1235>: Job has already finished
+def _classify_bkill(ret_code, std_out, std_err, id_map):
+    ret_map = {}
+    for line in (std_out + "\n" + std_err).splitlines():
+        for batch_id in find_batch_ids(line.replace("<", " ").replace(">", " "), id_map):
+            if "is being terminated" in line or "is being signaled" in line:
+                ret_map[batch_id] = (True, "")
+            else:
+                ret_map[batch_id] = (False, line.strip())
+    return ret_map
+
+
 # plugin for sweeper with LSF
 class LSFSweeper(PluginBase):
     # constructor
     def __init__(self, **kwarg):
         PluginBase.__init__(self, **kwarg)
+        # number of batchIDs passed to one bkill command
+        self.killChunkSize = getattr(self, "killChunkSize", 500)
+        # number of bkill commands executed in parallel
+        self.nKillThreads = getattr(self, "nKillThreads", 4)
 
     # kill a worker
     def kill_worker(self, workspec):
@@ -42,6 +63,13 @@ class LSFSweeper(PluginBase):
         # return
         return True, ""
 
+    # kill workers in bulk with bkill
+    def kill_workers(self, workspec_list):
+        tmpLog = self.make_logger(baseLogger, method_name="kill_workers")
+        return kill_workers_in_bulk(
+            workspec_list, lambda batch_ids: f"bkill {' '.join(batch_ids)}", _classify_bkill, tmpLog, self.killChunkSize, self.nKillThreads
+        )
+
     # cleanup for a worker
     def sweep_worker(self, workspec):
         """Perform cleanup procedures for a worker, such as deletion of work directory.
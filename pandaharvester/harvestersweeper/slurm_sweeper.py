@@ -3,7 +3,11 @@ import shutil
 import subprocess
 
 from pandaharvester.harvestercore import core_utils
-from pandaharvester.harvestersweeper.base_sweeper import BaseSweeper
+from pandaharvester.harvestersweeper.base_sweeper import (
+    BaseSweeper,
+    classify_kill_errors,
+    kill_workers_in_bulk,
+)
 
 # logger
 baseLogger = core_utils.setup_logger("slurm_sweeper")
@@ -14,6 +18,12 @@ class SlurmSweeper(BaseSweeper):
     # constructor
     def __init__(self, **kwarg):
         BaseSweeper.__init__(self, **kwarg)
+        # number of batchIDs passed to one scancel command
+        self.killChunkSize = getattr(self, "killChunkSize", 500)
+        # number of scancel commands executed in parallel
+        self.nKillThreads = getattr(self, "nKillThreads", 4)
+        # cluster name for scancel -M
+        self.batchCluster = getattr(self, "batchCluster", None)
 
     # kill a worker
     def kill_worker(self, workspec):
@@ -42,6 +52,16 @@ class SlurmSweeper(BaseSweeper):
         # return
         return True, ""
 
+    # kill workers in bulk with scancel
+    def kill_workers(self, workspec_list):
+        tmpLog = self.make_logger(baseLogger, method_name="kill_workers")
+        comStr = "scancel"
+        if self.batchCluster:
+            comStr += f" -M {self.batchCluster}"
+        return kill_workers_in_bulk(
+            workspec_list, lambda batch_ids: f"{comStr} {' '.join(batch_ids)}", classify_kill_errors, tmpLog, self.killChunkSize, self.nKillThreads
+        )
+
     # cleanup for a worker
     def sweep_worker(self, workspec):
         """Perform cleanup procedures for a worker, such as deletion of work directory.
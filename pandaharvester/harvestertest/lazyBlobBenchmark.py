@@ -0,0 +1,125 @@
+"""
+benchmark of DB methods loading XyzSpec objects with realistic blob sizes, where blob attributes are decoded lazily.
+"load + access blobs" corresponds to eager decoding at load time
+
+usage: python lazyBlobBenchmark.py [nObjects] [jobParamsSizeKB]
+"""
+
+import datetime
+import sys
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore import db_proxy as db_proxy_module
+from pandaharvester.harvestercore.db_proxy import DBProxy
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nObjects = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+jobParamsSizeKB = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+siteName = "LAZY_BLOB_BENCHMARK"
+baseID = 8000000000
+
+
+# make jobParams like those from PanDA
+def make_job_params(i):
+    jobParams = {
+        "PandaID": baseID + i,
+        "jobPars": "--maxEvents=1000 " + " ".join([f"--option{k}=value{k}" for k in range(jobParamsSizeKB * 1024 // 20)]),
+        "inFiles": ",".join([f"EVNT.{i:08d}._{k:06d}.pool.root.1" for k in range(10)]),
+        "GUID": ",".join([f"{i:08X}-0000-0000-0000-{k:012d}" for k in range(10)]),
+        "fsize": ",".join([str(123456789 + k) for k in range(10)]),
+        "checksum": ",".join([f"ad:{k:08x}" for k in range(10)]),
+        "outFiles": f"HITS.{i:08d}.pool.root.1,log.{i:08d}.tgz",
+        "transformation": "Sim_tf.py",
+        "homepackage": "AtlasOffline/21.0.15",
+        "prodSourceLabel": "managed",
+    }
+    jobParams.update({f"key{k}": f"value{k}" for k in range(40)})
+    return jobParams
+
+
+# fill the database
+def populate(proxy):
+    timeNow = core_utils.naive_utcnow()
+    jobSpecs = []
+    workSpecs = []
+    for i in range(nObjects):
+        jobSpec = JobSpec()
+        jobSpec.PandaID = baseID + i
+        jobSpec.computingSite = siteName
+        jobSpec.status = "running"
+        jobSpec.subStatus = "running"
+        jobSpec.jobParams = make_job_params(i)
+        jobSpec.jobAttributes = {"startTime": str(timeNow), "cpuConsumptionTime": i, "corruptedFiles": None}
+        jobSpec.trigger_propagation()
+        jobSpecs.append(jobSpec)
+        workSpec = WorkSpec()
+        workSpec.workerID = baseID + i
+        workSpec.computingSite = siteName
+        workSpec.status = WorkSpec.ST_running
+        workSpec.modificationTime = timeNow - datetime.timedelta(hours=1)
+        workSpec.workParams = {f"param{k}": "x" * 20 for k in range(20)}
+        workSpec.workAttributes = {"stdOut": f"/data/logs/{i}.out", "stdErr": f"/data/logs/{i}.err", "batchLog": f"/data/logs/{i}.log"}
+        workSpec.workAttributes.update({f"attr{k}": k for k in range(50)})
+        workSpecs.append(workSpec)
+    proxy.insert_jobs(jobSpecs)
+    sqlW = f"INSERT INTO {db_proxy_module.workTableName} ({WorkSpec.column_names()}) "
+    sqlW += WorkSpec.bind_values_expression()
+    proxy.executemany(sqlW, [workSpec.values_list() for workSpec in workSpecs])
+    proxy.commit()
+
+
+# delete jobs and workers
+def clean_up(proxy):
+    varMap = dict()
+    varMap[":siteName"] = siteName
+    proxy.execute(f"DELETE FROM {db_proxy_module.jobTableName} WHERE computingSite=:siteName ", varMap)
+    proxy.execute(f"DELETE FROM {db_proxy_module.workTableName} WHERE computingSite=:siteName ", varMap)
+    proxy.commit()
+
+
+# measure
+def measure(label, func):
+    timeStart = time.perf_counter()
+    retVal = func()
+    print(f"{label:<40} {time.perf_counter() - timeStart:8.3f} sec")
+    return retVal
+
+
+# access all blob attributes
+def access_blobs(specs):
+    for spec in specs:
+        for attr in spec.serializedAttrs:
+            getattr(spec, attr)
+
+
+# encode all attributes to save objects
+def encode_all(specs):
+    for spec in specs:
+        spec.values_map()
+
+
+if __name__ == "__main__":
+    proxy = DBProxy()
+    clean_up(proxy)
+    populate(proxy)
+    try:
+        print(f"=== {nObjects} workers and jobs with jobParams of {jobParamsSizeKB} KB, DB engine={harvester_config.db.engine}")
+        retMap = measure("get_workers_to_update", lambda: proxy.get_workers_to_update(nObjects, 0, 0, "benchmark"))
+        workSpecs = [
+            workSpec for configMap in retMap.values() for workersLists in configMap.values() for workersList in workersLists for workSpec in workersList
+        ]
+        print(f"got {len(workSpecs)} workers")
+        measure("encode to save without access", lambda: encode_all(workSpecs))
+        measure("access blobs", lambda: access_blobs(workSpecs))
+        measure("encode to save after access", lambda: encode_all(workSpecs))
+        jobSpecs = measure("get_jobs_to_propagate", lambda: proxy.get_jobs_to_propagate(nObjects, 0, 0, "benchmark"))
+        print(f"got {len(jobSpecs)} jobs")
+        measure("encode to save without access", lambda: encode_all(jobSpecs))
+        measure("access blobs", lambda: access_blobs(jobSpecs))
+        measure("encode to save after access", lambda: encode_all(jobSpecs))
+    finally:
+        clean_up(proxy)
@@ -0,0 +1,155 @@
+"""
+benchmark of Propagator against a local stub PanDA server, comparing sequential and concurrent propagation
+
+usage: python propagatorBenchmark.py [nJobs] [nWorkers] [baseLatency] [latencyPerItem] [nConcurrentShards,...] [targetShardLatency]
+e.g. python propagatorBenchmark.py 2000 2000 0.2 0.002 1,2,4,8 2
+Each setting runs with the fixed shard size of nJobsInBulk and nWorkersInBulk, and with shard sizes adjusted
+to targetShardLatency up to five times of them
+"""
+
+import http.server
+import json
+import sys
+import threading
+import time
+
+from pandaharvester.harvesterbody.propagator import Propagator
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import db_proxy as db_proxy_module
+from pandaharvester.harvestercore.communicator_pool import CommunicatorPool
+from pandaharvester.harvestercore.db_proxy import DBProxy
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+nWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+baseLatency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+latencyPerItem = float(sys.argv[4]) if len(sys.argv) > 4 else 0.002
+concurrencyList = [int(tmpStr) for tmpStr in sys.argv[5].split(",")] if len(sys.argv) > 5 else [1, 2, 4, 8]
+targetShardLatency = float(sys.argv[6]) if len(sys.argv) > 6 else 2
+
+siteName = "PROPAGATOR_BENCHMARK"
+basePandaID = 9000000000
+
+
+# stub PanDA server which takes baseLatency + latencyPerItem * number of jobs or workers
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # handle POST
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        data = json.loads(body) if body else {}
+        if self.path.endswith("/pilot/update_jobs_bulk"):
+            nItems = len(data["job_list"])
+            retData = [{"success": True, "message": "", "data": {"StatusCode": 0, "command": "NULL"}}] * nItems
+        elif self.path.endswith("/harvester/update_workers"):
+            nItems = len(data["workers"])
+            retData = [True] * nItems
+        else:
+            nItems = 0
+            retData = None
+        time.sleep(baseLatency + latencyPerItem * nItems)
+        out = json.dumps({"success": True, "message": "", "data": retData}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    do_GET = do_POST
+
+    # suppress logging
+    def log_message(self, *args):
+        pass
+
+
+# queue config without heartbeat suppression
+class DummyQueueConfig(object):
+    # get status without heartbeat
+    def get_no_heartbeat_status(self):
+        return []
+
+
+# queue config mapper
+class DummyQueueConfigMapper(object):
+    # get queue
+    def get_queue(self, queue_name, config_id=None):
+        return DummyQueueConfig()
+
+    # get active UPS queues
+    def get_active_ups_queues(self):
+        return []
+
+
+# make jobs and workers to propagate
+def make_entries(db_proxy):
+    jobSpecs = []
+    for i in range(nJobs):
+        jobSpec = JobSpec()
+        jobSpec.PandaID = basePandaID + i
+        jobSpec.computingSite = siteName
+        jobSpec.status = "running"
+        jobSpec.subStatus = "running"
+        jobSpec.jobParams = {}
+        jobSpec.trigger_propagation()
+        jobSpecs.append(jobSpec)
+    db_proxy.insert_jobs(jobSpecs)
+    workSpecs = []
+    for i in range(nWorkers):
+        workSpec = WorkSpec()
+        workSpec.workerID = basePandaID + i
+        workSpec.computingSite = siteName
+        workSpec.status = WorkSpec.ST_running
+        workSpec.trigger_propagation()
+        workSpecs.append(workSpec)
+    sqlW = f"INSERT INTO {db_proxy_module.workTableName} ({WorkSpec.column_names()}) "
+    sqlW += WorkSpec.bind_values_expression()
+    db_proxy.executemany(sqlW, [workSpec.values_list() for workSpec in workSpecs])
+    db_proxy.commit()
+
+
+# delete jobs and workers
+def delete_entries(db_proxy):
+    varMap = dict()
+    varMap[":siteName"] = siteName
+    db_proxy.execute(f"DELETE FROM {db_proxy_module.jobTableName} WHERE computingSite=:siteName ", varMap)
+    db_proxy.execute(f"DELETE FROM {db_proxy_module.workTableName} WHERE computingSite=:siteName ", varMap)
+    db_proxy.commit()
+
+
+if __name__ == "__main__":
+    server = http.server.ThreadingHTTPServer(("localhost", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stubURL = f"http://localhost:{server.server_address[1]}/api/v1"
+    communicator = CommunicatorPool()
+    for con in communicator.connections:
+        con.server_base_path_ssl = stubURL
+        con.server_base_path = stubURL
+        # plain HTTP without certificate
+        con.get_host_specific_auth_config = lambda base_url: ("x509", None, None, False, None)
+    print(f"{nJobs} jobs and {nWorkers} workers, latency {baseLatency} + {latencyPerItem} * items sec, {len(communicator.connections)} connections")
+    harvester_config.propagator.maxJobs = nJobs
+    harvester_config.propagator.maxWorkers = nWorkers
+    harvester_config.propagator.maxJobsInBulk = harvester_config.propagator.nJobsInBulk * 5
+    harvester_config.propagator.maxWorkersInBulk = harvester_config.propagator.nWorkersInBulk * 5
+    dbProxy = DBProxy()
+    delete_entries(dbProxy)
+    for nConcurrentShards in concurrencyList:
+        for targetLatency in (0, targetShardLatency):
+            harvester_config.propagator.nConcurrentShards = nConcurrentShards
+            harvester_config.propagator.targetShardLatency = targetLatency
+            make_entries(dbProxy)
+            try:
+                propagator = Propagator(communicator, DummyQueueConfigMapper(), single_mode=True)
+                timeStart = time.monotonic()
+                propagator.run()
+                timeConsumed = time.monotonic() - timeStart
+            finally:
+                delete_entries(dbProxy)
+            print(
+                f"nConcurrentShards={nConcurrentShards} targetShardLatency={targetLatency} "
+                f"{timeConsumed:7.2f} sec {(nJobs + nWorkers) / timeConsumed:8.1f} items/sec "
+                f"shard sizes {propagator.shardSizes}"
+            )
+    server.shutdown()
@@ -0,0 +1,83 @@
+"""
+micro-benchmark of construction and serialization of XyzSpec objects
+
+usage: python specBaseBenchmark.py [nObjects]
+"""
+
+import pickle
+import sqlite3
+import sys
+import time
+
+from pandaharvester.harvestercore.file_spec import FileSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nObjects = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+
+# measure time per object in usec
+def measure(label, func, n_objects):
+    time_point = time.perf_counter()
+    func()
+    time_consumed = time.perf_counter() - time_point
+    print(f"{label:<30} {time_consumed * 1e6 / n_objects:8.2f} usec/obj")
+
+
+# make an object with typical values
+def make_object(cls, i):
+    spec = cls()
+    if cls is FileSpec:
+        spec.PandaID = i
+        spec.lfn = f"EVNT.{i:08d}.pool.root.1"
+        spec.fileType = "output"
+        spec.status = "defined"
+        spec.fsize = 1024 * i
+        spec.fileAttributes = {"guid": f"guid-{i}"}
+    elif cls is WorkSpec:
+        spec.workerID = i
+        spec.status = "running"
+        spec.computingSite = "SITE_A"
+        spec.workAttributes = {"attr": i}
+    else:
+        spec.PandaID = i
+        spec.status = "running"
+        spec.computingSite = "SITE_A"
+        spec.jobParams = {"jobPars": "x" * 100}
+    return spec
+
+
+# make rows as loaded from sqlite
+def make_rows(cls, specs):
+    con = sqlite3.connect(":memory:")
+    con.row_factory = sqlite3.Row
+    cur = con.cursor()
+    cur.execute(f"CREATE TABLE t ({cls.column_names()})")
+    placeholders = ",".join(["?"] * len(cls.attributesWithTypes))
+    cur.executemany(f"INSERT INTO t ({cls.column_names()}) VALUES({placeholders})", [spec.values_list() for spec in specs])
+    cur.execute(f"SELECT {cls.column_names()} FROM t")
+    return cur.fetchall()
+
+
+for cls in [FileSpec, WorkSpec, JobSpec]:
+    print(f"--- {cls.__name__} x {nObjects}")
+    specs = []
+    measure("construct", lambda: [cls() for i in range(nObjects)], nObjects)
+    measure("construct + set attributes", lambda: specs.extend([make_object(cls, i) for i in range(nObjects)]), nObjects)
+    measure("values_list", lambda: [spec.values_list() for spec in specs], nObjects)
+    measure("values_map", lambda: [spec.values_map() for spec in specs], nObjects)
+    measure("values_map(only_changed)", lambda: [spec.values_map(only_changed=True) for spec in specs], nObjects)
+    rows = make_rows(cls, specs)
+
+    def pack_one_by_one():
+        for row in rows:
+            spec = cls()
+            spec.pack(row)
+
+    measure("pack", pack_one_by_one, nObjects)
+    if hasattr(cls, "pack_rows"):
+        measure("pack_rows", lambda: cls.pack_rows(rows), nObjects)
+    pickled = []
+    measure("pickle", lambda: pickled.extend([pickle.dumps(spec) for spec in specs]), nObjects)
+    print(f"{'pickle size':<30} {sum(len(p) for p in pickled) / nObjects:8.1f} bytes/obj")
+    measure("unpickle", lambda: [pickle.loads(p) for p in pickled], nObjects)
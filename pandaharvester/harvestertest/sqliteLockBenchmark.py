@@ -0,0 +1,183 @@
+"""
+benchmark of monitor, propagator and submitter threads sharing a sqlite database,
+with the application side lock on all statements and only on writes (db.sqliteConcurrentRead)
+
+usage: python sqliteLockBenchmark.py [nWorkers] [duration]
+"""
+
+import datetime
+import itertools
+import sys
+import threading
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore import db_proxy as db_proxy_module
+from pandaharvester.harvestercore.db_proxy import DBProxy
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.file_spec import FileSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.job_worker_relation_spec import JobWorkerRelationSpec
+from pandaharvester.harvestercore.panda_queue_spec import PandaQueueSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+duration = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+nQueues = 50
+nFilesPerJob = 3
+
+# workerIDs for new workers
+newWorkerIDs = itertools.count(100000000)
+
+if harvester_config.db.engine != "sqlite":
+    print("this benchmark is only for sqlite")
+    sys.exit(1)
+
+
+# fill the database
+def populate():
+    proxy = DBProxy()
+    for cls, table_name in [
+        (WorkSpec, db_proxy_module.workTableName),
+        (JobSpec, db_proxy_module.jobTableName),
+        (FileSpec, db_proxy_module.fileTableName),
+        (EventSpec, db_proxy_module.eventTableName),
+        (JobWorkerRelationSpec, db_proxy_module.jobWorkerTableName),
+        (PandaQueueSpec, db_proxy_module.pandaQueueTableName),
+    ]:
+        proxy.make_table(cls, table_name)
+        proxy.execute(f"DELETE FROM {table_name}")
+    proxy.commit()
+    timeOld = core_utils.naive_utcnow() - datetime.timedelta(hours=1)
+    workSpecs, jobSpecs, fileSpecs, relations, queueSpecs = [], [], [], [], []
+    for i in range(nQueues):
+        queueSpec = PandaQueueSpec()
+        queueSpec.queueName = f"QUEUE_{i}"
+        queueSpec.siteName = f"QUEUE_{i}"
+        queueSpec.jobType = "managed"
+        queueSpec.resourceType = "SCORE"
+        queueSpec.nNewWorkers = 0
+        queueSpecs.append(queueSpec)
+    for i in range(1, nWorkers + 1):
+        workSpec = WorkSpec()
+        workSpec.workerID = i
+        workSpec.status = WorkSpec.ST_running
+        workSpec.computingSite = f"QUEUE_{i % nQueues}"
+        workSpec.mapType = WorkSpec.MT_OneToOne
+        workSpec.modificationTime = timeOld
+        workSpecs.append(workSpec)
+        jobSpec = JobSpec()
+        jobSpec.PandaID = i
+        jobSpec.computingSite = workSpec.computingSite
+        jobSpec.status = "running"
+        jobSpec.subStatus = "running"
+        jobSpec.propagatorTime = timeOld
+        jobSpec.jobParams = {"jobPars": "x" * 500}
+        jobSpecs.append(jobSpec)
+        relation = JobWorkerRelationSpec()
+        relation.PandaID = i
+        relation.workerID = i
+        relations.append(relation)
+        for j in range(nFilesPerJob):
+            fileSpec = FileSpec()
+            fileSpec.fileID = i * nFilesPerJob + j
+            fileSpec.PandaID = i
+            fileSpec.lfn = f"EVNT.{i:08d}._{j:06d}.pool.root.1"
+            fileSpec.fileType = "output"
+            fileSpec.status = "defined"
+            fileSpecs.append(fileSpec)
+    for specs, cls, table_name in [
+        (queueSpecs, PandaQueueSpec, db_proxy_module.pandaQueueTableName),
+        (workSpecs, WorkSpec, db_proxy_module.workTableName),
+        (jobSpecs, JobSpec, db_proxy_module.jobTableName),
+        (fileSpecs, FileSpec, db_proxy_module.fileTableName),
+        (relations, JobWorkerRelationSpec, db_proxy_module.jobWorkerTableName),
+    ]:
+        sql = f"INSERT INTO {table_name} ({cls.column_names()}) {cls.bind_values_expression()}"
+        proxy.executemany(sql, [spec.values_list() for spec in specs])
+    proxy.commit()
+    print(f"populated {nWorkers} workers, {nWorkers} jobs, {nWorkers * nFilesPerJob} files in {nQueues} queues")
+
+
+# thread running a role for a given duration
+class RoleThread(threading.Thread):
+    def __init__(self, role, idx, stop_event):
+        threading.Thread.__init__(self)
+        self.role = role
+        self.idx = idx
+        self.stopEvent = stop_event
+        self.proxy = DBProxy(thr_name=f"{role}-{idx}")
+        self.nCycles = 0
+        self.cycleTime = 0.0
+        self.maxCycleTime = 0.0
+
+    def run(self):
+        lockedBy = f"{self.role}-{self.idx}"
+        while not self.stopEvent.is_set():
+            timeStart = time.monotonic()
+            queueName = f"QUEUE_{(self.nCycles * 7 + self.idx) % nQueues}"
+            if self.role == "monitor":
+                # pick up workers and read statistics
+                self.proxy.get_workers_to_update(50, 0, 0, lockedBy)
+                self.proxy.get_worker_stats(queueName)
+            elif self.role == "propagator":
+                # pick up jobs with files
+                self.proxy.get_jobs_to_propagate(50, 0, 0, lockedBy)
+            else:
+                # read statistics and insert new workers
+                self.proxy.get_worker_stats_bulk(None)
+                self.proxy.get_worker_stats(queueName)
+                workSpecs = []
+                for i in range(5):
+                    workSpec = WorkSpec()
+                    workSpec.workerID = next(newWorkerIDs)
+                    workSpec.computingSite = queueName
+                    workSpec.isNew = True
+                    workSpecs.append(workSpec)
+                try:
+                    self.proxy.executemany(
+                        f"INSERT INTO {db_proxy_module.workTableName} ({WorkSpec.column_names()}) {WorkSpec.bind_values_expression()}",
+                        [workSpec.values_list() for workSpec in workSpecs],
+                    )
+                    self.proxy.commit()
+                except Exception:
+                    self.proxy.rollback()
+                    raise
+            cycleTime = time.monotonic() - timeStart
+            self.nCycles += 1
+            self.cycleTime += cycleTime
+            self.maxCycleTime = max(self.maxCycleTime, cycleTime)
+
+
+# run all roles at once
+def run_roles(concurrent_read):
+    harvester_config.db.sqliteConcurrentRead = concurrent_read
+    with db_proxy_module._appLockStatsLock:
+        for key in db_proxy_module._appLockStats:
+            db_proxy_module._appLockStats[key] = 0
+    stopEvent = threading.Event()
+    threads = []
+    for role, nThreads in [("monitor", 3), ("propagator", 2), ("submitter", 2)]:
+        for idx in range(nThreads):
+            threads.append(RoleThread(role, idx, stopEvent))
+    for thr in threads:
+        thr.start()
+    time.sleep(duration)
+    stopEvent.set()
+    for thr in threads:
+        thr.join()
+    print(f"--- sqliteConcurrentRead={concurrent_read} for {duration} sec")
+    for role in ["monitor", "propagator", "submitter"]:
+        roleThreads = [thr for thr in threads if thr.role == role]
+        nCycles = sum(thr.nCycles for thr in roleThreads)
+        cycleTime = sum(thr.cycleTime for thr in roleThreads)
+        maxCycleTime = max(thr.maxCycleTime for thr in roleThreads)
+        print(f"{role:<12} cycles={nCycles:<6} avg={cycleTime * 1e3 / max(nCycles, 1):8.1f} ms  max={maxCycleTime * 1e3:8.1f} ms")
+    lockStats = threads[0].proxy.get_app_lock_stats()
+    print("lock stats   " + " ".join([f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in lockStats.items()]))
+
+
+populate()
+for concurrent_read in [False, True]:
+    run_roles(concurrent_read)
@@ -0,0 +1,150 @@
+"""
+benchmark of DBProxy.update_jobs_workers replaying large reports of event service workers
+
+usage: python updateJobsWorkersBenchmark.py [nEvents]
+Each round reports running events, then finished events with an output file each, and then finished
+events in zipped outputs twice, where the second report adds files associated to the existing zip file
+"""
+
+import sys
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore import db_proxy as db_proxy_module
+from pandaharvester.harvestercore.db_proxy import DBProxy
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.file_spec import FileSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nEvents = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+siteName = "UPDATE_JOBS_WORKERS_BENCHMARK"
+pandaID = 7000000000
+workerID = 7000000000
+lockedBy = "benchmark"
+
+
+# make a job as reported by the monitor
+def make_job():
+    jobSpec = JobSpec()
+    jobSpec.PandaID = pandaID
+    jobSpec.taskID = 1
+    jobSpec.computingSite = siteName
+    jobSpec.status = "running"
+    jobSpec.subStatus = "running"
+    # locked by the monitor
+    jobSpec.lockedBy = lockedBy
+    jobSpec.modificationTime = core_utils.naive_utcnow()
+    return jobSpec
+
+
+# make a job as loaded from DB by the monitor
+def get_job():
+    jobSpec = make_job()
+    jobSpec.reset_changed_list()
+    return jobSpec
+
+
+# make events, with output files if lfn is given
+def add_events(jobSpec, i_start, i_end, event_status, lfn=None, is_zip=None):
+    for i in range(i_start, i_end):
+        eventRangeID = f"{pandaID}-1-{i}-{i}-1"
+        eventSpec = EventSpec()
+        eventSpec.PandaID = pandaID
+        eventSpec.eventRangeID = eventRangeID
+        eventSpec.eventStatus = event_status
+        jobSpec.events.add(eventSpec)
+        if lfn is not None:
+            fileSpec = FileSpec()
+            fileSpec.PandaID = pandaID
+            fileSpec.taskID = 1
+            fileSpec.lfn = lfn.format(i=i)
+            fileSpec.fileType = "es_output"
+            fileSpec.fsize = 1024
+            fileSpec.eventRangeID = eventRangeID
+            fileSpec.isZip = is_zip
+            jobSpec.add_out_file(fileSpec)
+
+
+# insert job and worker
+def populate(proxy):
+    proxy.insert_jobs([make_job()])
+    workSpec = WorkSpec()
+    workSpec.workerID = workerID
+    workSpec.computingSite = siteName
+    workSpec.status = WorkSpec.ST_running
+    workSpec.lockedBy = lockedBy
+    sqlW = f"INSERT INTO {db_proxy_module.workTableName} ({WorkSpec.column_names()}) "
+    sqlW += WorkSpec.bind_values_expression()
+    proxy.execute(sqlW, workSpec.values_list())
+    proxy.commit()
+
+
+# delete job, worker, files, and events
+def clean_up(proxy):
+    varMap = dict()
+    varMap[":PandaID"] = pandaID
+    for tableName in (db_proxy_module.jobTableName, db_proxy_module.fileTableName, db_proxy_module.eventTableName):
+        proxy.execute(f"DELETE FROM {tableName} WHERE PandaID=:PandaID ", varMap)
+    varMap = dict()
+    varMap[":workerID"] = workerID
+    proxy.execute(f"DELETE FROM {db_proxy_module.workTableName} WHERE workerID=:workerID ", varMap)
+    proxy.commit()
+
+
+# report from the worker
+def report(proxy, label, job_spec):
+    workSpec = WorkSpec()
+    workSpec.workerID = workerID
+    workSpec.lockedBy = lockedBy
+    workSpec.reset_changed_list()
+    workSpec.status = WorkSpec.ST_running
+    # lock the worker as the monitor does
+    varMap = dict()
+    varMap[":workerID"] = workerID
+    varMap[":lockedBy"] = lockedBy
+    proxy.execute(f"UPDATE {db_proxy_module.workTableName} SET lockedBy=:lockedBy WHERE workerID=:workerID ", varMap)
+    proxy.commit()
+    timeStart = time.perf_counter()
+    retVal = proxy.update_jobs_workers([job_spec], [workSpec], lockedBy)
+    print(f"{label:<50} {time.perf_counter() - timeStart:8.3f} sec ret={retVal}")
+
+
+# check that events point to files with the same eventRangeID
+def check(proxy):
+    varMap = dict()
+    varMap[":PandaID"] = pandaID
+    proxy.execute(f"SELECT COUNT(*) FROM {db_proxy_module.fileTableName} WHERE PandaID=:PandaID ", varMap)
+    (nFiles,) = proxy.cur.fetchone()
+    sql = f"SELECT e.eventRangeID,f.eventRangeID FROM {db_proxy_module.eventTableName} e "
+    sql += f"LEFT JOIN {db_proxy_module.fileTableName} f ON f.fileID=e.fileID WHERE e.PandaID=:PandaID "
+    proxy.execute(sql, varMap)
+    resE = proxy.cur.fetchall()
+    nGood = len([1 for eventRangeID, fileEventRangeID in resE if eventRangeID == fileEventRangeID])
+    proxy.commit()
+    print(f"{nFiles} files, {len(resE)} events, {nGood} events associated to files with the same eventRangeID")
+
+
+if __name__ == "__main__":
+    proxy = DBProxy()
+    clean_up(proxy)
+    populate(proxy)
+    try:
+        print(f"=== {nEvents} events per report, DB engine={harvester_config.db.engine}")
+        jobSpec = get_job()
+        add_events(jobSpec, 0, nEvents, "running")
+        report(proxy, "running events", jobSpec)
+        jobSpec = get_job()
+        add_events(jobSpec, 0, nEvents, "finished", lfn="EVNT.{i:08d}.pool.root")
+        report(proxy, "finished events with output files", jobSpec)
+        jobSpec = get_job()
+        add_events(jobSpec, nEvents, 2 * nEvents, "finished", lfn="zip.0.tar", is_zip=1)
+        report(proxy, "finished events with new zip file", jobSpec)
+        jobSpec = get_job()
+        add_events(jobSpec, 2 * nEvents, 3 * nEvents, "finished", lfn="zip.0.tar", is_zip=1)
+        report(proxy, "finished events associated to existing zip file", jobSpec)
+        check(proxy)
+    finally:
+        clean_up(proxy)
@@ -0,0 +1,97 @@
+"""
+benchmark of zip making with the tar command and with the native streaming archiver of BaseZipper
+
+usage: python zipperBenchmark.py [workDir] [nSmallFiles] [smallFileSizeKB] [nLargeFiles] [largeFileSizeMB]
+e.g. python zipperBenchmark.py /tmp/zipbench 5000 16 2 4096 for a few multi-GB files
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import time
+import uuid
+
+from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvesterzipper.base_zipper import BaseZipper
+
+workDir = sys.argv[1] if len(sys.argv) > 1 else "/tmp/zipper_benchmark"
+nSmallFiles = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+smallFileSizeKB = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+nLargeFiles = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+largeFileSizeMB = int(sys.argv[5]) if len(sys.argv) > 5 else 512
+
+
+# make input files
+def make_files(sub_dir, n_files, file_size):
+    dirPath = os.path.join(workDir, sub_dir)
+    os.makedirs(dirPath, exist_ok=True)
+    fileList = []
+    blockSize = 8 * 1024 * 1024
+    for i in range(n_files):
+        filePath = os.path.join(dirPath, f"EVNT.{i:08d}.pool.root.1")
+        with open(filePath, "wb") as f:
+            nLeft = file_size
+            while nLeft > 0:
+                f.write(os.urandom(min(blockSize, nLeft)))
+                nLeft -= blockSize
+        fileList.append(filePath)
+    return fileList
+
+
+# make zip with the tar command and then read it again for checksum
+def zip_with_command(zip_path, file_list):
+    listPath = zip_path + ".in"
+    with open(listPath, "w") as f:
+        for filePath in file_list:
+            f.write(f"{filePath}\n")
+    com = f"tar -c -f {zip_path} -T {listPath} --transform 's/.*\\///'"
+    subprocess.check_call(com, shell=True)
+    os.remove(listPath)
+    return os.stat(zip_path).st_size, core_utils.calc_adler32(zip_path)
+
+
+# make zip with the native archiver
+def zip_native(zipper, zip_path, file_list):
+    return zipper.write_tar_stream(zip_path, file_list)
+
+
+# measure
+def measure(label, func, file_list, ref_members):
+    zipPath = os.path.join(workDir, f"bench.{uuid.uuid4()}.tar")
+    # drop dirty pages of previous runs so that runs do not interfere
+    os.sync()
+    timeStart = time.perf_counter()
+    fsize, chksum = func(zipPath, file_list)
+    os.sync()
+    timeConsumed = time.perf_counter() - timeStart
+    # validate
+    assert fsize == os.stat(zipPath).st_size, f"wrong size {fsize}"
+    assert chksum == core_utils.calc_adler32(zipPath), f"wrong checksum {chksum}"
+    with tarfile.open(zipPath) as tar:
+        members = [(member.name, member.size) for member in tar.getmembers()]
+    assert members == ref_members, "wrong members"
+    os.remove(zipPath)
+    totalSize = sum([member[1] for member in members])
+    print(f"{label:<28} {timeConsumed:8.3f} sec {totalSize / timeConsumed / 2**20:9.1f} MB/s")
+
+
+# run benchmarks for a set of files
+def run(title, file_list):
+    print(f"=== {title}: {len(file_list)} files")
+    refMembers = [(os.path.basename(filePath), os.stat(filePath).st_size) for filePath in file_list]
+    zipper = BaseZipper()
+    zipperZeroCopy = BaseZipper(useZeroCopy=True)
+    measure("tar command + adler32", zip_with_command, file_list, refMembers)
+    measure("native", lambda zip_path, files: zip_native(zipper, zip_path, files), file_list, refMembers)
+    measure("native with zero copy", lambda zip_path, files: zip_native(zipperZeroCopy, zip_path, files), file_list, refMembers)
+
+
+if __name__ == "__main__":
+    os.makedirs(workDir, exist_ok=True)
+    try:
+        run(f"small files of {smallFileSizeKB} KB", make_files("small", nSmallFiles, smallFileSizeKB * 1024))
+        run(f"large files of {largeFileSizeMB} MB", make_files("large", nLargeFiles, largeFileSizeMB * 1024 * 1024))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
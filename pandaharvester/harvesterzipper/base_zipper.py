@@ -1,10 +1,17 @@
+import functools
 import gc
+import grp
 import multiprocessing
 import os
+import pwd
+import stat
+import struct
 import subprocess
+import tarfile
 import tempfile
 import time
 import uuid
+import zlib
 from concurrent.futures import ThreadPoolExecutor as Pool
 
 from pandaharvester.harvesterconfig import harvester_config
@@ -12,6 +19,80 @@ from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
 
 
+# get user name for tar headers
+@functools.lru_cache(maxsize=64)
+def _get_user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name.encode("utf-8", "surrogateescape")
+    except KeyError:
+        return b""
+
+
+# get group name for tar headers
+@functools.lru_cache(maxsize=64)
+def _get_group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name.encode("utf-8", "surrogateescape")
+    except KeyError:
+        return b""
+
+
+# max values of numeric fields in ustar headers
+_maxTarIdValue = 8**7
+_maxTarSizeValue = 8**11
+
+# layout of ustar header
+_tarHeaderStruct = struct.Struct("100s8s8s8s12s12s8s1s100s8s32s32s8s8s155s12s")
+
+
+# make tar header of a regular file. Raw headers are packed for usual files since TarInfo.tobuf is slow for many small files
+def _make_tar_header(name, stat_info):
+    mode = stat.S_IMODE(stat_info.st_mode)
+    mtime = int(stat_info.st_mtime)
+    nameBytes = name.encode("utf-8", "surrogateescape")
+    uname = _get_user_name(stat_info.st_uid)
+    gname = _get_group_name(stat_info.st_gid)
+    if (
+        len(nameBytes) >= 100
+        or len(uname) >= 32
+        or len(gname) >= 32
+        or not 0 <= stat_info.st_uid < _maxTarIdValue
+        or not 0 <= stat_info.st_gid < _maxTarIdValue
+        or stat_info.st_size >= _maxTarSizeValue
+        or not 0 <= mtime < _maxTarSizeValue
+    ):
+        # long names and large numbers need GNU extensions
+        tarInfo = tarfile.TarInfo(name)
+        tarInfo.size = stat_info.st_size
+        tarInfo.mtime = mtime
+        tarInfo.mode = mode
+        tarInfo.uid = stat_info.st_uid
+        tarInfo.gid = stat_info.st_gid
+        tarInfo.uname = uname.decode("utf-8", "surrogateescape")
+        tarInfo.gname = gname.decode("utf-8", "surrogateescape")
+        return tarInfo.tobuf(format=tarfile.GNU_FORMAT, encoding="utf-8", errors="surrogateescape")
+    header = _tarHeaderStruct.pack(
+        nameBytes,
+        b"%07o\0" % mode,
+        b"%07o\0" % stat_info.st_uid,
+        b"%07o\0" % stat_info.st_gid,
+        b"%011o\0" % stat_info.st_size,
+        b"%011o\0" % mtime,
+        b" " * 8,
+        tarfile.REGTYPE,
+        b"",
+        tarfile.GNU_MAGIC,
+        uname,
+        gname,
+        b"",
+        b"",
+        b"",
+        b"",
+    )
+    # checksum is calculated with the checksum field filled with spaces
+    return header[:148] + b"%06o\0" % sum(header) + header[155:]
+
+
 # base class for zipper plugin
 class BaseZipper(PluginBase):
     # constructor
@@ -19,6 +100,12 @@ class BaseZipper(PluginBase):
         self.zipDir = "${SRCDIR}"
         self.zip_tmp_log = None
         self.zip_jobSpec = None
+        # write tar archives in python instead of the tar command, computing size and checksum on the fly
+        self.useNativeTar = False
+        # buffer size in bytes to read file bodies
+        self.zipBufferSize = 8 * 1024 * 1024
+        # copy file bodies in the kernel with copy_file_range/sendfile when using native tar
+        self.useZeroCopy = False
         PluginBase.__init__(self, **kwarg)
 
     # zip output files
@@ -84,24 +171,36 @@ class BaseZipper(PluginBase):
             lfn = os.path.basename(zipPath)
             self.zip_tmp_log.debug(f"{lfn} start zipPath={zipPath} with {len(arg_dict['associatedFiles'])} files")
             # make zip if doesn't exist
+            zipInfo = None
             if not os.path.exists(zipPath):
                 # tmp file names
                 tmpZipPath = zipPath + "." + str(uuid.uuid4())
-                tmpZipPathIn = tmpZipPath + ".in"
-                with open(tmpZipPathIn, "w") as f:
-                    for associatedFile in arg_dict["associatedFiles"]:
-                        f.write(f"{associatedFile}\n")
-                # make command
-                com = f"tar -c -f {tmpZipPath} -T {tmpZipPathIn} "
-                com += "--transform 's/.*\///' "
-                # execute
-                p = subprocess.Popen(com, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                stdOut, stdErr = p.communicate()
-                retCode = p.returncode
-                if retCode != 0:
-                    msgStr = f"failed to make zip for {lfn} with {stdOut}:{stdErr}"
-                    self.zip_tmp_log.error(msgStr)
-                    return None, msgStr, {}
+                if self.useNativeTar:
+                    # write archive in one pass
+                    try:
+                        zipInfo = self.write_tar_stream(tmpZipPath, arg_dict["associatedFiles"])
+                    except Exception as e:
+                        if os.path.exists(tmpZipPath):
+                            os.remove(tmpZipPath)
+                        msgStr = f"failed to make zip for {lfn} with {e.__class__.__name__}:{e}"
+                        self.zip_tmp_log.error(msgStr)
+                        return None, msgStr, {}
+                else:
+                    tmpZipPathIn = tmpZipPath + ".in"
+                    with open(tmpZipPathIn, "w") as f:
+                        for associatedFile in arg_dict["associatedFiles"]:
+                            f.write(f"{associatedFile}\n")
+                    # make command
+                    com = f"tar -c -f {tmpZipPath} -T {tmpZipPathIn} "
+                    com += "--transform 's/.*\///' "
+                    # execute
+                    p = subprocess.Popen(com, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    stdOut, stdErr = p.communicate()
+                    retCode = p.returncode
+                    if retCode != 0:
+                        msgStr = f"failed to make zip for {lfn} with {stdOut}:{stdErr}"
+                        self.zip_tmp_log.error(msgStr)
+                        return None, msgStr, {}
                 # avoid overwriting
                 lockName = f"zip.lock.{lfn}"
                 lockInterval = 60
@@ -119,21 +218,100 @@ class BaseZipper(PluginBase):
                     return None, msgStr
                 if not os.path.exists(zipPath):
                     os.rename(tmpZipPath, zipPath)
+                else:
+                    # made by another thread
+                    zipInfo = None
                 # release lock
                 self.dbInterface.release_object_lock(lockName)
             # make return
             fileInfo = dict()
             fileInfo["path"] = zipPath
-            # get size
-            statInfo = os.stat(zipPath)
-            fileInfo["fsize"] = statInfo.st_size
-            fileInfo["chksum"] = core_utils.calc_adler32(zipPath)
+            if zipInfo is not None:
+                # size and checksum computed while writing
+                fileInfo["fsize"], fileInfo["chksum"] = zipInfo
+            else:
+                # get size
+                statInfo = os.stat(zipPath)
+                fileInfo["fsize"] = statInfo.st_size
+                fileInfo["chksum"] = core_utils.calc_adler32(zipPath)
         except Exception:
             errMsg = core_utils.dump_error_message(self.zip_tmp_log)
             return False, f"failed to zip with {errMsg}"
         self.zip_tmp_log.debug(f"{lfn} done")
         return True, "", fileInfo
 
+    # write tar archive of files in one pass, and return size and adler32 of the archive
+    def write_tar_stream(self, zip_path, file_list):
+        bufSize = max(self.zipBufferSize, tarfile.BLOCKSIZE)
+        buf = bytearray(bufSize)
+        bufView = memoryview(buf)
+        chksum = 1
+        fsize = 0
+        with open(zip_path, "wb", buffering=0) as zipFile:
+            # write data and update size and checksum
+            def write_data(data):
+                nonlocal chksum, fsize
+                zipFile.write(data)
+                chksum = zlib.adler32(data, chksum)
+                fsize += len(data)
+
+            for filePath in file_list:
+                with open(filePath, "rb", buffering=0) as srcFile:
+                    statInfo = os.fstat(srcFile.fileno())
+                    if not stat.S_ISREG(statInfo.st_mode):
+                        raise RuntimeError(f"{filePath} is not a regular file")
+                    # header with the base name like tar --transform 's/.*\///'
+                    write_data(_make_tar_header(os.path.basename(filePath), statInfo))
+                    # body
+                    nLeft = statInfo.st_size
+                    if self.useZeroCopy and nLeft > bufSize:
+                        # copy in the kernel and then checksum the source which is likely in the page cache
+                        nLeft -= self._copy_file_body(srcFile.fileno(), zipFile.fileno(), nLeft)
+                        srcFile.seek(0)
+                        nRead = 0
+                        while nRead < statInfo.st_size - nLeft:
+                            nBytes = srcFile.readinto(bufView[: min(bufSize, statInfo.st_size - nLeft - nRead)])
+                            if not nBytes:
+                                raise RuntimeError(f"{filePath} was truncated while zipping")
+                            chksum = zlib.adler32(bufView[:nBytes], chksum)
+                            nRead += nBytes
+                        fsize += nRead
+                    while nLeft > 0:
+                        nBytes = srcFile.readinto(bufView[: min(bufSize, nLeft)])
+                        if not nBytes:
+                            raise RuntimeError(f"{filePath} was truncated while zipping")
+                        write_data(bufView[:nBytes])
+                        nLeft -= nBytes
+                    # pad to the block boundary
+                    remainder = statInfo.st_size % tarfile.BLOCKSIZE
+                    if remainder > 0:
+                        write_data(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            # end-of-archive marker and padding to the record size as the tar command does
+            write_data(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+            remainder = fsize % tarfile.RECORDSIZE
+            if remainder > 0:
+                write_data(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+        if chksum < 0:
+            chksum += 2**32
+        return fsize, hex(chksum)[2:10].zfill(8).lower()
+
+    # copy file body in the kernel and return the number of bytes copied
+    def _copy_file_body(self, src_fd, dst_fd, n_bytes):
+        nCopied = 0
+        while nCopied < n_bytes:
+            try:
+                if hasattr(os, "copy_file_range"):
+                    nBytes = os.copy_file_range(src_fd, dst_fd, n_bytes - nCopied)
+                else:
+                    nBytes = os.sendfile(dst_fd, src_fd, None, n_bytes - nCopied)
+            except OSError:
+                # not supported for the file systems. The rest is copied in user space
+                break
+            if nBytes == 0:
+                break
+            nCopied += nBytes
+        return nCopied
+
     # zip output files; file operations are done on remote side with ssh
     def ssh_zip_output(self, jobspec, tmp_log):
         tmp_log.debug("start")